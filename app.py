@@ -1,5 +1,22 @@
-from flask import Flask, request, jsonify
+import json
+import hmac
+import threading
+import psycopg2
+from flask import Flask, Response, request, jsonify
 from pipeline import handle_query, reset_conversation
+from renderer import RESPONSE_MODES
+from llm_backends import get_pool
+from resilience import Deadline, RequestCancelled
+from structured_logging import request_scope, safe_request_id
+from profiling import profile_request, parse_mode
+from fetch_sql import QueryStream, DATABASES, STREAMING_FORMATS, format_chunks, build_export_query
+from batch import run_batch
+from db_utils import database_status
+from shared_results import SharedResults
+from session_store import get_session_manager
+from config import (REQUEST_DEADLINE, CHAT_HEARTBEAT_SECONDS, BATCH_MAX_WORKERS, BATCH_MAX_QUERIES,
+                    EXPORT_API_TOKEN, PROFILE_API_TOKEN)
+import metrics
 
 app = Flask(__name__)
 
@@ -15,22 +32,200 @@ def chat():
         if not query:
             return jsonify({"error": "Query is required"}), 400
 
-        response = handle_query(query)
-        return jsonify({
-            "response": response,
-            "status": "success"
-        })
+        response_mode = data.get("response_mode")
+        if response_mode and response_mode not in RESPONSE_MODES:
+            return jsonify({"error": f"response_mode must be one of {', '.join(RESPONSE_MODES)}"}), 400
+
+        # Conversations with a session id survive restarts and can land on any worker
+        session_id = data.get("session_id")
+        if session_id is not None and (not isinstance(session_id, str) or not session_id.strip()):
+            return jsonify({"error": "session_id must be a non-empty string"}), 400
+
+        # Opt-in profiling via the X-Profile header or a "profile" flag, for trusted callers
+        # only when PROFILE_API_TOKEN is set
+        try:
+            profile_mode = parse_mode(request.headers.get("X-Profile") or data.get("profile"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if profile_mode and PROFILE_API_TOKEN and not hmac.compare_digest(
+                request.headers.get("X-Profile-Token", "").encode(), PROFILE_API_TOKEN.encode()):
+            return jsonify({"error": "Profiling needs a valid X-Profile-Token"}), 403
+
+        deadline = Deadline(REQUEST_DEADLINE)
+        # Anything but a plain token (e.g. a path) is replaced by a generated id
+        request_id = safe_request_id(request.headers.get("X-Request-ID"))
+        outcome = {}
+
+        def run():
+            with request_scope(request_id):
+                try:
+                    sessions = get_session_manager() if session_id else None
+                    manager = sessions.get(session_id) if sessions else None
+                    if profile_mode:
+                        with profile_request(profile_mode, request_id) as profile:
+                            response = handle_query(query, response_mode=response_mode, deadline=deadline,
+                                                    manager=manager)
+                        outcome["payload"] = chat_payload(response, response_mode, request_id)
+                        outcome["payload"]["profile"] = profile.summary()
+                    else:
+                        response = handle_query(query, response_mode=response_mode, deadline=deadline,
+                                                manager=manager)
+                        outcome["payload"] = chat_payload(response, response_mode, request_id)
+                    if sessions:
+                        # Written behind, off the request path
+                        sessions.save(session_id, manager)
+                        outcome["payload"]["session_id"] = session_id
+                except RequestCancelled:
+                    outcome["cancelled"] = True
+                except Exception as e:
+                    outcome["error"] = str(e)
+
+        worker = threading.Thread(target=run, name="chat-request", daemon=True)
+        worker.start()
+        worker.join(CHAT_HEARTBEAT_SECONDS)
+
+        # Fast answers go out as a normal JSON response
+        if not worker.is_alive():
+            if "error" in outcome:
+                return jsonify({"error": outcome["error"], "status": "error"}), 500
+            return jsonify(outcome["payload"])
+
+        # Slow ones stream whitespace heartbeats first; a failed write means the
+        # client disconnected and the LLM generation and SQL query get cancelled.
+        # The 200 status is already sent by then, so failures are only marked
+        # by "status": "error" in the body
+        def stream():
+            try:
+                while worker.is_alive():
+                    yield " "
+                    worker.join(CHAT_HEARTBEAT_SECONDS)
+                if "error" in outcome:
+                    yield json.dumps({"error": outcome["error"], "status": "error", "request_id": request_id})
+                elif "payload" in outcome:
+                    yield json.dumps(outcome["payload"])
+                else:
+                    yield json.dumps({"error": "Request cancelled", "status": "error", "request_id": request_id})
+            finally:
+                if worker.is_alive():
+                    deadline.cancel("client disconnected")
+
+        return Response(stream(), mimetype="application/json")
     except Exception as e:
         return jsonify({
             "error": str(e),
             "status": "error"
         }), 500
 
+def chat_payload(response, response_mode=None, request_id=None):
+    """Response body for /chat"""
+    payload = {
+        "response": response,
+        "status": "success",
+        "request_id": request_id
+    }
+
+    # JSON mode returns the rendered data as an object for API clients
+    if response_mode == "json":
+        try:
+            payload["data"] = json.loads(response)
+        except ValueError:
+            pass
+
+    return payload
+
+@app.route("/chat/batch", methods=["POST"])
+def chat_batch():
+    """Answer a list of independent queries concurrently"""
+    data = request.json
+    if not data:
+        return jsonify({"error": "JSON body required"}), 400
+
+    queries = data.get("queries")
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({"error": "queries must be a non-empty list of strings"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {BATCH_MAX_QUERIES} queries per batch"}), 400
+
+    response_mode = data.get("response_mode")
+    if response_mode and response_mode not in RESPONSE_MODES:
+        return jsonify({"error": f"response_mode must be one of {', '.join(RESPONSE_MODES)}"}), 400
+
+    max_workers = data.get("max_workers", BATCH_MAX_WORKERS)
+    if isinstance(max_workers, bool) or not isinstance(max_workers, int) or max_workers < 1:
+        return jsonify({"error": "max_workers must be a positive integer"}), 400
+    max_workers = min(max_workers, BATCH_MAX_WORKERS)
+    shared = SharedResults()
+    results = run_batch(queries, response_mode, max_workers, shared)
+
+    # Streamed as NDJSON in completion order, the last line carries the stats
+    if data.get("stream"):
+        def generate():
+            for result in results:
+                yield json.dumps(result) + "\n"
+            yield json.dumps({"status": "done", "count": len(queries), "stats": shared.stats()}) + "\n"
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    return jsonify({
+        "results": sorted(results, key=lambda r: r["index"]),
+        "stats": shared.stats(),
+        "status": "success"
+    })
+
+@app.route("/export", methods=["POST"])
+def export():
+    """Stream the rows of a table as CSV or NDJSON, optionally only some columns and
+    the rows matching equality filters"""
+    if not EXPORT_API_TOKEN:
+        return jsonify({"error": "Export is disabled", "status": "error"}), 403
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {EXPORT_API_TOKEN}".encode()):
+        return jsonify({"error": "Export needs a valid bearer token", "status": "error"}), 401
+
+    data = request.json
+    if not data:
+        return jsonify({"error": "JSON body required"}), 400
+    if "sql" in data:
+        return jsonify({"error": "SQL is not accepted, select a table, columns and filters", "status": "error"}), 400
+
+    database = data.get("db", "scop3p")
+    fmt = data.get("format", "csv")
+    if database not in DATABASES:
+        return jsonify({"error": f"db must be one of {', '.join(sorted(DATABASES))}"}), 400
+    if fmt not in STREAMING_FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(STREAMING_FORMATS)}"}), 400
+
+    # Runs the query and fetches the first chunk, so an unknown column is still a 400
+    try:
+        query, params = build_export_query(database, data.get("table"), data.get("columns"),
+                                           data.get("filters"), data.get("order_by"))
+        stream = QueryStream(database, query, params=params)
+    except ValueError as e:
+        return jsonify({"error": str(e), "status": "error"}), 400
+    except psycopg2.Error as e:
+        return jsonify({"error": str(e).strip(), "status": "error"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e), "status": "error"}), 500
+
+    def generate():
+        # Closing the generator on disconnect closes the cursor's connection
+        try:
+            yield from format_chunks(fmt, stream.columns, stream.chunks())
+        finally:
+            stream.close()
+
+    return Response(generate(), mimetype=STREAMING_FORMATS[fmt], headers={
+        "Content-Disposition": f"attachment; filename={database}_export.{fmt}"
+    })
+
 @app.route("/reset", methods=["POST"])
 def reset():
-    """Reset conversation state"""
+    """Reset conversation state, of one session if a session_id is given"""
     try:
-        reset_conversation()
+        session_id = (request.get_json(silent=True) or {}).get("session_id")
+        if session_id:
+            get_session_manager().reset(session_id)
+        else:
+            reset_conversation()
         return jsonify({
             "message": "Conversation reset successfully",
             "status": "success"
@@ -46,7 +241,10 @@ def health():
     """Health check endpoint"""
     return jsonify({
         "status": "healthy",
-        "service": "Scop3P And Scop3PTM Chatbot"
+        "service": "Scop3P And Scop3PTM Chatbot",
+        "llm_backends": get_pool().status(),
+        "databases": database_status(),
+        "metrics": metrics.snapshot()
     })
 
 # Quick test endpoint for debugging
@@ -0,0 +1,92 @@
+# batch.py - run many independent questions concurrently
+import sys
+import json
+import time
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional
+from pipeline import handle_query
+from conversation_manager import ConversationManager
+from renderer import RESPONSE_MODES
+from shared_results import SharedResults, use_shared_results
+from resilience import Deadline
+from structured_logging import setup_logging
+from config import BATCH_MAX_WORKERS, REQUEST_DEADLINE
+
+logger = logging.getLogger(__name__)
+
+def run_batch(queries: List[str], response_mode: Optional[str] = None, max_workers: int = BATCH_MAX_WORKERS,
+              shared: Optional[SharedResults] = None) -> Iterator[Dict]:
+    """Answer independent queries concurrently, each with its own conversation state,
+    yielding results in completion order; identical LLM calls and SQL are shared"""
+    shared = shared or SharedResults()
+    deadlines = []
+
+    def run_one(index, query):
+        deadline = Deadline(REQUEST_DEADLINE)
+        deadlines.append(deadline)
+        result = {"index": index, "query": query}
+        with use_shared_results(shared):
+            try:
+                result["response"] = handle_query(query, response_mode, deadline=deadline,
+                                                  manager=ConversationManager(max_history=4))
+                result["status"] = "success"
+            except Exception as e:
+                logger.error(f"Batch query {index} failed: {e}")
+                result["error"] = str(e)
+                result["status"] = "error"
+        result["elapsed"] = round(deadline.elapsed(), 3)
+        return result
+
+    logger.info(f"Running batch of {len(queries)} queries with {max_workers} workers")
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+    futures = [executor.submit(run_one, i, query) for i, query in enumerate(queries)]
+    try:
+        for future in as_completed(futures):
+            yield future.result()
+    finally:
+        # Stopped early (e.g. the client went away): drop queued queries, cancel running ones
+        executor.shutdown(wait=False, cancel_futures=True)
+        for deadline in deadlines:
+            deadline.cancel("batch stopped")
+        logger.info(f"Batch finished, {shared.stats()}")
+
+def read_queries(path: str) -> List[str]:
+    """Queries from a JSON list or a text file with one query per line"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        return [str(q) for q in json.loads(text) if str(q).strip()]
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Answer a file of independent questions")
+    parser.add_argument("queries", help="Text file with one question per line, or a JSON list")
+    parser.add_argument("--workers", type=int, default=BATCH_MAX_WORKERS)
+    parser.add_argument("--mode", choices=RESPONSE_MODES)
+    parser.add_argument("--output", "-o", help="NDJSON output file, stdout if omitted")
+    args = parser.parse_args(argv)
+
+    # Keep stderr for progress, the pipeline logs go to chatbot.log
+    setup_logging(console=False, force=True)
+    queries = read_queries(args.queries)
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    shared = SharedResults()
+    started = time.monotonic()
+    try:
+        for done, result in enumerate(run_batch(queries, args.mode, args.workers, shared), 1):
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            print(f"[{done}/{len(queries)}] {result['status']} in {result['elapsed']:.1f}s: {result['query']}",
+                  file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+
+    print(f"Answered {len(queries)} queries in {time.monotonic() - started:.1f}s ({shared.stats()})",
+          file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
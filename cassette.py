@@ -0,0 +1,212 @@
+# cassette.py - record/replay of LLM generations and SQL results
+import os
+import sys
+import copy
+import functools
+import gzip
+import json
+import time
+import logging
+import argparse
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, List, Optional
+from shared_results import result_key
+from result_set import ResultSet, json_default
+from config import CASSETTE_DIR
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_MODES = ("record", "replay")
+
+class CassetteMiss(Exception):
+    """A replayed call that was never recorded"""
+
+class Cassette:
+    """query_llm and run_sql responses keyed by a hash of the prompt or SQL and
+    its options. Record mode calls through and keeps the response and latency,
+    replay mode serves them back and never touches the services"""
+
+    def __init__(self, path: str, mode: str = "replay", latency_scale: float = 0.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of {', '.join(CASSETTE_MODES)}")
+        self.path = path
+        self.mode = mode
+        # 1.0 replays recorded latencies as they were, 0 as fast as possible
+        self.latency_scale = latency_scale
+        self.entries: Dict[str, Dict] = {}
+        self.misses: List[str] = []
+        self.hits = 0
+        self.recorded = 0
+        self.simulated_latency = 0.0
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self.entries = self._read(path)
+        elif mode == "replay":
+            raise FileNotFoundError(f"No cassette at {path}, record one first")
+
+    @staticmethod
+    def _read(path: str) -> Dict[str, Dict]:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            return json.load(f)["entries"]
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        opener = gzip.open if self.path.endswith(".gz") else open
+        with self._lock:
+            data = {"version": 1, "entries": dict(sorted(self.entries.items()))}
+        with opener(self.path, "wt", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"), default=str)
+
+    def call(self, kind: str, label: str, parts: tuple, request: str, compute: Callable[[], Any]):
+        """Response for a call, recorded or replayed according to the mode"""
+        key = result_key(kind, *parts)
+        with self._lock:
+            entry = self.entries.get(key)
+
+        if self.mode == "replay":
+            if entry is None:
+                miss = f"{kind} {label}: {request[:120]!r}"
+                with self._lock:
+                    self.misses.append(miss)
+                raise CassetteMiss(f"Not in cassette {self.path}: {miss}")
+            delay = entry.get("latency", 0.0) * self.latency_scale
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self.hits += 1
+                self.simulated_latency += delay
+            return _decode(entry["response"])
+
+        started = time.perf_counter()
+        value = compute()
+        with self._lock:
+            self.entries[key] = {
+                "kind": kind,
+                "label": label,
+                "request": request[:300],
+                "response": _encode(value),
+                "latency": round(time.perf_counter() - started, 4)
+            }
+            self.recorded += 1
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"mode": self.mode, "entries": len(self.entries), "hits": self.hits,
+                    "recorded": self.recorded, "misses": len(self.misses),
+                    "simulated_latency": round(self.simulated_latency, 4)}
+
+def _encode(value):
+    # Stored as JSON, so dates replay as ISO strings and decimals as numbers
+    if isinstance(value, ResultSet):
+        return {"result_set": json.loads(json.dumps(value.to_compact(), default=json_default))}
+    return json.loads(json.dumps(value, default=json_default))
+
+def _decode(response):
+    if isinstance(response, dict) and set(response) == {"result_set"}:
+        return ResultSet.from_compact(response["result_set"])
+    # Callers may modify what they get back
+    return copy.deepcopy(response)
+
+# Process-wide, so batch workers and request threads see it too
+_active: Optional[Cassette] = None
+
+def current_cassette() -> Optional[Cassette]:
+    return _active
+
+@contextmanager
+def use_cassette(path: str, mode: str = "replay", latency_scale: float = 0.0, strict: bool = True):
+    """Record or replay every query_llm and run_sql call made in this block.
+    Record mode saves the cassette on exit. In replay mode a miss raises at the
+    call, and again on exit when strict, in case the pipeline swallowed it"""
+    global _active
+    cassette = Cassette(path, mode, latency_scale)
+    previous, _active = _active, cassette
+    try:
+        yield cassette
+    finally:
+        _active = previous
+        if mode == "record":
+            cassette.save()
+        logger.info(f"Cassette {path}: {cassette.stats()}")
+    if strict and cassette.misses:
+        raise CassetteMiss(f"{len(cassette.misses)} calls not in cassette {path}:\n  " +
+                           "\n  ".join(cassette.misses))
+
+def script_cassette(name: str, directory: str = CASSETTE_DIR):
+    """Cassette for a test script, chosen by the CHATBOT_CASSETTE environment
+    variable ("record", "replay" or "off"). Unset, a recorded cassette is
+    replayed and a script without one talks to the live services"""
+    path = os.path.join(directory, f"{name}.json.gz")
+    mode = os.environ.get("CHATBOT_CASSETTE", "").strip().lower()
+    if not mode:
+        mode = "replay" if os.path.exists(path) else "off"
+    if mode == "off":
+        return nullcontext()
+    latency_scale = float(os.environ.get("CHATBOT_CASSETTE_LATENCY", "0") or 0)
+    return use_cassette(path, mode, latency_scale)
+
+def recorded(name: str, directory: str = CASSETTE_DIR):
+    """Decorator running a test function inside script_cassette(name)"""
+    def decorate(test):
+        @functools.wraps(test)
+        def run(*args, **kwargs):
+            with script_cassette(name, directory):
+                return test(*args, **kwargs)
+        return run
+    return decorate
+
+def benchmark(path: str, queries: List[str], latency_scale: float = 0.0, response_mode: Optional[str] = None):
+    """Replay a recorded session to time the pipeline's own work: LLM and SQL
+    answers come from the cassette, so what's left is Python-side overhead"""
+    from pipeline import handle_query, reset_conversation
+
+    timings = []
+    with use_cassette(path, "replay", latency_scale) as cassette:
+        for query in queries:
+            reset_conversation()
+            started = time.perf_counter()
+            handle_query(query, response_mode)
+            timings.append(time.perf_counter() - started)
+    total = sum(timings)
+    return {
+        "queries": len(queries),
+        "total_seconds": round(total, 4),
+        "mean_seconds": round(total / max(len(queries), 1), 4),
+        "max_seconds": round(max(timings, default=0.0), 4),
+        "overhead_seconds": round(total - cassette.simulated_latency, 4),
+        **cassette.stats()
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect cassettes or replay them as a benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    stats_cmd = commands.add_parser("stats", help="Count the recorded calls per kind and label")
+    stats_cmd.add_argument("cassette")
+    bench_cmd = commands.add_parser("bench", help="Replay a cassette and time the pipeline")
+    bench_cmd.add_argument("cassette")
+    bench_cmd.add_argument("queries", help="Text file with one question per line, or a JSON list")
+    bench_cmd.add_argument("--latency", type=float, default=0.0, help="Scale of recorded latencies to replay")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        counts: Dict[str, int] = {}
+        for entry in Cassette._read(args.cassette).values():
+            name = f"{entry['kind']} {entry['label']}"
+            counts[name] = counts.get(name, 0) + 1
+        for name, count in sorted(counts.items()):
+            print(f"{count:6d}  {name}")
+        return 0
+
+    from batch import read_queries
+    from structured_logging import setup_logging
+    setup_logging(console=False, force=True)
+    print(json.dumps(benchmark(args.cassette, read_queries(args.queries), args.latency), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,22 +1,19 @@
 import sys
 import os
-import logging
 
-logging.getLogger().setLevel(logging.CRITICAL)
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
+sys.path.append('.')
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chatbot.log', mode='a')
-    ]
-)
+from structured_logging import setup_logging
 
-sys.path.append('.')
+# Log to chatbot.log only, keeping the console for the conversation
+setup_logging(console=False, force=True)
 
 from pipeline import handle_query, reset_conversation, configure_conversation
+from renderer import RESPONSE_MODES
+from structured_logging import request_scope
+from profiling import profile_request, PROFILE_MODES
+
+response_mode = None
 
 def print_separator():
     print("=" * 60)
@@ -33,6 +30,8 @@ def show_help():
 Available commands:
   /help     - Show this help message
   /reset    - Reset conversation context
+  /mode     - Set response mode (auto, prose, table, json)
+  /profile  - Profile one question: /profile [sampling|cprofile] <question>
   /quit     - Exit the chat
   /test     - Run a quick test conversation
   
@@ -66,7 +65,39 @@ def run_test_conversation():
     print(" Test conversation completed!")
     print_separator()
 
+def run_profiled_query(command_parts):
+    """Answer one question under the profiler and print where the time went"""
+    mode = None
+    if len(command_parts) > 1 and command_parts[1].lower() in PROFILE_MODES:
+        mode = command_parts.pop(1).lower()
+    query = " ".join(command_parts[1:])
+    if not query:
+        print(f" Usage: /profile [{'|'.join(PROFILE_MODES)}] <question>")
+        return
+
+    with request_scope():
+        with profile_request(mode) as profile:
+            try:
+                response = handle_query(query, response_mode=response_mode)
+                print_bot_response(response)
+            except Exception as e:
+                print(f" Error processing query: {e}\n")
+
+    summary = profile.summary()
+    if "skipped" in summary:
+        print(f" Profiling skipped: {summary['skipped']}")
+        return
+    print(f" Profile ({summary['mode']}): {summary['elapsed']:.2f}s total, LLM {summary['llm_seconds']:.2f}s, "
+          f"SQL {summary['sql_seconds']:.2f}s, other {summary['other_seconds']:.2f}s")
+    for call in sorted(profile.spans, key=lambda s: s["start"]):
+        print(f"   +{call['start']:7.3f}s {call['duration']:7.3f}s  {call['kind']:<3} {call['label']}")
+    for entry in profile.top_functions(5):
+        print(f"   {entry['function']}")
+    print(f" Saved to {summary['file']}\n")
+
 def main():
+    global response_mode
+
     print_separator()
     print(" Protein Modification Chatbot - CLI Interface")
     print("Enhanced with conversational memory!")
@@ -98,6 +129,16 @@ def main():
                     reset_conversation()
                     print(" Conversation context reset!")
                     continue
+                elif command == '/mode':
+                    if len(command_parts) < 2 or command_parts[1].lower() not in RESPONSE_MODES:
+                        print(f" Usage: /mode <{'|'.join(RESPONSE_MODES)}>")
+                    else:
+                        response_mode = command_parts[1].lower()
+                        print(f" Response mode set to {response_mode}")
+                    continue
+                elif command == '/profile':
+                    run_profiled_query(command_parts)
+                    continue
                 elif command == '/test':
                     run_test_conversation()
                     continue
@@ -107,7 +148,7 @@ def main():
                     continue
             
             try:
-                response = handle_query(user_input)
+                response = handle_query(user_input, response_mode=response_mode)
                 print_bot_response(response)
             except Exception as e:
                 print(f" Error processing query: {e}")
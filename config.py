@@ -1,10 +1,22 @@
 # Model settings
 MODEL_NAME = "llama3:8b-instruct-q4_0"
 OLLAMA_URL = "http://localhost:11434"
-OLLAMA_GENERATE_URL = "http://localhost:11434/api/generate"
+# Keep the model (and its prompt prefix cache) loaded between requests
+OLLAMA_KEEP_ALIVE = "30m"
 NUM_CTX = 4096
 NUM_PREDICT = 512
 
+# LLM backends, each an Ollama ("ollama") or OpenAI-compatible ("openai") server.
+# Requests go to the backend with the fewest outstanding requests; a backend
+# listing "stages" only serves those stages and is preferred for them, e.g.
+# {"url": "http://gpu2:11434", "model": "sqlcoder:7b", "stages": ["sql"]}
+LLM_BACKENDS = [
+    {"url": OLLAMA_URL, "kind": "ollama", "model": MODEL_NAME}
+]
+LLM_BACKEND_MAX_FAILURES = 3
+LLM_BACKEND_EJECT_SECONDS = 30
+LLM_BACKEND_HEALTH_INTERVAL = 10
+
 # Database settings
 DB_TYPE = "postgres"
 DB_HOST = "localhost"
@@ -12,4 +24,242 @@ DB_PORT = 5432
 DB_NAME_SCOP3P = "scop3p"
 DB_NAME_SCOP3PTM = "scop3ptm"
 DB_USER = "postgres"
-DB_PASSWORD = ""
\ No newline at end of file
+DB_PASSWORD = ""
+# Servers per database. Chatbot queries are spread round robin over the replicas
+# whose circuit breaker is closed and fail over to the primary; maintenance
+# (index migration) always uses the primary, e.g.
+# "replicas": [{"host": "db-replica1", "port": 5432}]
+DB_TARGETS = {
+    DB_NAME_SCOP3P: {"primary": {"host": DB_HOST, "port": DB_PORT}, "replicas": []},
+    DB_NAME_SCOP3PTM: {"primary": {"host": DB_HOST, "port": DB_PORT}, "replicas": []}
+}
+# Reads run in READ ONLY transactions; SERIALIZABLE is not available on hot standbys
+DB_READ_ISOLATION = "REPEATABLE READ"
+
+# Response rendering
+# "auto" renders small, flat results directly and only summarizes the rest,
+# "prose" always uses the summarizer LLM, "table"/"json" never do
+RESPONSE_MODE = "auto"
+RENDER_MAX_ROWS = 10
+RENDER_MAX_COLUMNS = 8
+RENDER_MAX_CELL_CHARS = 80
+
+# Speculative SQL generation
+# Starts SQL generation in parallel with intent classification for queries
+# the lexicon routes straight to SQL. The Ollama server needs
+# OLLAMA_NUM_PARALLEL > 1 for the two generations to actually overlap.
+SPECULATIVE_SQL = False
+SPECULATIVE_EXECUTE = False
+SPECULATIVE_WORKERS = 2
+
+# Per-stage generation profiles
+# num_ctx is kept the same for every stage on purpose: Ollama reloads the
+# model whenever num_ctx changes between requests.
+ROUTER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "mode": {"type": "string", "enum": ["sql"]},
+        "db": {"type": "string", "enum": ["scop3p", "scop3ptm", "both"]},
+        "needs_projects": {"type": "boolean"},
+        "needs_mutations": {"type": "boolean"}
+    },
+    "required": ["mode", "db", "needs_projects", "needs_mutations"]
+}
+
+INTENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": ["SOCIAL", "CONTEXTUAL", "INFORMATIONAL", "RESEARCH", "META"]},
+        "confidence": {"type": "number"},
+        "action": {"type": "string", "enum": ["DIRECT_RESPONSE", "EXPAND_PREVIOUS", "DATABASE_SEARCH", "CLARIFY"]},
+        "resolved_query": {"type": ["string", "null"]},
+        "direct_response": {"type": ["string", "null"]},
+        "expansion_topic": {"type": ["string", "null"]},
+        "entities_mentioned": {"type": "array", "items": {"type": "string"}},
+        "topics_mentioned": {"type": "array", "items": {"type": "string"}},
+        "reasoning": {"type": "string"}
+    },
+    "required": ["intent", "confidence", "action"]
+}
+
+GENERATION_PROFILES = {
+    "intent": {"num_ctx": NUM_CTX, "num_predict": 300, "format": INTENT_SCHEMA},
+    "router": {"num_ctx": NUM_CTX, "num_predict": 64, "format": ROUTER_SCHEMA},
+    "sql": {"num_ctx": NUM_CTX, "num_predict": 256, "stop": [";"]},
+    "summary": {"num_ctx": NUM_CTX, "num_predict": 800},
+    "direct": {"num_ctx": NUM_CTX, "num_predict": 400},
+    "expand": {"num_ctx": NUM_CTX, "num_predict": 500},
+    "memory": {"num_ctx": NUM_CTX, "num_predict": 200},
+    "page": {"num_ctx": NUM_CTX, "num_predict": 80},
+    "polish": {"num_ctx": NUM_CTX, "num_predict": 250}
+}
+
+# Semantic answer cache for FAQ-style questions
+# Embedder is "tfidf" (offline, pure Python) or "ollama" (local embedding model)
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_EMBEDDER = "tfidf"
+SEMANTIC_CACHE_EMBED_MODEL = "nomic-embed-text"
+SEMANTIC_CACHE_THRESHOLD = 0.85
+SEMANTIC_CACHE_TTL = 24 * 3600
+SEMANTIC_CACHE_MAX_ENTRIES = 5000
+SEMANTIC_CACHE_SEED_FILE = "chatbot_results.txt"
+
+# Knowledge base retrieval for direct-response and summarizer prompts
+KNOWLEDGE_TOP_K = 4
+KNOWLEDGE_TOKEN_BUDGET = 500
+
+# Deadlines, timeouts and circuit breakers (seconds)
+# A request gets REQUEST_DEADLINE overall; each stage is capped by its budget
+# and degrades (fallback classifier, no enrichment, rendered results) when
+# the remaining time runs short
+REQUEST_DEADLINE = 90
+STAGE_BUDGETS = {
+    "classification": 20,
+    "routing": 10,
+    "sql": 30,
+    "enrichment": 10,
+    "summary": 45
+}
+# Below this many seconds left, results are rendered instead of summarized
+SUMMARY_MIN_SECONDS = 8
+LLM_CONNECT_TIMEOUT = 5
+LLM_TIMEOUT = 120
+DB_CONNECT_TIMEOUT = 5
+DB_STATEMENT_TIMEOUT = 30
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_SECONDS = 30
+
+# /chat answers slower than this stream whitespace heartbeats until done, so a
+# client disconnect is noticed and the in-flight LLM and SQL work is cancelled
+CHAT_HEARTBEAT_SECONDS = 5
+
+# Logging runs through a queue to a background writer thread. Prompt and
+# response bodies are only kept for a sample of records and truncated
+LOG_FILE = "chatbot.log"
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "json"            # "json" or "text"
+LOG_ROTATION = "size"          # "size", "time" or "none"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_ROTATE_WHEN = "midnight"
+LOG_BACKUP_COUNT = 5
+LOG_BODY_SAMPLE_RATE = 0.1
+LOG_BODY_MAX_CHARS = 500
+LOG_MESSAGE_MAX_CHARS = 1000
+
+# Result exports (fetch_sql.py and /export) read in chunks from a server-side cursor
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_STATEMENT_TIMEOUT = 600
+EXPORT_PROGRESS_ROWS = 50000
+# /export never takes SQL: callers pick a table below, columns, equality filters and
+# an order, and the query is built server side. The endpoint is off unless
+# EXPORT_API_TOKEN is set and then needs "Authorization: Bearer <token>". Exports
+# connect as EXPORT_DB_USER when set, a role that should only have SELECT on
+# these tables (no superuser, no pg_read_server_files); DB_USER otherwise
+EXPORT_API_TOKEN = None
+EXPORT_DB_USER = None
+EXPORT_DB_PASSWORD = ""
+EXPORT_MAX_FILTER_VALUES = 1000
+EXPORT_TABLES = {
+    "scop3p": ["protein", "modification", "structure", "dynamine_predictions", "project", "peptide",
+               "peptide_has_modification", "mutation"],
+    "scop3ptm": ["protein", "protein_modification", "modification", "structure_modification",
+                 "peptide_modification", "project", "mutation", "gene"]
+}
+
+# Batch queries (/chat/batch and batch.py) run concurrently, sharing identical sub-results
+BATCH_MAX_WORKERS = 4
+BATCH_MAX_QUERIES = 100
+
+# Validated question -> SQL lookup, built with `python sql_index.py` and used
+# before LLM SQL generation on an exact or near-exact question match
+SQL_INDEX_ENABLED = True
+SQL_INDEX_FILE = "sql_index.json"
+SQL_INDEX_TRAINING_FILE = "comprehensive_codet5_training.json"
+
+# Opt-in per-request profiling (X-Profile header or "profile" on /chat, /profile
+# in the CLI). Profiles are written to PROFILE_DIR as <request_id>.json plus a
+# .folded (sampling) or .prof (cprofile) file. At most one request is profiled
+# at a time, and profiling stops being granted once its overhead in the last
+# PROFILE_BUDGET_WINDOW seconds reaches PROFILE_OVERHEAD_BUDGET seconds
+PROFILE_ENABLED = True
+PROFILE_DIR = "profiles"
+PROFILE_DEFAULT_MODE = "sampling"   # "sampling" or "cprofile"
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SAMPLER_OVERHEAD = 0.05 # share of wall time before the sampler slows down
+PROFILE_OVERHEAD_BUDGET = 30
+PROFILE_BUDGET_WINDOW = 3600
+# When set, /chat only profiles requests carrying this value in X-Profile-Token
+PROFILE_API_TOKEN = None
+
+# Record/replay cassettes for query_llm and run_sql. Test scripts replay
+# CASSETTE_DIR/<name>.json.gz when it exists, unless the CHATBOT_CASSETTE
+# environment variable says "record" or "off" (talk to the live services)
+CASSETTE_DIR = "tests/cassettes"
+
+# Precomputed per-protein project and mutation lists, built with
+# `python enrichment_store.py` into memory-mapped files that all workers share.
+# Every ENRICHMENT_CHECK_SECONDS the databases' release fingerprint is compared
+# with the one the files were built from; stale files, and any file before the
+# first check, are not served (the SQL enrichment is used instead). Rebuilding
+# is left to the CLI; with ENRICHMENT_AUTO_REBUILD one worker process at a time
+# rebuilds stale files in the background, under ENRICHMENT_BUILD_TIMEOUT
+ENRICHMENT_STORE_ENABLED = True
+ENRICHMENT_DIR = "enrichment"
+ENRICHMENT_CHECK_SECONDS = 3600
+ENRICHMENT_AUTO_REBUILD = False
+ENRICHMENT_BUILD_TIMEOUT = 1800
+
+# Conversation memory. "window" pastes the last two exchanges into the intent and
+# summarizer prompts; "summary" keeps a running summary plus the accessions,
+# modifications and topics mentioned, folds each turn into the summary in the
+# background, and renders it within MEMORY_TOKEN_BUDGET tokens however long the
+# conversation runs
+CONVERSATION_MEMORY = "window"
+MEMORY_TOKEN_BUDGET = 300
+MEMORY_SUMMARY_WORDS = 120
+MEMORY_EXPAND_TOKEN_BUDGET = 600
+MEMORY_WORKERS = 2
+
+# "Show more" follow-ups page through the last answer's rows without new SQL
+# generation. Up to PAGES_MAX_ROWS rows per database are kept per conversation
+# for PAGES_TTL_SECONDS; later pages re-run the SQL with LIMIT/OFFSET.
+# PAGE_INTRO_LLM adds a one-sentence LLM introduction to each page
+PAGE_SIZE = 20
+PAGES_MAX_ROWS = 500
+PAGES_TTL_SECONDS = 1800
+PAGE_INTRO_LLM = False
+
+# Conversations sent with a "session_id" on /chat are kept in a session store,
+# "sqlite" (SESSION_DB_FILE, shared by the worker processes on a host) or
+# "memory" (this process only). Sessions load on first use, turns are written
+# in the background in batches every SESSION_FLUSH_SECONDS, and sessions idle
+# for SESSION_TTL_SECONDS are compacted away every SESSION_COMPACT_SECONDS
+SESSION_BACKEND = "sqlite"
+SESSION_DB_FILE = "sessions.db"
+SESSION_CACHE_SIZE = 1000
+SESSION_FLUSH_SECONDS = 1.0
+SESSION_TTL_SECONDS = 7 * 24 * 3600
+SESSION_COMPACT_SECONDS = 3600
+
+# Per-protein summary cards (site counts by modification and evidence, structure
+# coverage, top projects, mutation counts) built with `python protein_cards.py`
+# into a SQLite file indexed by accession and name. Overview questions such as
+# "tell me about P02545" or "show me p53 phosphorylation sites" are answered from
+# a card without SQL generation or the summarizer. Rebuilds after a release only
+# recompute proteins with new rows, up to PROTEIN_CARD_MAX_CHANGED of them.
+# PROTEIN_CARD_POLISH rewrites the card as prose with a short LLM call
+PROTEIN_CARDS_ENABLED = True
+PROTEIN_CARDS_FILE = "enrichment/protein_cards.db"
+PROTEIN_CARD_MAX_SITES = 25
+PROTEIN_CARD_TOP_PROJECTS = 5
+PROTEIN_CARD_MAX_CHANGED = 5000
+PROTEIN_CARD_POLISH = False
+
+# SQL generation evaluation (`python sql_eval.py`) runs the training question/SQL
+# pairs through the SQL prompts and the LLM on SQL_EVAL_WORKERS threads, executes
+# the generated and target SQL and writes a JSON report per db_id. With --offline
+# a fake LLM answers with the target SQL and the queries run on SQLite fixtures
+# built from the training schemas, up to SQL_EVAL_FIXTURE_ROWS rows per table
+SQL_EVAL_WORKERS = 4
+SQL_EVAL_REPORT_FILE = "sql_eval_report.json"
+SQL_EVAL_FIXTURE_ROWS = 5000
@@ -2,18 +2,34 @@ import re
 import logging
 from typing import Dict, List, Any, Optional
 from llm_client import query_llm
-from prompts import load_prompt
+from prompts import format_prompt_parts
+from semantic_cache import get_semantic_cache
+from knowledge_store import get_knowledge_store
+from resilience import Deadline, CircuitOpen
+from structured_logging import log_body
+from conversation_memory import ConversationMemory, truncate_to_tokens
+from result_pages import ResultPages
+from result_set import dumps_limited
+from renderer import render_page
+from db_utils import run_sql
+from config import SEMANTIC_CACHE_ENABLED, CONVERSATION_MEMORY, MEMORY_EXPAND_TOKEN_BUDGET, PAGE_INTRO_LLM
 import json
+from collections import deque
 
 logger = logging.getLogger(__name__)
 
 class ConversationState:
-    def __init__(self, max_history: int = 5):
+    def __init__(self, max_history: int = 5, memory: str = CONVERSATION_MEMORY):
         self.last_query: Optional[str] = None
         self.last_response: Optional[str] = None
-        self.conversation_history: List[Dict] = []
         self.max_history: int = max_history
+        self.conversation_history: deque = deque(maxlen=max_history)
         self.current_context: Dict[str, Any] = {}
+        self.memory_mode: str = memory
+        # Running summary used for the context in "summary" mode
+        self.memory: Optional[ConversationMemory] = ConversationMemory() if memory == "summary" else None
+        # Rows of the last database answer for "show more" follow-ups
+        self.pages: Optional[ResultPages] = None
     
     def add_exchange(self, user_query: str, bot_response: str):
         """Add a conversation exchange"""
@@ -27,14 +43,21 @@ class ConversationState:
         }
         
         self.conversation_history.append(exchange)
-        self.conversation_history = self.conversation_history[-self.max_history:]
+        
+        if self.memory is not None:
+            self.memory.record(user_query, bot_response, self.current_context)
+        if self.pages is not None:
+            self.pages.record_response(bot_response)
     
     def get_context_string(self) -> str:
         """Get recent conversation as string for LLM"""
         if not self.conversation_history:
             return "No previous conversation"
         
-        recent = self.conversation_history[-2:]  # Last 2 exchanges
+        if self.memory is not None:
+            return self.memory.render() or "No previous conversation"
+        
+        recent = list(self.conversation_history)[-2:]  # Last 2 exchanges
         context_parts = []
         
         for exchange in recent:
@@ -43,45 +66,67 @@ class ConversationState:
         
         return "\n".join(context_parts)
     
+    def snapshot(self) -> Dict[str, Any]:
+        """Plain data for the session store; "show more" pages stay with the process"""
+        return {
+            "last_query": self.last_query,
+            "last_response": self.last_response,
+            "conversation_history": list(self.conversation_history),
+            "current_context": dict(self.current_context),
+            "memory": self.memory.snapshot() if self.memory is not None else None
+        }
+    
+    def restore(self, data: Dict[str, Any]):
+        """Load a snapshot taken by snapshot()"""
+        self.last_query = data.get("last_query")
+        self.last_response = data.get("last_response")
+        self.conversation_history = deque(data.get("conversation_history") or [], maxlen=self.max_history)
+        self.current_context = dict(data.get("current_context") or {})
+        if self.memory is not None and data.get("memory"):
+            self.memory.restore(data["memory"])
+    
     def _get_timestamp(self) -> str:
         from datetime import datetime
         return datetime.now().isoformat()
 
 class ConversationManager:
-    def __init__(self, max_history: int = 5):
-        self.state = ConversationState(max_history)
+    def __init__(self, max_history: int = 5, memory: str = CONVERSATION_MEMORY):
+        self.state = ConversationState(max_history, memory)
     
-    def classify_intent_with_llm(self, query: str) -> Dict[str, Any]:
+    def classify_intent_with_llm(self, query: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """Use LLM to classify intent using prompt template"""
         logger.info(f"Classifying intent for: '{query}'")
         
+        if deadline and not deadline.allows("classification"):
+            logger.warning("No time left for LLM intent classification")
+            return self._fallback_classification(query)
+        
         try:
-            # Load prompt template
-            prompt_template = load_prompt("intent_classifier.txt")
-            logger.info("Intent classifier prompt loaded successfully")
-            
             # Prepare context
             context = self.state.get_context_string()
             current_context = json.dumps(self.state.current_context, indent=2) if self.state.current_context else "None"
             
-            logger.info(f"Context: {context[:100]}...")
-            logger.info(f"Current context: {current_context}")
+            log_body(logger, "Context", context)
+            log_body(logger, "Current context", current_context)
             
-            # Fill template
-            prompt = prompt_template.format(
+            # Fill template, the static instructions go in the system prompt
+            system, prompt = format_prompt_parts(
+                "intent_classifier.txt",
                 context=context,
                 current_context=current_context,
                 user_query=query
             )
             
-            logger.info(f"Sending prompt to LLM (length: {len(prompt)})")
+            logger.info(f"Sending prompt to LLM (length: {len(system) + len(prompt)})")
             
             # Get LLM response
-            response = query_llm(prompt, num_predict=300)
-            logger.info(f"LLM raw response: {response}")
+            response = query_llm(prompt, system=system, stage="intent",
+                                 timeout=deadline.budget("classification") if deadline else None,
+                                 deadline=deadline)
+            log_body(logger, "LLM raw response", response)
             
             parsed_result = self._parse_intent_response(response)
-            logger.info(f"Parsed intent result: {parsed_result}")
+            log_body(logger, "Parsed intent result", parsed_result)
             
             return parsed_result
             
@@ -93,14 +138,22 @@ class ConversationManager:
     def _parse_intent_response(self, response: str) -> Dict[str, Any]:
         """Parse LLM response into structured data with better error handling"""
         try:
-            logger.info(f"Attempting to parse response: {response[:200]}...")
+            log_body(logger, "Attempting to parse response", response)
+            
+            # Structured output from the intent stage is plain JSON
+            try:
+                intent_data = json.loads(response)
+                if isinstance(intent_data, dict) and 'intent' in intent_data and 'action' in intent_data:
+                    return intent_data
+            except json.JSONDecodeError:
+                pass
             
             # Clean response - remove markdown formatting
             cleaned = re.sub(r'^```\s*json?\s*\n?', '', response, flags=re.IGNORECASE | re.MULTILINE)
             cleaned = re.sub(r'\n?```\s*$', '', cleaned, flags=re.MULTILINE)
             cleaned = cleaned.strip()
             
-            logger.info(f"Cleaned response: {cleaned[:200]}...")
+            log_body(logger, "Cleaned response", cleaned)
             
             # Try to find JSON object in the response
             json_pattern = r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}'
@@ -111,7 +164,7 @@ class ConversationManager:
                 for json_candidate in json_matches:
                     try:
                         intent_data = json.loads(json_candidate)
-                        logger.info(f"Successfully parsed JSON: {intent_data}")
+                        log_body(logger, "Successfully parsed JSON", intent_data)
                         
                         # Validate required fields
                         if 'intent' in intent_data and 'action' in intent_data:
@@ -137,7 +190,7 @@ class ConversationManager:
                     "confidence": 0.6,
                     "reasoning": "Manually extracted from malformed JSON"
                 }
-                logger.info(f"Manual extraction successful: {manual_result}")
+                log_body(logger, "Manual extraction successful", manual_result)
                 return manual_result
             
             raise ValueError("Could not extract valid intent data")
@@ -196,9 +249,24 @@ class ConversationManager:
         logger.info("Classified as RESEARCH (default)")
         return result
     
-    def process_query(self, query: str) -> Dict[str, Any]:
+    def process_query(self, query: str, deadline: Optional[Deadline] = None) -> Dict[str, Any]:
         """Process query and return action plan"""
-        intent_data = self.classify_intent_with_llm(query)
+        # "Show more" right after a database answer pages through its rows without the LLM
+        if self.state.pages is not None and self.state.pages.wants_more(query):
+            logger.info("Follow-up asks for more rows of the previous results")
+            return {
+                "action": "SHOW_MORE",
+                "intent_data": {
+                    "intent": "CONTEXTUAL",
+                    "action": "SHOW_MORE",
+                    "confidence": 1.0,
+                    "reasoning": "Follow-up for more rows"
+                },
+                "skip_pipeline": True,
+                "response": self._next_result_page(deadline)
+            }
+        
+        intent_data = self.classify_intent_with_llm(query, deadline)
         action = intent_data.get("action", "DATABASE_SEARCH")
         
         # Update context with any new entities/topics
@@ -214,10 +282,13 @@ class ConversationManager:
         }
         
         if action == "DIRECT_RESPONSE":
+            # Paraphrases of already answered FAQ questions skip the answer generation;
+            # only informational turns, so data requests always reach the database
+            cached = self._lookup_cached_answer(query, intent_data)
             # For direct responses, use specialized knowledge from summarizer
-            result["response"] = self._generate_informed_direct_response(query, intent_data)
+            result["response"] = cached or self._generate_informed_direct_response(query, intent_data, deadline)
         elif action == "EXPAND_PREVIOUS":
-            result["response"] = self._expand_on_previous_topic(intent_data.get("expansion_topic"))
+            result["response"] = self._expand_on_previous_topic(intent_data.get("expansion_topic"), deadline)
         elif action == "CLARIFY":
             result["response"] = "Could you please be more specific about what you'd like to know?"
         else:  # DATABASE_SEARCH
@@ -225,8 +296,29 @@ class ConversationManager:
         
         return result
     
-    def _expand_on_previous_topic(self, topic: str) -> str:
+    def _lookup_cached_answer(self, query: str, intent_data: Dict) -> Optional[str]:
+        """Answer of a semantically similar informational question, if one was answered"""
+        if not SEMANTIC_CACHE_ENABLED or intent_data.get("intent") != "INFORMATIONAL":
+            return None
+        
+        try:
+            hit = get_semantic_cache().lookup(query)
+        except Exception as e:
+            logger.warning(f"Semantic cache lookup failed: {e}")
+            return None
+        if not hit:
+            return None
+        
+        answer, similarity = hit
+        intent_data["reasoning"] = f"Semantic cache hit ({similarity:.2f})"
+        return answer
+    
+    def _expand_on_previous_topic(self, topic: str, deadline: Optional[Deadline] = None) -> str:
         """Expand on the previous topic discussed"""
+        # More rows of a database answer are better than more prose about the same rows
+        if self.state.pages is not None and self.state.pages.pending:
+            return self._next_result_page(deadline)
+        
         if not self.state.last_response:
             return "I'd be happy to provide more information, but I'm not sure what specific topic you'd like me to expand on."
         
@@ -240,57 +332,72 @@ class ConversationManager:
         if len(self.state.last_response) < 100:
             return "I'd be happy to provide more details. What specific aspect would you like me to elaborate on?"
         
-        # Use LLM to expand on the previous response
+        # Use LLM to expand on the previous response, bounded in summary mode
+        previous_response = self.state.last_response
+        if self.state.memory is not None:
+            previous_response = truncate_to_tokens(previous_response, MEMORY_EXPAND_TOKEN_BUDGET)
         try:
-            expand_prompt = f"""The user asked for more information about a topic we were discussing. Here's what I told them previously:
-
-PREVIOUS RESPONSE: {self.state.last_response}
-
-USER REQUEST: More information / elaboration
-
-Provide additional helpful details about the same topic, building naturally on what was already discussed. Be conversational and informative. Focus on expanding the specific points that were mentioned.
-
-IMPORTANT: Only reference what is shown in the previous response above. Do not invent or assume other discussions.
-
-Response:"""
+            system, expand_prompt = format_prompt_parts(
+                "expand_previous.txt",
+                previous_response=previous_response
+            )
             
-            response = query_llm(expand_prompt, num_predict=500)
+            response = query_llm(expand_prompt, system=system, stage="expand",
+                                 timeout=deadline.budget("summary") if deadline else None,
+                                 deadline=deadline)
             return response
         except Exception:
             return "I'd be happy to provide more details, but I'm having trouble accessing additional information right now. Could you ask a more specific question?"
     
-    def _generate_informed_direct_response(self, query: str, intent_data: Dict) -> str:
+    def _next_result_page(self, deadline: Optional[Deadline] = None) -> str:
+        """Next rows of the last database answer, without generating SQL again"""
+        pages = self.state.pages
+        timeout = deadline.budget("sql") if deadline else None
+        try:
+            page = pages.next_page(lambda db, sql: run_sql(db, sql, timeout=timeout, deadline=deadline))
+        except CircuitOpen as e:
+            logger.error(f"Next page unavailable: {e}")
+            return "The database is temporarily unavailable, so I can't fetch more rows right now. Please try again in a minute."
+        answer = render_page(pages.query, page)
+        
+        if PAGE_INTRO_LLM and page:
+            try:
+                system, prompt = format_prompt_parts(
+                    "page_intro.txt",
+                    user_query=pages.query,
+                    rows=dumps_limited({db: section["rows"] for db, section in page.items()}, 1500)
+                )
+                intro = query_llm(prompt, system=system, stage="page",
+                                  timeout=deadline.budget("summary") if deadline else None,
+                                  deadline=deadline)
+                answer = f"{intro.strip()}\n\n{answer}"
+            except Exception as e:
+                logger.warning(f"Page introduction failed: {e}")
+        
+        return pages.offer(answer)
+    
+    def _generate_informed_direct_response(self, query: str, intent_data: Dict, deadline: Optional[Deadline] = None) -> str:
         """Generate direct response using specialized knowledge from summarizer template"""
         try:
-            # Load the summarizer template to get the specialized knowledge
-            from prompts import load_prompt
-            
-            summarizer_template = load_prompt("summarizer.txt")
+            # Static instructions and guidelines first, relevant knowledge chunks with the query
+            store = get_knowledge_store()
+            system, informed_prompt = format_prompt_parts(
+                "direct_response.txt",
+                knowledge_section=store.knowledge_section(query),
+                query=query
+            )
+            system = f"{system}\n\n{store.tail}"
             
-            # Extract just the knowledge base section (everything after "KEY KNOWLEDGE BASE:")
-            knowledge_start = summarizer_template.find("KEY KNOWLEDGE BASE:")
-            if knowledge_start != -1:
-                knowledge_section = summarizer_template[knowledge_start:]
-            else:
-                knowledge_section = summarizer_template
+            response = query_llm(informed_prompt, system=system, stage="direct",
+                                 timeout=deadline.budget("summary") if deadline else None,
+                                 deadline=deadline)
             
-            # Create informed response prompt
-            informed_prompt = f"""You are an AI assistant who can understand the proteomics field well enough to answer user questions enthusiastically.
-
-{knowledge_section}
-
-USER QUERY: {query}
-
-INSTRUCTIONS:
-- Provide a direct, factual answer to the user's question
-- Use the specialized knowledge base above when relevant
-- Be conversational and helpful
-- If the question relates to protein modifications, databases, or proteomics concepts covered in the knowledge base, reference that information
-- Keep the response focused and informative
-
-Response:"""
+            if SEMANTIC_CACHE_ENABLED and intent_data.get("intent") == "INFORMATIONAL":
+                try:
+                    get_semantic_cache().add(query, response)
+                except Exception as e:
+                    logger.warning(f"Could not cache answer: {e}")
             
-            response = query_llm(informed_prompt, num_predict=400)
             return response
             
         except Exception as e:
@@ -308,4 +415,4 @@ Response:"""
     
     def reset(self):
         """Reset conversation state"""
-        self.state = ConversationState(self.state.max_history)
\ No newline at end of file
+        self.state = ConversationState(self.state.max_history, self.state.memory_mode)
\ No newline at end of file
@@ -0,0 +1,187 @@
+# conversation_memory.py - running conversation summary with a fixed prompt footprint
+import re
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from llm_client import query_llm
+from prompts import format_prompt_parts
+from knowledge_store import CHARS_PER_TOKEN
+from config import MEMORY_TOKEN_BUDGET, MEMORY_SUMMARY_WORDS, MEMORY_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# UniProt accession format
+ACCESSION_PATTERN = re.compile(r"\b(?:[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9](?:[A-Z][A-Z0-9]{2}[0-9]){1,2})\b")
+
+MODIFICATION_TERMS = {
+    "phospho": "phosphorylation", "ubiquitin": "ubiquitination", "acetyl": "acetylation",
+    "methyl": "methylation", "glyco": "glycosylation", "sumoyl": "sumoylation",
+    "neddyl": "neddylation", "palmitoyl": "palmitoylation"
+}
+
+# Most recent values kept per entity kind
+MAX_ENTITIES = 8
+
+_executor = ThreadPoolExecutor(max_workers=MEMORY_WORKERS, thread_name_prefix="memory")
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    limit = max(tokens, 0) * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    return text[:max(limit - 3, 0)].rstrip() + "..."
+
+def summarize_exchange(summary: str, user_query: str, bot_response: str) -> str:
+    """Fold one exchange into the running summary with the LLM"""
+    system, prompt = format_prompt_parts(
+        "memory_summary.txt",
+        summary=summary or "None yet",
+        user_query=user_query,
+        bot_response=truncate_to_tokens(bot_response, 4 * MEMORY_TOKEN_BUDGET),
+        max_words=MEMORY_SUMMARY_WORDS
+    )
+    return query_llm(prompt, system=system, stage="memory")
+
+def _remember(values: List[str], new: List[str]):
+    # Most recent last, without duplicates
+    for value in new:
+        if value in values:
+            values.remove(value)
+        values.append(value)
+    del values[:-MAX_ENTITIES]
+
+class ConversationMemory:
+    """A running summary plus the entities mentioned. Each turn is folded into
+    the summary once, in the background; turns not folded in yet are shown as
+    they are. The rendered context is memoized until the next change"""
+
+    def __init__(self, token_budget: int = MEMORY_TOKEN_BUDGET,
+                 summarize: Callable[[str, str, str], str] = summarize_exchange,
+                 executor: Optional[ThreadPoolExecutor] = None):
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.executor = executor or _executor
+        self.summary = ""
+        self.entities: Dict[str, List[str]] = {"accessions": [], "modifications": [], "entities": [], "topics": []}
+        self.pending: List[Dict] = []
+        self.latest: Optional[Dict] = None
+        self.turn = 0
+        self.summarized_turn = 0
+        self._future = None
+        self._rendered = None
+        self._lock = threading.Lock()
+
+    def record(self, user_query: str, bot_response: str, current_context: Optional[Dict] = None):
+        """Add a finished turn; returns at once, the summary catches up in the background"""
+        text = f"{user_query}\n{bot_response}"
+        with self._lock:
+            self.turn += 1
+            self.latest = {"turn": self.turn, "user_query": user_query, "bot_response": bot_response}
+            self.pending.append(self.latest)
+            _remember(self.entities["accessions"], ACCESSION_PATTERN.findall(text))
+            lowered = text.lower()
+            _remember(self.entities["modifications"],
+                      [name for stem, name in MODIFICATION_TERMS.items() if stem in lowered])
+            context = current_context or {}
+            _remember(self.entities["entities"], [str(e) for e in context.get("recent_entities") or []])
+            _remember(self.entities["topics"], [str(t) for t in context.get("recent_topics") or []])
+            self._schedule()
+
+    def _schedule(self):
+        # Called with the lock held; one fold at a time, oldest turn first
+        if self._future is not None or not self.pending:
+            return
+        summary, exchange = self.summary, self.pending[0]
+        self._future = self.executor.submit(self._fold, summary, exchange)
+
+    def _fold(self, summary: str, exchange: Dict):
+        try:
+            updated = self.summarize(summary, exchange["user_query"], exchange["bot_response"]).strip()
+        except Exception as e:
+            logger.warning(f"Conversation summary update failed, keeping the question only: {e}")
+            updated = ""
+        if not updated:
+            updated = f"{summary} The user asked: {truncate_to_tokens(exchange['user_query'], 40)}".strip()
+        with self._lock:
+            self._future = None
+            # Unless reset() dropped the turn while the update ran
+            if self.pending and self.pending[0] is exchange:
+                self.summary = truncate_to_tokens(updated, self.token_budget // 2)
+                self.summarized_turn = exchange["turn"]
+                self.pending.pop(0)
+            self._schedule()
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until every recorded turn is in the summary"""
+        while True:
+            with self._lock:
+                future = self._future
+            if future is None:
+                return
+            future.result(timeout)
+
+    def render(self, token_budget: Optional[int] = None) -> str:
+        """Summary, unsummarized turns and entities within the token budget"""
+        budget = token_budget or self.token_budget
+        with self._lock:
+            key = (self.turn, self.summarized_turn, budget)
+            if self._rendered is not None and self._rendered[0] == key:
+                return self._rendered[1]
+            summary, pending, latest = self.summary, list(self.pending), self.latest
+            entities = {kind: list(values) for kind, values in self.entities.items() if values}
+
+        if latest is None:
+            text = ""
+        else:
+            entity_line = "; ".join(f"{kind}: {', '.join(values)}" for kind, values in entities.items())
+            entity_line = truncate_to_tokens(f"Mentioned so far - {entity_line}", budget // 4) if entity_line else ""
+            remaining = budget - len(entity_line) // CHARS_PER_TOKEN
+
+            # The latest turn is shown as it was, follow-ups refer to it most; then
+            # the summary, then any older turns still being summarized
+            share = remaining // 2 if summary else remaining
+            recent = [truncate_to_tokens(f"User: {latest['user_query']}\nBot: {latest['bot_response']}", share)]
+            remaining -= len(recent[0]) // CHARS_PER_TOKEN
+            summary_text = truncate_to_tokens(f"Conversation so far: {summary}", remaining) if summary else ""
+            remaining -= len(summary_text) // CHARS_PER_TOKEN
+            for exchange in reversed(pending[:-1]):
+                line = f"User: {exchange['user_query']}"
+                if len(line) // CHARS_PER_TOKEN + 1 > remaining:
+                    break
+                recent.insert(0, line)
+                remaining -= len(line) // CHARS_PER_TOKEN + 1
+            text = "\n".join(part for part in [summary_text] + recent + [entity_line] if part)
+
+        with self._lock:
+            self._rendered = (key, text)
+        return text
+
+    def snapshot(self) -> Dict:
+        """Plain data for the session store"""
+        with self._lock:
+            return {"summary": self.summary, "entities": {k: list(v) for k, v in self.entities.items()},
+                    "pending": list(self.pending), "latest": self.latest,
+                    "turn": self.turn, "summarized_turn": self.summarized_turn}
+
+    def restore(self, data: Dict):
+        """Load a snapshot; turns that weren't summarized yet are folded in again"""
+        with self._lock:
+            self.summary = data.get("summary", "")
+            for kind, values in (data.get("entities") or {}).items():
+                self.entities[kind] = list(values)
+            self.pending = list(data.get("pending") or [])
+            self.latest = data.get("latest")
+            self.turn = data.get("turn", 0)
+            self.summarized_turn = data.get("summarized_turn", 0)
+            self._rendered = None
+            self._schedule()
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self.pending = []
+            self.latest = None
+            for values in self.entities.values():
+                values.clear()
+            self.turn = self.summarized_turn = 0
+            self._rendered = None
@@ -1,54 +1,177 @@
 import psycopg2
 import json
-from config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD
+import itertools
+from config import (DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_CONNECT_TIMEOUT, DB_STATEMENT_TIMEOUT,
+                    DB_TARGETS, DB_READ_ISOLATION)
+from resilience import get_breaker, CircuitOpen
+from shared_results import current_shared_results, result_key
+from profiling import span
+from cassette import current_cassette
+from result_set import ResultSet
 
-def get_db_connection(dbname):
-    """Get database connection with proper error handling"""
+def db_targets(dbname):
+    """(primary, replicas) servers of a database"""
+    targets = DB_TARGETS.get(dbname) or {}
+    primary = targets.get("primary") or {"host": DB_HOST, "port": DB_PORT}
+    return primary, list(targets.get("replicas") or [])
+
+def get_db_connection(dbname, statement_timeout=DB_STATEMENT_TIMEOUT, target=None, readonly=False,
+                      user=None, password=None):
+    """Get database connection with proper error handling, to the primary unless
+    another server is given; readonly sessions can't write whatever SQL they run.
+    user/password log in as another role than DB_USER"""
+    target = target or db_targets(dbname)[0]
+    options = f"-c statement_timeout={max(1, int(statement_timeout * 1000))}"
+    if readonly:
+        # Also the session default, so statements after a COMMIT inside the SQL stay read-only
+        options += " -c default_transaction_read_only=on"
     try:
-        return psycopg2.connect(
+        conn = psycopg2.connect(
             dbname=dbname, 
-            user=DB_USER, 
-            password=DB_PASSWORD, 
-            host=DB_HOST,
-            port=DB_PORT
+            user=user or DB_USER,
+            password=password if user else DB_PASSWORD,
+            host=target["host"],
+            port=target.get("port", DB_PORT),
+            connect_timeout=DB_CONNECT_TIMEOUT,
+            options=options
         )
     except psycopg2.Error as e:
         raise Exception(f"Database connection failed for {dbname}: {e}")
+    if readonly:
+        conn.set_session(readonly=True, isolation_level=DB_READ_ISOLATION)
+    return conn
+
+_rotation = itertools.count()
+
+def read_targets(dbname):
+    """Servers to try for a read: the replicas in round-robin order, then the primary"""
+    primary, replicas = db_targets(dbname)
+    if replicas:
+        start = next(_rotation) % len(replicas)
+        replicas = replicas[start:] + replicas[:start]
+    return replicas + [primary]
+
+class DatabaseUnavailable(CircuitOpen):
+    """No server of a database can be reached, or all their circuits are open"""
+
+def target_breaker(dbname, target):
+    return get_breaker(f"db:{dbname}@{target['host']}:{target.get('port', DB_PORT)}")
+
+def get_read_connection(dbname, statement_timeout=DB_STATEMENT_TIMEOUT, user=None, password=None):
+    """Read-only connection to the next healthy replica, failing over to the primary;
+    servers that can't be reached are skipped until their circuit breaker resets"""
+    errors = []
+    for target in read_targets(dbname):
+        breaker = target_breaker(dbname, target)
+        try:
+            breaker.before_call()
+        except CircuitOpen as e:
+            errors.append(str(e))
+            continue
+        try:
+            conn = get_db_connection(dbname, statement_timeout, target, readonly=True, user=user, password=password)
+        except Exception as e:
+            breaker.record_failure()
+            print(f"Failing over from {target['host']}: {e}")
+            errors.append(str(e))
+            continue
+        breaker.record_success()
+        return conn
+    raise DatabaseUnavailable(f"No database server available for {dbname}: {'; '.join(errors)}")
 
-def run_sql(dbname, sql):
-    """Execute SQL query and return results as list of dictionaries"""
+def database_status():
+    """Circuit state of every configured database server, for /health"""
+    status = {}
+    for dbname in DB_TARGETS:
+        primary, replicas = db_targets(dbname)
+        status[dbname] = [
+            {"host": target["host"], "port": target.get("port", DB_PORT), "role": role,
+             "circuit": target_breaker(dbname, target).state}
+            for role, target in [("primary", primary)] + [("replica", r) for r in replicas]
+        ]
+    return status
+
+def run_sql(dbname, sql, timeout=None, deadline=None):
+    """Execute SQL query and return the rows as a ResultSet, empty on errors;
+    cancelling the request's deadline cancels the query on the server. Raises
+    DatabaseUnavailable when no server can be reached, so an outage isn't mistaken for no rows"""
     if not sql or sql.strip() == "":
-        return []
+        return ResultSet()
+    
+    if deadline is not None and deadline.cancelled:
+        return ResultSet()
+    
+    def compute():
+        # Queries of a batch share identical SQL results
+        shared = current_shared_results()
+        if shared is not None:
+            rows = shared.get_or_compute(result_key("sql", dbname, sql.strip()),
+                                         lambda: _execute(dbname, sql, timeout, deadline), timeout)
+            return rows[:]
+        return _execute(dbname, sql, timeout, deadline)
+
+    with span("sql", dbname, sql=sql.strip()[:200]) as details:
+        cassette = current_cassette()
+        if cassette is not None:
+            rows = cassette.call("sql", dbname, (dbname, sql.strip()), sql.strip(), compute)
+        else:
+            rows = compute()
+        details["rows"] = len(rows)
+        return rows
+
+def _execute(dbname, sql, timeout=None, deadline=None):
+    """Run one query on a fresh connection. Server health is tracked per server by
+    get_read_connection, so a failing replica never blocks failover to the others;
+    shared or replayed results never get here and never take a half-open trial"""
+    if deadline is not None and deadline.cancelled:
+        return ResultSet()
     
     conn = None
+    unregister = lambda: None
     try:
-        conn = get_db_connection(dbname)
+        conn = get_read_connection(dbname, timeout or DB_STATEMENT_TIMEOUT)
+        if deadline is not None:
+            unregister = deadline.on_cancel(conn.cancel)
+            # A cancel while connecting hit an idle connection and did nothing
+            if deadline.cancelled:
+                print(f"SQL query in {dbname} cancelled: {deadline.cancel_reason}")
+                return ResultSet()
         cur = conn.cursor()
         cur.execute(sql)
         rows = cur.fetchall()
         cols = [desc[0] for desc in cur.description]
-        return [dict(zip(cols, row)) for row in rows]
+        return ResultSet(cols, rows)
+    except DatabaseUnavailable:
+        # Every server is down, callers report this as an outage
+        raise
+    except psycopg2.extensions.QueryCanceledError as e:
+        if deadline is not None and deadline.cancelled:
+            print(f"SQL query in {dbname} cancelled: {deadline.cancel_reason}")
+        else:
+            print(f"SQL query in {dbname} timed out: {e}")
+        return ResultSet()
     except psycopg2.Error as e:
         print(f"SQL execution error in {dbname}: {e}")
-        return []
+        return ResultSet()
     except Exception as e:
         print(f"Unexpected error in run_sql: {e}")
-        return []
+        return ResultSet()
     finally:
+        unregister()
         if conn:
             conn.close()
 
-def run_project_sql(dbname, sql): 
+def run_project_sql(dbname, sql, timeout=None, deadline=None): 
     """Execute project-related SQL query"""
-    return run_sql(dbname, sql)
+    return run_sql(dbname, sql, timeout=timeout, deadline=deadline)
 
-def run_mutation_sql(dbname, protein_ids): 
+def run_mutation_sql(dbname, protein_ids, timeout=None, deadline=None): 
     """Execute mutation SQL query for given protein IDs"""
     if not protein_ids:
-        return []
+        return ResultSet()
     
     mutation_sql = build_mutation_sql(dbname, protein_ids)
-    return run_sql(dbname, mutation_sql)
+    return run_sql(dbname, mutation_sql, timeout=timeout, deadline=deadline)
 
 def build_mutation_sql(database, protein_ids):
     """Build SQL to fetch mutation information"""
@@ -0,0 +1,343 @@
+# enrichment_store.py - precomputed per-protein project and mutation lists
+import os
+import sys
+import json
+import mmap
+import fcntl
+import time
+import array
+import struct
+import logging
+import argparse
+import tempfile
+import threading
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from db_utils import get_read_connection
+from fetch_sql import QueryStream, DATABASES
+from result_set import ResultSet
+from structured_logging import setup_logging
+from config import (ENRICHMENT_STORE_ENABLED, ENRICHMENT_DIR, ENRICHMENT_CHECK_SECONDS,
+                    ENRICHMENT_AUTO_REBUILD, ENRICHMENT_BUILD_TIMEOUT, DB_STATEMENT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("projects", "mutations")
+
+# The same rows and limits as build_project_sql and build_mutation_sql, for
+# every protein at once, grouped by protein id
+PRECOMPUTE_SQL = {
+    ("scop3p", "projects"): """
+        SELECT DISTINCT p.id AS protein_id, proj.project_id, proj.project_title, proj.species,
+               proj.publication_date, proj.submission_type, proj.tissues,
+               p.protein_name, p.accession
+        FROM project proj
+        JOIN peptide pep ON proj.id = pep.l_project_id
+        JOIN protein p ON pep.l_protein_id = p.id
+        ORDER BY p.id""",
+    ("scop3ptm", "projects"): """
+        SELECT DISTINCT p.id AS protein_id, proj.project_id, proj.project_title, proj.species,
+               proj.publication_date, proj.tissue, proj.disease, proj.instrument,
+               p.protein_name, p.accession
+        FROM project proj
+        JOIN peptide_modification pm ON proj.id = pm.l_project_id
+        JOIN protein p ON pm.l_protein_id = p.id
+        ORDER BY p.id""",
+    ("scop3p", "mutations"): """
+        SELECT p.id AS protein_id, m.uniprot_position, m.reference_amino_acid, m.alternative_amino_acid,
+               m.mutation_type, m.disease, p.protein_name, p.accession
+        FROM mutation m
+        JOIN protein p ON m.l_protein_id = p.id
+        ORDER BY p.id, m.id""",
+    ("scop3ptm", "mutations"): """
+        SELECT p.id AS protein_id, m.mutation_position, m.reference_amino_acid, m.alternative_amino_acid,
+               m.mutation_type, m.disease, p.protein_name, p.accession, g.gene_name
+        FROM mutation m
+        JOIN protein p ON m.l_protein_id = p.id
+        LEFT JOIN gene g ON m.l_gene_id = g.id
+        ORDER BY p.id, m.id"""
+}
+LIMITS = {"projects": 20, "mutations": 50}
+
+# Cheap fingerprint of a data release: the newest row of every table the lists come from
+RELEASE_SQL = {
+    "scop3p": """SELECT concat_ws(':', (SELECT max(id) FROM protein), (SELECT max(id) FROM project),
+                                  (SELECT max(id) FROM peptide), (SELECT max(id) FROM mutation))""",
+    "scop3ptm": """SELECT concat_ws(':', (SELECT max(id) FROM protein), (SELECT max(id) FROM project),
+                                    (SELECT max(id) FROM peptide_modification), (SELECT max(id) FROM mutation),
+                                    (SELECT max(id) FROM gene))"""
+}
+
+MAGIC = b"ENRMAP1\0"
+
+# Held by the one worker process rebuilding maps, so the others don't run the same joins
+REBUILD_LOCK = ".rebuild.lock"
+
+def map_path(directory: str, database: str, kind: str) -> str:
+    return os.path.join(directory, f"{database}_{kind}.map")
+
+def write_map(path: str, columns: Sequence[str], rows: Iterable[Tuple], release: str = "", **meta) -> Dict:
+    """Write (protein_id, *values) rows, sorted by protein id, as a map file:
+    a JSON header with the columns, then arrays of protein ids, row ranges and
+    row offsets, then each row as a compact JSON list. Written to a temporary
+    file and renamed, so readers never see a partial map"""
+    ids, starts, offsets = array.array("q"), array.array("q"), array.array("q", [0])
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryFile() as blob:
+        size, count = 0, 0
+        for row in rows:
+            protein_id = int(row[0])
+            if not ids or ids[-1] != protein_id:
+                if ids and protein_id < ids[-1]:
+                    raise ValueError("Rows must be sorted by protein id")
+                ids.append(protein_id)
+                starts.append(count)
+            data = json.dumps(list(row[1:]), separators=(",", ":"), default=str).encode("utf-8")
+            blob.write(data)
+            size += len(data)
+            count += 1
+            offsets.append(size)
+        starts.append(count)
+
+        header = dict(meta, columns=list(columns), release=release, proteins=len(ids), rows=count,
+                      built_at=time.strftime("%Y-%m-%dT%H:%M:%S"))
+        encoded = json.dumps(header).encode("utf-8")
+        # Pad so the arrays start 8-byte aligned
+        encoded += b" " * (-(len(MAGIC) + 8 + len(encoded)) % 8)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                out.write(MAGIC + struct.pack("<q", len(encoded)) + encoded)
+                out.write(ids.tobytes())
+                out.write(starts.tobytes())
+                out.write(offsets.tobytes())
+                blob.seek(0)
+                while True:
+                    chunk = blob.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return header
+
+class EnrichmentMap:
+    """Read-only, memory-mapped per-protein row lists; processes mapping the same
+    file share one copy in the page cache, and rows are decoded only when asked for"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an enrichment map")
+        position = len(MAGIC)
+        (header_length,) = struct.unpack_from("<q", self._mm, position)
+        position += 8
+        self.header = json.loads(self._mm[position:position + header_length])
+        position += header_length
+        self.columns: List[str] = self.header["columns"][1:]
+        self.release: str = self.header.get("release", "")
+
+        proteins, rows = self.header["proteins"], self.header["rows"]
+        view = memoryview(self._mm)
+        self.ids = view[position:position + 8 * proteins].cast("q")
+        position += 8 * proteins
+        self.starts = view[position:position + 8 * (proteins + 1)].cast("q")
+        position += 8 * (proteins + 1)
+        self.offsets = view[position:position + 8 * (rows + 1)].cast("q")
+        self.blob = view[position + 8 * (rows + 1):]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rows_for(self, protein_id: int) -> Iterable[Tuple]:
+        i = bisect_left(self.ids, protein_id)
+        if i == len(self.ids) or self.ids[i] != protein_id:
+            return
+        for r in range(self.starts[i], self.starts[i + 1]):
+            yield tuple(json.loads(bytes(self.blob[self.offsets[r]:self.offsets[r + 1]])))
+
+    def lookup(self, protein_ids: Iterable, limit: Optional[int] = None) -> ResultSet:
+        """Rows of the given proteins, at most limit of them"""
+        found = ResultSet(self.columns)
+        for protein_id in protein_ids:
+            try:
+                protein_id = int(protein_id)
+            except (TypeError, ValueError):
+                continue
+            for row in self.rows_for(protein_id):
+                if limit is not None and len(found.rows) >= limit:
+                    return found
+                found.rows.append(row)
+        return found
+
+def release_version(database: str) -> str:
+    conn = get_read_connection(DATABASES[database], statement_timeout=DB_STATEMENT_TIMEOUT)
+    try:
+        cur = conn.cursor()
+        cur.execute(RELEASE_SQL[database])
+        return str(cur.fetchone()[0])
+    finally:
+        conn.close()
+
+def build(database: str, kind: str, directory: str = ENRICHMENT_DIR, release: Optional[str] = None) -> Dict:
+    """Precompute one map from Postgres, streaming the rows"""
+    release = release if release is not None else release_version(database)
+    started = time.monotonic()
+    sql = PRECOMPUTE_SQL[(database, kind)]
+    with QueryStream(database, sql, statement_timeout=ENRICHMENT_BUILD_TIMEOUT) as stream:
+        rows = (row for chunk in stream.chunks() for row in chunk)
+        header = write_map(map_path(directory, database, kind), stream.columns, rows, release,
+                           database=database, kind=kind)
+    logger.info(f"Built {database} {kind} map: {header['rows']} rows for {header['proteins']} proteins "
+                f"in {time.monotonic() - started:.1f}s")
+    return header
+
+class EnrichmentStore:
+    """The maps of both databases, reloaded when their files are replaced and
+    not served once the database release they were built from is outdated"""
+
+    def __init__(self, directory: str = ENRICHMENT_DIR, check_seconds: float = ENRICHMENT_CHECK_SECONDS,
+                 auto_rebuild: bool = ENRICHMENT_AUTO_REBUILD,
+                 release_version: Callable[[str], str] = release_version, builder: Callable = build):
+        self.directory = directory
+        self.check_seconds = check_seconds
+        self.auto_rebuild = auto_rebuild
+        self.release_version = release_version
+        self.builder = builder
+        self.maps: Dict[Tuple[str, str], EnrichmentMap] = {}
+        self.releases: Dict[str, str] = {}
+        self._checked_at = 0.0
+        self._checking: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _map(self, database: str, kind: str) -> Optional[EnrichmentMap]:
+        path = map_path(self.directory, database, kind)
+        current = self.maps.get((database, kind))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if current is None or (stat.st_ino, stat.st_mtime_ns) != (current.stat.st_ino, current.stat.st_mtime_ns):
+            # A replaced map is swapped in; lookups still using the old one keep it mapped
+            try:
+                current = self.maps[(database, kind)] = EnrichmentMap(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not load enrichment map {path}: {e}")
+                return None
+        return current
+
+    def lookup(self, kind: str, database: str, protein_ids) -> Optional[ResultSet]:
+        """Rows like the enrichment SQL returns, or None when the map is missing,
+        stale or not checked against the database yet and the caller should query it"""
+        self._maybe_check()
+        with self._lock:
+            enrichment_map = self._map(database, kind)
+        if enrichment_map is None:
+            return None
+        if self.releases.get(database) != enrichment_map.release:
+            return None
+        return enrichment_map.lookup(protein_ids, LIMITS[kind])
+
+    def projects(self, database: str, protein_ids) -> Optional[ResultSet]:
+        return self.lookup("projects", database, protein_ids)
+
+    def mutations(self, database: str, protein_ids) -> Optional[ResultSet]:
+        return self.lookup("mutations", database, protein_ids)
+
+    def _maybe_check(self):
+        # The release check queries Postgres, so it runs in the background, not in the request
+        with self._lock:
+            if time.monotonic() - self._checked_at < self.check_seconds or self._checking is not None:
+                return
+            if not os.path.isdir(self.directory):
+                return
+            self._checked_at = time.monotonic()
+            self._checking = threading.Thread(target=self.check_releases, name="enrichment-check", daemon=True)
+            self._checking.start()
+
+    def check_releases(self):
+        """Compare the databases' releases with the maps', rebuilding stale maps if enabled;
+        maps that were never built are left to the CLI"""
+        try:
+            for database in DATABASES:
+                try:
+                    release = self.release_version(database)
+                except Exception as e:
+                    logger.warning(f"Could not read the {database} release: {e}")
+                    continue
+                self.releases[database] = release
+                for kind in KINDS:
+                    with self._lock:
+                        enrichment_map = self._map(database, kind)
+                    if enrichment_map is None or enrichment_map.release == release:
+                        continue
+                    logger.info(f"Enrichment map {database} {kind} is outdated "
+                                f"({enrichment_map.release} -> {release})")
+                    if self.auto_rebuild:
+                        self._rebuild(database, kind, release)
+        finally:
+            with self._lock:
+                self._checking = None
+
+    def _rebuild(self, database: str, kind: str, release: str):
+        """Rebuild a stale map unless another worker process is already rebuilding"""
+        with open(os.path.join(self.directory, REBUILD_LOCK), "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                logger.info(f"Another process is rebuilding enrichment maps, skipping {database} {kind}")
+                return
+            try:
+                # It may have just been rebuilt by the process that held the lock
+                with self._lock:
+                    enrichment_map = self._map(database, kind)
+                if enrichment_map is not None and enrichment_map.release == release:
+                    return
+                self.builder(database, kind, self.directory, release)
+            except Exception as e:
+                logger.error(f"Rebuilding the {database} {kind} map failed: {e}")
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+_store: Optional[EnrichmentStore] = None
+_store_lock = threading.Lock()
+
+def get_enrichment_store() -> Optional[EnrichmentStore]:
+    """Shared store, None if disabled"""
+    global _store
+    if not ENRICHMENT_STORE_ENABLED:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = EnrichmentStore(os.path.join(os.path.dirname(__file__), ENRICHMENT_DIR))
+        return _store
+
+def set_enrichment_store(store: Optional[EnrichmentStore]):
+    global _store
+    with _store_lock:
+        _store = store
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute per-protein project and mutation lists")
+    parser.add_argument("--db", choices=sorted(DATABASES), action="append")
+    parser.add_argument("--kind", choices=KINDS, action="append")
+    parser.add_argument("--output-dir", default=ENRICHMENT_DIR)
+    args = parser.parse_args(argv)
+
+    setup_logging(log_file=None, console=True, force=True)
+    for database in args.db or sorted(DATABASES):
+        release = release_version(database)
+        for kind in args.kind or KINDS:
+            header = build(database, kind, args.output_dir, release)
+            print(f"{database} {kind}: {header['rows']} rows for {header['proteins']} proteins (release {release})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,28 +1,294 @@
-# test_query.py
-import psycopg2
-import pandas as pd
+# fetch_sql.py - export query results in chunks without loading them into memory
+import re
+import io
+import csv
 import sys
+import json
+import time
+import argparse
+from psycopg2 import sql as pgsql
+from config import (DB_NAME_SCOP3P, DB_NAME_SCOP3PTM, EXPORT_CHUNK_ROWS, EXPORT_STATEMENT_TIMEOUT,
+                    EXPORT_PROGRESS_ROWS, EXPORT_TABLES, EXPORT_MAX_FILTER_VALUES, EXPORT_DB_USER,
+                    EXPORT_DB_PASSWORD)
+from db_utils import get_read_connection
 
-def run_query(query: str, dbname="scop3p", user="postgres", password="", host="localhost", port=5432):
-    """Execute a SQL query and return as pandas DataFrame."""
-    conn = psycopg2.connect(
-        dbname=dbname,
-        user=user,
-        password=password,
-        host=host,
-        port=port
-    )
+DATABASES = {"scop3p": DB_NAME_SCOP3P, "scop3ptm": DB_NAME_SCOP3PTM}
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+
+# Formats that can be written to a stream as the rows arrive
+STREAMING_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+IDENTIFIER = re.compile(r"^[a-z_][a-z0-9_]{0,62}$")
+
+def _identifier(name, what: str) -> str:
+    if not isinstance(name, str) or not IDENTIFIER.match(name):
+        raise ValueError(f"Invalid {what}: {name!r}")
+    return name
+
+def build_export_query(database: str, table: str, columns=None, filters=None, order_by=None):
+    """(query, params) selecting columns of an exportable table, rows matching every
+    filter {column: value or list of values}; identifiers are quoted and values passed
+    as parameters, so the caller never supplies SQL"""
+    if database not in DATABASES:
+        raise ValueError(f"Unknown database: {database}")
+    if table not in EXPORT_TABLES.get(database, ()):
+        raise ValueError(f"table must be one of {', '.join(EXPORT_TABLES.get(database, ()))}")
+    if columns is not None and (not isinstance(columns, list) or not columns):
+        raise ValueError("columns must be a non-empty list")
+    if filters is not None and not isinstance(filters, dict):
+        raise ValueError("filters must be an object of column: value")
+    if order_by is not None and not isinstance(order_by, list):
+        order_by = [order_by]
+
+    selected = (pgsql.SQL(", ").join(pgsql.Identifier(_identifier(c, "column")) for c in columns)
+                if columns else pgsql.SQL("*"))
+    query = pgsql.SQL("SELECT {} FROM {}").format(selected, pgsql.Identifier(table))
+    conditions, params = [], []
+    for column, value in (filters or {}).items():
+        column = pgsql.Identifier(_identifier(column, "filter column"))
+        if isinstance(value, list):
+            if not value or len(value) > EXPORT_MAX_FILTER_VALUES:
+                raise ValueError(f"Filter lists need 1 to {EXPORT_MAX_FILTER_VALUES} values")
+            conditions.append(pgsql.SQL("{} = ANY(%s)").format(column))
+        elif value is None:
+            conditions.append(pgsql.SQL("{} IS NULL").format(column))
+            continue
+        else:
+            conditions.append(pgsql.SQL("{} = %s").format(column))
+        if any(isinstance(v, (dict, list)) for v in (value if isinstance(value, list) else [value])):
+            raise ValueError("Filter values must be strings, numbers or booleans")
+        params.append(value)
+    if conditions:
+        query += pgsql.SQL(" WHERE ") + pgsql.SQL(" AND ").join(conditions)
+    if order_by:
+        query += pgsql.SQL(" ORDER BY ") + pgsql.SQL(", ").join(
+            pgsql.Identifier(_identifier(c, "order_by column")) for c in order_by)
+    return query, params
+
+def validate_export_sql(sql: str) -> str:
+    """Return the query without a trailing semicolon if it is a single SELECT/WITH statement"""
+    # Blank out literals, quoted identifiers and comments before looking at the structure
+    stripped = re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/", " ", sql or "", flags=re.DOTALL)
+    if not stripped.strip():
+        raise ValueError("SQL query is required")
+    if ";" in stripped.strip().rstrip(";"):
+        raise ValueError("Only a single SQL statement can be exported")
+    if not re.match(r"\s*(select|with)\b", stripped, re.IGNORECASE):
+        raise ValueError("Only SELECT or WITH queries can be exported")
+    return sql.strip().rstrip(";").strip()
+
+class QueryStream:
+    """Rows of a query fetched in chunks through a server-side cursor in a read-only session.
+    sql is either SQL text from a trusted operator or a query from build_export_query with
+    its params; sessions use the EXPORT_DB_USER role when one is configured"""
+
+    def __init__(self, database: str, sql, chunk_size: int = EXPORT_CHUNK_ROWS, params=None,
+                 statement_timeout: float = EXPORT_STATEMENT_TIMEOUT):
+        if database not in DATABASES:
+            raise ValueError(f"Unknown database: {database}")
+        self.sql = sql if isinstance(sql, pgsql.Composable) else validate_export_sql(sql)
+        self.chunk_size = chunk_size
+        self.conn = get_read_connection(DATABASES[database], statement_timeout=statement_timeout,
+                                        user=EXPORT_DB_USER, password=EXPORT_DB_PASSWORD)
+        try:
+            self.cursor = self.conn.cursor(name="export_cursor")
+            self.cursor.itersize = chunk_size
+            self.cursor.execute(self.sql, params or None)
+            # A named cursor only knows its columns after the first fetch
+            self._first = self.cursor.fetchmany(chunk_size)
+            self.columns = [desc[0] for desc in self.cursor.description]
+            self.types = [desc[1] for desc in self.cursor.description]
+        except Exception:
+            self.close()
+            raise
+
+    def chunks(self):
+        """Yield lists of row tuples, closing the connection when done"""
+        try:
+            chunk, self._first = self._first, None
+            while chunk:
+                yield chunk
+                chunk = self.cursor.fetchmany(self.chunk_size)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def csv_chunks(columns, chunks):
+    """CSV text, header first, one string per chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def ndjson_chunks(columns, chunks):
+    """One JSON object per row, one string per chunk"""
+    for rows in chunks:
+        yield "".join(json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in rows)
+
+def format_chunks(fmt, columns, chunks):
+    if fmt == "csv":
+        return csv_chunks(columns, chunks)
+    if fmt == "ndjson":
+        return ndjson_chunks(columns, chunks)
+    raise ValueError(f"Format '{fmt}' cannot be streamed")
+
+# Parquet column kinds for PostgreSQL type OIDs; any other type is written as text
+PARQUET_KINDS = {16: "bool", 20: "int64", 21: "int64", 23: "int64", 26: "int64", 700: "float64", 701: "float64",
+                 1700: "float64", 1082: "date", 1114: "timestamp", 1184: "timestamptz"}
+
+def parquet_kinds(types, count):
+    """Column kinds from the cursor's type codes, so the schema never depends on the values"""
+    types = list(types or [])
+    return [PARQUET_KINDS.get(types[i] if i < len(types) else None, "string") for i in range(count)]
+
+def parquet_value(kind, value):
+    """A value converted for its column kind; numerics become floats, unknown types text"""
+    if value is None:
+        return None
+    if kind == "float64":
+        return float(value)
+    if kind == "string" and not isinstance(value, str):
+        return json.dumps(value, default=str) if isinstance(value, (list, dict)) else str(value)
+    return value
+
+def write_parquet(path, columns, chunks, progress=None, types=None):
+    """Write chunks as Parquet row groups, with the schema taken from the column
+    types (types as in cursor.description); the file is written even without rows.
+    Needs pyarrow"""
     try:
-        df = pd.read_sql_query(query, conn)
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+
+    arrow_types = {"bool": pa.bool_(), "int64": pa.int64(), "float64": pa.float64(), "date": pa.date32(),
+                   "timestamp": pa.timestamp("us"), "timestamptz": pa.timestamp("us", tz="UTC"),
+                   "string": pa.string()}
+    kinds = parquet_kinds(types, len(columns))
+    schema = pa.schema([pa.field(name, arrow_types[kind]) for name, kind in zip(columns, kinds)])
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            arrays = [pa.array([parquet_value(kind, row[i]) for row in rows], type=schema.field(i).type)
+                      for i, kind in enumerate(kinds)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            if progress:
+                progress.update(len(rows))
+
+def copy_csv(database, sql, out, progress=None):
+    """Fastest CSV export: let the server format rows with COPY ... TO STDOUT"""
+    sql = validate_export_sql(sql)
+    conn = get_read_connection(DATABASES[database], statement_timeout=EXPORT_STATEMENT_TIMEOUT,
+                               user=EXPORT_DB_USER, password=EXPORT_DB_PASSWORD)
+    try:
+        cur = conn.cursor()
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)",
+                        _ProgressWriter(out, progress) if progress else out)
     finally:
         conn.close()
-    return df
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python test_query.py \"SELECT * FROM project LIMIT 5;\"")
-        sys.exit(1)
+class _ProgressWriter:
+    """File wrapper counting the lines COPY writes"""
+
+    def __init__(self, out, progress):
+        self.out = out
+        self.progress = progress
+        self.header_seen = False
+
+    def write(self, data):
+        lines = data.count("\n") if isinstance(data, str) else data.count(b"\n")
+        if not self.header_seen and lines:
+            self.header_seen = True
+            lines -= 1
+        self.progress.update(lines)
+        return self.out.write(data if isinstance(data, str) else data.decode("utf-8"))
+
+class Progress:
+    """Rows exported so far, printed to stderr every few thousand rows"""
+
+    def __init__(self, every: int = EXPORT_PROGRESS_ROWS, stream=sys.stderr):
+        self.every = every
+        self.stream = stream
+        self.rows = 0
+        self.started = time.monotonic()
+        self._next_report = every
+
+    def update(self, rows: int):
+        self.rows += rows
+        if self.rows >= self._next_report:
+            self._next_report = self.rows + self.every
+            self.report()
 
-    sql = sys.argv[1]
-    df = run_query(sql)
-    print(df)
+    def report(self, final=False):
+        elapsed = time.monotonic() - self.started
+        rate = self.rows / elapsed if elapsed else 0
+        label = "Exported" if final else "Exporting..."
+        print(f"{label} {self.rows} rows in {elapsed:.1f}s ({rate:.0f} rows/s)", file=self.stream)
+
+def export(database, sql, fmt="csv", output=None, chunk_size=EXPORT_CHUNK_ROWS, use_copy=True):
+    """Export a query to a file (stdout when output is None), returns rows written"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format must be one of {', '.join(EXPORT_FORMATS)}")
+    if fmt == "parquet" and not output:
+        raise ValueError("Parquet export needs an output file")
+
+    progress = Progress()
+    if fmt == "parquet":
+        with QueryStream(database, sql, chunk_size) as stream:
+            write_parquet(output, stream.columns, stream.chunks(), progress, stream.types)
+    else:
+        out = open(output, "w", encoding="utf-8", newline="") if output else sys.stdout
+        try:
+            if fmt == "csv" and use_copy:
+                copy_csv(database, sql, out, progress)
+            else:
+                with QueryStream(database, sql, chunk_size) as stream:
+                    for text in format_chunks(fmt, stream.columns, _counted(stream.chunks(), progress)):
+                        out.write(text)
+        finally:
+            if output:
+                out.close()
+
+    progress.report(final=True)
+    return progress.rows
+
+def _counted(chunks, progress):
+    for rows in chunks:
+        progress.update(len(rows))
+        yield rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the results of a SELECT query")
+    parser.add_argument("sql", help='e.g. "SELECT * FROM peptide"')
+    parser.add_argument("--db", choices=sorted(DATABASES), default="scop3p")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--output", "-o", help="Output file, stdout if omitted")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_ROWS)
+    parser.add_argument("--no-copy", action="store_true", help="Use a server-side cursor instead of COPY for CSV")
+    args = parser.parse_args(argv)
+
+    try:
+        export(args.db, args.sql, args.format, args.output, args.chunk_size, use_copy=not args.no_copy)
+    except Exception as e:
+        print(f"Export failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# index_advisor.py - index migration and advisor driven by the SQL the chatbot generates
+import re
+import sys
+import json
+import math
+import logging
+import argparse
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from config import DB_NAME_SCOP3P, DB_NAME_SCOP3PTM, LOG_FILE
+from db_utils import get_db_connection
+
+logger = logging.getLogger(__name__)
+
+DATABASES = {"scop3p": DB_NAME_SCOP3P, "scop3ptm": DB_NAME_SCOP3PTM}
+
+# Text columns the SQL prompts tell the model to match with ILIKE '%...%'
+TRIGRAM_COLUMNS = {
+    "scop3p": [("protein", "protein_name"), ("protein", "accession"), ("modification", "modification_name"),
+               ("structure", "secondary_structure"), ("mutation", "disease")],
+    "scop3ptm": [("protein", "protein_name"), ("modification", "unimod_modification_name"),
+                 ("mutation", "disease"), ("gene", "gene_name")]
+}
+
+# Index builds on the large tables take a while
+MIGRATION_STATEMENT_TIMEOUT = 3600
+
+# Foreign keys every join pattern goes through
+FOREIGN_KEY_COLUMNS = ("l_protein_id", "l_modification_id", "l_project_id")
+
+SQL_LOG_PATTERN = re.compile(r"(?:Generated|Using speculative|Using indexed) (SCOP3PTM|SCOP3P) SQL: (.*)", re.DOTALL)
+TEXT_LOG_LINE = re.compile(r"^(?:\[[\w-]+\] )?\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+
+SQL_KEYWORDS = {"on", "where", "join", "left", "right", "inner", "outer", "full", "cross", "group", "order",
+                "limit", "union", "having", "using", "as", "select", "lateral"}
+
+Column = Tuple[str, str]  # (table, column)
+
+def index_name(table: str, column: str, kind: str) -> str:
+    return f"idx_{table}_{column}_trgm" if kind == "trgm" else f"idx_{table}_{column}"
+
+def create_index_sql(table: str, column: str, kind: str) -> str:
+    if kind == "trgm":
+        return (f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(table, column, kind)} "
+                f"ON {table} USING gin ({column} gin_trgm_ops)")
+    return f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(table, column, kind)} ON {table} ({column})"
+
+# --- Migration ---------------------------------------------------------------
+
+def table_columns(conn) -> Dict[str, Set[str]]:
+    cur = conn.cursor()
+    cur.execute("SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = 'public'")
+    columns: Dict[str, Set[str]] = {}
+    for table, column in cur.fetchall():
+        columns.setdefault(table, set()).add(column)
+    return columns
+
+def migration_statements(database: str, columns: Dict[str, Set[str]]) -> List[str]:
+    """pg_trgm and foreign-key index DDL for the tables and columns that exist"""
+    statements = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+    for table, column in TRIGRAM_COLUMNS.get(database, []):
+        if column in columns.get(table, ()):
+            statements.append(create_index_sql(table, column, "trgm"))
+    for table in sorted(columns):
+        for column in FOREIGN_KEY_COLUMNS:
+            if column in columns[table]:
+                statements.append(create_index_sql(table, column, "btree"))
+    return statements
+
+def migrate(database: str, dry_run: bool = False) -> List[str]:
+    """Create the indexes on the primary; CONCURRENTLY keeps the tables writable while they build"""
+    conn = get_db_connection(DATABASES[database], statement_timeout=MIGRATION_STATEMENT_TIMEOUT)
+    try:
+        conn.autocommit = True
+        statements = migration_statements(database, table_columns(conn))
+        cur = conn.cursor()
+        for statement in statements:
+            print(f"{database}: {statement}")
+            if not dry_run:
+                cur.execute(statement)
+        if not dry_run:
+            cur.execute("ANALYZE")
+        return statements
+    finally:
+        conn.close()
+
+# --- Advisor -----------------------------------------------------------------
+
+def read_generated_sql(path: str) -> List[Tuple[str, str]]:
+    """(database, sql) pairs from chatbot.log, in JSON-lines or text format"""
+    found = []
+    message: Optional[str] = None
+
+    def flush(text, sql=None):
+        # JSON records carry the whole SQL in their "sql" field, the message may be truncated
+        match = SQL_LOG_PATTERN.search(text or "")
+        sql = (sql or (match.group(2) if match else "")).strip()
+        if match and sql:
+            found.append((match.group(1).lower(), sql))
+
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("{"):
+                flush(message)
+                message = None
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                flush(entry.get("message"), entry.get("sql"))
+            elif TEXT_LOG_LINE.match(line):
+                # Text records can span several lines, a new timestamp starts the next one
+                flush(message)
+                message = line
+            elif message is not None:
+                message += line
+    flush(message)
+    return found
+
+def _strip_literals(sql: str) -> str:
+    return re.sub(r"'(?:[^']|'')*'", "''", sql)
+
+def table_aliases(sql: str) -> Dict[str, str]:
+    """alias -> table for the FROM and JOIN clauses of a query"""
+    aliases = {}
+    for table, alias in re.findall(r"\b(?:from|join)\s+(\w+)(?:\s+(?:as\s+)?(\w+))?", sql, re.IGNORECASE):
+        table = table.lower()
+        if table in SQL_KEYWORDS:
+            continue
+        aliases[table] = table
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias.lower()] = table
+    return aliases
+
+def parse_predicates(sql: str) -> Counter:
+    """Count (table, column, kind) lookups a query needs, kind being 'trgm' for
+    ILIKE/LIKE '%...%' matches and 'btree' for equality, range and join columns"""
+    aliases = table_aliases(sql)
+    tables = set(aliases.values())
+    only_table = next(iter(tables)) if len(tables) == 1 else None
+    found = Counter()
+
+    def resolve(reference: str) -> Optional[Column]:
+        parts = reference.lower().split(".")
+        if len(parts) == 2:
+            table = aliases.get(parts[0])
+            return (table, parts[1]) if table else None
+        return (only_table, parts[0]) if only_table and parts[0] not in SQL_KEYWORDS else None
+
+    # ILIKE and wildcard-led LIKE need a trigram index, an anchored LIKE can use a B-tree
+    for reference, operator, pattern in re.findall(r"([\w.]+)\s+(i?like)\s+'((?:[^']|'')*)'", sql, re.IGNORECASE):
+        column = resolve(reference)
+        if column:
+            kind = "trgm" if operator.lower() == "ilike" or pattern.startswith("%") else "btree"
+            found[column + (kind,)] += 1
+
+    stripped = _strip_literals(sql)
+    for reference in re.findall(r"([\w.]+)\s*(?:=|<>|!=|>=|<=|<|>|\bin\b|\bbetween\b)\s*(?:''|\d|\()", stripped,
+                                re.IGNORECASE):
+        column = resolve(reference)
+        if column:
+            found[column + ("btree",)] += 1
+
+    # Both sides of a join condition are looked up by equality
+    for left, right in re.findall(r"(\w+\.\w+)\s*=\s*(\w+\.\w+)", stripped):
+        for reference in (left, right):
+            column = resolve(reference)
+            if column:
+                found[column + ("btree",)] += 1
+    return found
+
+def existing_indexes(conn) -> Set[Tuple[str, str, str]]:
+    """(table, leading column, kind) of the indexes a database already has"""
+    cur = conn.cursor()
+    cur.execute("SELECT tablename, indexdef FROM pg_indexes WHERE schemaname = 'public'")
+    indexed = set()
+    for table, definition in cur.fetchall():
+        match = re.search(r"\((\w+)(\s+gin_trgm_ops)?", definition)
+        if match:
+            indexed.add((table, match.group(1), "trgm" if match.group(2) else "btree"))
+    return indexed
+
+def table_sizes(conn) -> Dict[str, float]:
+    cur = conn.cursor()
+    cur.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace")
+    return {table: max(float(rows), 0.0) for table, rows in cur.fetchall()}
+
+def advise(queries: Iterable[Tuple[str, str]], indexed: Dict[str, Set[Tuple[str, str, str]]],
+           sizes: Optional[Dict[str, Dict[str, float]]] = None) -> List[Dict]:
+    """Proposed indexes for predicates and joins on unindexed columns, best first.
+    The benefit estimate is the rows a sequential scan reads that an index lookup
+    would skip, summed over the logged queries"""
+    usage = Counter()
+    for database, sql in queries:
+        for (table, column, kind), count in parse_predicates(sql).items():
+            usage[(database, table, column, kind)] += count
+
+    proposals = []
+    for (database, table, column, kind), count in usage.items():
+        have = indexed.get(database, set())
+        # The primary key and any index on the column serve equality lookups; ILIKE needs trigrams
+        if kind == "btree" and (column == "id" or (table, column, "btree") in have or (table, column, "trgm") in have):
+            continue
+        if kind == "trgm" and (table, column, "trgm") in have:
+            continue
+
+        rows = (sizes or {}).get(database, {}).get(table)
+        proposal = {
+            "database": database,
+            "table": table,
+            "column": column,
+            "kind": kind,
+            "occurrences": count,
+            "sql": create_index_sql(table, column, kind)
+        }
+        if rows:
+            proposal["table_rows"] = int(rows)
+            proposal["estimated_rows_saved"] = int(count * max(rows - math.log2(rows + 1), 0))
+        proposals.append(proposal)
+
+    return sorted(proposals, key=lambda p: (p.get("estimated_rows_saved", 0), p["occurrences"]), reverse=True)
+
+def catalog(databases: Iterable[str]):
+    """Existing indexes and table sizes per database"""
+    indexed, sizes = {}, {}
+    for database in databases:
+        conn = get_db_connection(DATABASES[database])
+        try:
+            indexed[database] = existing_indexes(conn)
+            sizes[database] = table_sizes(conn)
+        finally:
+            conn.close()
+    return indexed, sizes
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Index migration and advisor for the chatbot databases")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate_cmd = commands.add_parser("migrate", help="Create pg_trgm and foreign-key indexes")
+    migrate_cmd.add_argument("--db", choices=sorted(DATABASES), action="append")
+    migrate_cmd.add_argument("--dry-run", action="store_true", help="Print the DDL without running it")
+
+    advise_cmd = commands.add_parser("advise", help="Propose indexes from the SQL in the chatbot log")
+    advise_cmd.add_argument("--log", default=LOG_FILE)
+    advise_cmd.add_argument("--offline", action="store_true",
+                            help="Don't read the catalog, assume only primary keys are indexed")
+    advise_cmd.add_argument("--top", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        for database in args.db or sorted(DATABASES):
+            migrate(database, args.dry_run)
+        return 0
+
+    queries = read_generated_sql(args.log)
+    databases = sorted({database for database, _ in queries})
+    indexed, sizes = ({}, None) if args.offline else catalog(databases)
+    proposals = advise(queries, indexed, sizes)
+
+    print(f"Analyzed {len(queries)} generated queries from {args.log}")
+    for proposal in proposals[:args.top]:
+        benefit = proposal.get("estimated_rows_saved")
+        estimate = f", ~{benefit} rows not scanned" if benefit is not None else ""
+        print(f"{proposal['database']}: {proposal['sql']};  -- used {proposal['occurrences']}x{estimate}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import re
+import math
+import logging
+import threading
+from typing import List, Optional
+from prompts import load_prompt
+from semantic_cache import tokenize
+from config import KNOWLEDGE_TOP_K, KNOWLEDGE_TOKEN_BUDGET
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_HEADER = "YOUR KEY KNOWLEDGE BASE:"
+EXAMPLES_HEADER = "USER QUESTION-RESPONSE EXAMPLES:"
+GUIDELINES_HEADER = "RESPONSE GUIDELINES:"
+
+# Bullets longer than this are split into one chunk per sub-line
+CHUNK_MAX_CHARS = 400
+
+# Roughly 4 characters per token for English text
+CHARS_PER_TOKEN = 4
+
+def stem(token: str) -> str:
+    """Crude prefix stemming so phosphorylation/phosphorylated/phospho match"""
+    return token[:6]
+
+class KnowledgeChunk:
+    __slots__ = ("text", "terms", "length")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.terms = {}
+        for token in tokenize(text):
+            term = stem(token)
+            self.terms[term] = self.terms.get(term, 0) + 1
+        self.length = sum(self.terms.values())
+
+class KnowledgeStore:
+    """BM25 index over topical chunks of the summarizer knowledge base"""
+
+    def __init__(self, template: str, k1: float = 1.5, b: float = 0.75):
+        self.header, knowledge, examples, self.tail = split_template(template)
+        self.chunks = [KnowledgeChunk(text) for text in chunk_knowledge(knowledge) + chunk_examples(examples)]
+        self.k1 = k1
+        self.b = b
+        self.avg_length = sum(c.length for c in self.chunks) / max(len(self.chunks), 1)
+
+        doc_freq = {}
+        for chunk in self.chunks:
+            for term in chunk.terms:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        n = len(self.chunks)
+        self.idf = {term: math.log(1 + (n - df + 0.5) / (df + 0.5)) for term, df in doc_freq.items()}
+
+        logger.info(f"Indexed {len(self.chunks)} knowledge chunks")
+
+    def _score(self, query_terms: List[str], chunk: KnowledgeChunk) -> float:
+        score = 0.0
+        for term in query_terms:
+            tf = chunk.terms.get(term)
+            if not tf:
+                continue
+            norm = tf + self.k1 * (1 - self.b + self.b * chunk.length / self.avg_length)
+            score += self.idf[term] * tf * (self.k1 + 1) / norm
+        return score
+
+    def retrieve(self, query: str, top_k: int = KNOWLEDGE_TOP_K,
+                 token_budget: int = KNOWLEDGE_TOKEN_BUDGET) -> List[str]:
+        """Top-k chunks for a query that fit in the token budget, in document order"""
+        query_terms = list({stem(t) for t in tokenize(query)})
+        scored = [(self._score(query_terms, chunk), i) for i, chunk in enumerate(self.chunks)]
+        ranked = [i for score, i in sorted(scored, reverse=True) if score > 0][:top_k]
+
+        # Nothing matched: the database definitions are the most useful general context
+        if not ranked:
+            ranked = [0, 1][:len(self.chunks)]
+
+        budget = token_budget * CHARS_PER_TOKEN
+        selected = []
+        for i in ranked:
+            size = len(self.chunks[i].text)
+            if selected and size > budget:
+                continue
+            selected.append(i)
+            budget -= size
+
+        return [self.chunks[i].text for i in sorted(selected)]
+
+    def knowledge_section(self, query: str) -> str:
+        """Knowledge base section with only the chunks relevant to the query"""
+        return f"{KNOWLEDGE_HEADER}\n" + "\n".join(self.retrieve(query))
+
+    @property
+    def static_prefix(self) -> str:
+        """Summarizer instructions without the knowledge base, identical for every query"""
+        return f"{self.header}\n\n{self.tail}"
+
+def split_template(template: str):
+    """Split a summarizer template into header, knowledge, examples and the rest"""
+    kb_start = template.find(KNOWLEDGE_HEADER)
+    if kb_start == -1:
+        return template, "", "", ""
+
+    examples_start = template.find(EXAMPLES_HEADER, kb_start)
+    guidelines_start = template.find(GUIDELINES_HEADER, kb_start)
+    if guidelines_start == -1:
+        guidelines_start = len(template)
+    if examples_start == -1:
+        examples_start = guidelines_start
+
+    header = template[:kb_start].strip()
+    knowledge = template[kb_start + len(KNOWLEDGE_HEADER):examples_start].strip()
+    examples = template[examples_start + len(EXAMPLES_HEADER):guidelines_start].strip() if examples_start < guidelines_start else ""
+    tail = template[guidelines_start:].strip()
+    return header, knowledge, examples, tail
+
+def chunk_knowledge(knowledge: str) -> List[str]:
+    """Split the knowledge base into topical chunks, one per top-level bullet"""
+    bullets = []
+    for line in knowledge.splitlines():
+        if not line.strip() or line.strip() == "-":
+            continue
+        if line.startswith("- ") or not bullets:
+            bullets.append([line.rstrip()])
+        else:
+            bullets[-1].append(line.rstrip())
+
+    chunks = []
+    for lines in bullets:
+        text = "\n".join(lines)
+        if len(text) <= CHUNK_MAX_CHARS or len(lines) == 1:
+            chunks.append(text)
+        else:
+            # Large sections become one chunk per sub-line, keeping the heading
+            heading = lines[0].rstrip(":")
+            chunks.extend(f"{heading}: {line.strip()}" for line in lines[1:])
+    return chunks
+
+def chunk_examples(examples: str) -> List[str]:
+    """Split question-response examples into one chunk per Q/A pair"""
+    pairs = re.split(r"\n\s*\n(?=Q:)", examples.strip())
+    return [pair.strip() for pair in pairs if pair.strip()]
+
+_store: Optional[KnowledgeStore] = None
+_store_lock = threading.Lock()
+
+def get_knowledge_store() -> KnowledgeStore:
+    """Shared knowledge store, indexed once on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = KnowledgeStore(load_prompt("summarizer.txt"))
+        return _store
@@ -0,0 +1,287 @@
+import json
+import time
+import logging
+import threading
+import requests
+from typing import Dict, List, Optional
+from config import (LLM_BACKENDS, MODEL_NAME, OLLAMA_KEEP_ALIVE, LLM_BACKEND_MAX_FAILURES,
+                    LLM_BACKEND_EJECT_SECONDS, LLM_BACKEND_HEALTH_INTERVAL,
+                    LLM_CONNECT_TIMEOUT, LLM_TIMEOUT)
+from resilience import DeadlineExceeded, RequestCancelled
+
+logger = logging.getLogger(__name__)
+
+class NoBackendAvailable(Exception):
+    """Raised when every backend that could serve a stage is ejected"""
+
+class LLMBackend:
+    """One inference server, either Ollama or an OpenAI-compatible local server"""
+
+    def __init__(self, url: str, kind: str = "ollama", model: str = MODEL_NAME,
+                 stages: Optional[List[str]] = None, name: Optional[str] = None):
+        if kind not in ("ollama", "openai"):
+            raise ValueError(f"Unknown backend kind: {kind}")
+        self.url = url.rstrip("/")
+        self.kind = kind
+        self.model = model
+        self.stages = set(stages) if stages else None
+        self.name = name or self.url
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until: Optional[float] = None
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until is not None
+
+    def health_url(self) -> str:
+        return f"{self.url}/api/tags" if self.kind == "ollama" else f"{self.url}/v1/models"
+
+    def check_health(self, timeout: float = 2.0) -> bool:
+        try:
+            return requests.get(self.health_url(), timeout=timeout).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def generate(self, prompt: str, system: Optional[str], options: Dict, output_format=None,
+                 timeout: Optional[float] = None, deadline=None, stats: Optional[Dict] = None) -> str:
+        """Run one streaming generation and return the full text within timeout seconds;
+        cancelling the deadline closes the stream, which stops generation on the server.
+        stats, if given, receives the prompt_tokens and completion_tokens the server reports"""
+        timeout = timeout or LLM_TIMEOUT
+        if self.kind == "openai":
+            request = self._openai_request(prompt, system, options, output_format, usage=stats is not None)
+        else:
+            request = self._ollama_request(prompt, system, options, output_format)
+
+        url, payload, extract = request
+        ends_at = time.monotonic() + timeout
+        r = requests.post(url, json=payload, stream=True, timeout=(LLM_CONNECT_TIMEOUT, timeout))
+        unregister = deadline.on_cancel(lambda: _abort_stream(r)) if deadline else (lambda: None)
+        try:
+            r.raise_for_status()
+            output = ""
+            for line in r.iter_lines():
+                if deadline and deadline.cancelled:
+                    raise RequestCancelled(f"LLM generation on {self.name} cancelled")
+                if line:
+                    chunk, done, usage = extract(line)
+                    output += chunk
+                    if usage and stats is not None:
+                        stats.update(usage)
+                    if done:
+                        break
+                if time.monotonic() > ends_at:
+                    raise DeadlineExceeded(f"LLM generation on {self.name} exceeded {timeout:.1f}s")
+            if deadline and deadline.cancelled:
+                raise RequestCancelled(f"LLM generation on {self.name} cancelled")
+            return output
+        except (RequestCancelled, DeadlineExceeded):
+            raise
+        except Exception as e:
+            # Reading from a stream closed by cancel() fails in various ways
+            if deadline and deadline.cancelled:
+                raise RequestCancelled(f"LLM generation on {self.name} cancelled") from e
+            raise
+        finally:
+            unregister()
+            # Closing the stream makes the server stop generating
+            r.close()
+
+    def _ollama_request(self, prompt, system, options, output_format):
+        if system:
+            url = f"{self.url}/api/chat"
+            payload = {
+                "model": self.model,
+                "messages": [
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": prompt}
+                ],
+                "options": options,
+                "keep_alive": OLLAMA_KEEP_ALIVE
+            }
+        else:
+            url = f"{self.url}/api/generate"
+            payload = {
+                "model": self.model,
+                "prompt": prompt,
+                "options": options,
+                "keep_alive": OLLAMA_KEEP_ALIVE
+            }
+        if output_format:
+            payload["format"] = output_format
+
+        def extract(line):
+            data = json.loads(line)
+            usage = None
+            if data.get("done") and "eval_count" in data:
+                usage = {"prompt_tokens": data.get("prompt_eval_count", 0), "completion_tokens": data["eval_count"]}
+            if "response" in data:
+                return data["response"], data.get("done", False), usage
+            return (data.get("message") or {}).get("content", ""), data.get("done", False), usage
+
+        return url, payload, extract
+
+    def _openai_request(self, prompt, system, options, output_format, usage=False):
+        messages = [{"role": "user", "content": prompt}]
+        if system:
+            messages.insert(0, {"role": "system", "content": system})
+
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": options.get("num_predict"),
+            "stream": True
+        }
+        if options.get("stop"):
+            payload["stop"] = options["stop"]
+        if output_format:
+            payload["response_format"] = {"type": "json_object"}
+        if usage:
+            # Token counts come in a last chunk, only when asked for
+            payload["stream_options"] = {"include_usage": True}
+
+        def extract(line):
+            if not line.startswith(b"data:"):
+                return "", False, None
+            data = line[5:].strip()
+            if data == b"[DONE]":
+                return "", True, None
+            data = json.loads(data)
+            text = "".join((choice.get("delta") or {}).get("content") or ""
+                           for choice in data.get("choices", []))
+            usage = data.get("usage")
+            if usage:
+                usage = {"prompt_tokens": usage.get("prompt_tokens", 0),
+                         "completion_tokens": usage.get("completion_tokens", 0)}
+            return text, False, usage
+
+        return f"{self.url}/v1/chat/completions", payload, extract
+
+def _abort_stream(response):
+    """Close a streaming response from another thread, interrupting a blocked read"""
+    shutdown = getattr(response.raw, "shutdown", None)  # urllib3 >= 2.3
+    if shutdown:
+        shutdown()
+    response.close()
+
+class BackendPool:
+    """Least-outstanding-requests balancing with ejection of failing backends"""
+
+    def __init__(self, backends: List[LLMBackend], max_failures: int = LLM_BACKEND_MAX_FAILURES,
+                 eject_seconds: float = LLM_BACKEND_EJECT_SECONDS,
+                 health_interval: float = LLM_BACKEND_HEALTH_INTERVAL):
+        if not backends:
+            raise ValueError("At least one LLM backend is required")
+        self.backends = backends
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._next = 0
+        self._health_thread: Optional[threading.Thread] = None
+
+    def acquire(self, stage: Optional[str] = None, exclude=()) -> LLMBackend:
+        """Pick the serving backend with the fewest outstanding requests"""
+        with self._lock:
+            candidates = self._candidates(stage, exclude)
+        if not candidates:
+            # Last resort before failing: probe ejected backends right away
+            self._readmit_recovered(force=True)
+
+        with self._lock:
+            candidates = self._candidates(stage, exclude)
+            if not candidates:
+                raise NoBackendAvailable(f"No LLM backend available for stage '{stage}'")
+
+            # Rotate the starting point so ties are spread round-robin
+            self._next = (self._next + 1) % len(candidates)
+            ordered = candidates[self._next:] + candidates[:self._next]
+            backend = min(ordered, key=lambda b: b.outstanding)
+            backend.outstanding += 1
+            return backend
+
+    def _candidates(self, stage, exclude) -> List[LLMBackend]:
+        live = [b for b in self.backends if not b.ejected and b not in exclude]
+        # Backends pinned to this stage win over general-purpose ones
+        return [b for b in live if b.stages and stage in b.stages] or \
+               [b for b in live if b.stages is None]
+
+    def release(self, backend: LLMBackend, success: Optional[bool]):
+        """Return a backend after a request, ejecting it after repeated failures;
+        success=None leaves the failure count alone (e.g. our own deadline expired)"""
+        with self._lock:
+            backend.outstanding -= 1
+            if success is None:
+                return
+            if success:
+                backend.consecutive_failures = 0
+                return
+
+            backend.consecutive_failures += 1
+            if backend.consecutive_failures >= self.max_failures and not backend.ejected:
+                backend.ejected_until = time.time() + self.eject_seconds
+                logger.warning(f"Ejected LLM backend {backend.name} after {backend.consecutive_failures} failures")
+            ejected = backend.ejected
+
+        if ejected:
+            self._ensure_health_checks()
+
+    def _readmit_recovered(self, force: bool = False):
+        """Re-admit ejected backends whose cooldown passed and that pass a health check"""
+        now = time.time()
+        for backend in self.backends:
+            if backend.ejected and (force or backend.ejected_until <= now):
+                if backend.check_health():
+                    with self._lock:
+                        backend.ejected_until = None
+                        backend.consecutive_failures = 0
+                    logger.info(f"Re-admitted LLM backend {backend.name}")
+                else:
+                    with self._lock:
+                        backend.ejected_until = now + self.eject_seconds
+
+    def _ensure_health_checks(self):
+        with self._lock:
+            if self._health_thread and self._health_thread.is_alive():
+                return
+            self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+            self._health_thread.start()
+
+    def _health_loop(self):
+        # Runs only while some backend is ejected
+        while any(b.ejected for b in self.backends):
+            time.sleep(self.health_interval)
+            self._readmit_recovered()
+
+    def status(self) -> List[Dict]:
+        with self._lock:
+            return [{
+                "name": b.name,
+                "kind": b.kind,
+                "model": b.model,
+                "stages": sorted(b.stages) if b.stages else None,
+                "outstanding": b.outstanding,
+                "ejected": b.ejected
+            } for b in self.backends]
+
+def create_pool(configs: List[Dict]) -> BackendPool:
+    """Build a pool from LLM_BACKENDS-style dicts"""
+    return BackendPool([LLMBackend(**cfg) for cfg in configs])
+
+_pool: Optional[BackendPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> BackendPool:
+    """Shared backend pool built from config"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool(LLM_BACKENDS)
+        return _pool
+
+def set_pool(pool: Optional[BackendPool]):
+    """Replace the shared pool, None rebuilds it from config on next use"""
+    global _pool
+    with _pool_lock:
+        _pool = pool
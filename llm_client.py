@@ -1,33 +1,89 @@
-import requests
-import json
 import logging
-from config import OLLAMA_GENERATE_URL, MODEL_NAME, NUM_CTX, NUM_PREDICT
+import requests
+from config import NUM_CTX, NUM_PREDICT, GENERATION_PROFILES
+from llm_backends import get_pool
+from resilience import DeadlineExceeded, RequestCancelled
+from shared_results import current_shared_results, result_key
+from profiling import span
+from cassette import current_cassette
 
 logger = logging.getLogger(__name__)
 
-def query_llm(prompt: str, num_ctx=NUM_CTX, num_predict=NUM_PREDICT) -> str:
-    logger.info(f"Querying LLM with prompt length: {len(prompt)}")
+def build_options(stage=None, num_ctx=None, num_predict=None, stop=None, format=None):
+    """Resolve generation options for a stage, explicit arguments win"""
+    profile = GENERATION_PROFILES.get(stage, {}) if stage else {}
     
-    payload = {
-        "model": MODEL_NAME,
-        "prompt": prompt,
-        "options": {"num_ctx": num_ctx, "num_predict": num_predict}
+    options = {
+        "num_ctx": num_ctx or profile.get("num_ctx", NUM_CTX),
+        "num_predict": num_predict or profile.get("num_predict", NUM_PREDICT)
     }
+    stop = stop if stop is not None else profile.get("stop")
+    if stop:
+        options["stop"] = stop
+    
+    return options, format if format is not None else profile.get("format")
+
+def query_llm(prompt: str, num_ctx=None, num_predict=None, stage=None, stop=None, format=None,
+              system=None, timeout=None, deadline=None, stats=None) -> str:
+    """Generate a completion on the least busy backend for the stage; with a
+    system prompt the static system part forms a prefix the server can keep cached.
+    timeout bounds the whole generation in seconds (LLM_TIMEOUT when None),
+    cancelling the request's deadline aborts the generation. A stats dict gets the
+    backend and the token counts it reports; shared or replayed results have none"""
+    if deadline is not None and deadline.cancelled:
+        raise RequestCancelled(f"Request cancelled before LLM stage '{stage}'")
+    if timeout is not None and timeout <= 0:
+        raise DeadlineExceeded(f"No time left for LLM stage '{stage}'")
+    
+    options, output_format = build_options(stage, num_ctx, num_predict, stop, format)
+    logger.info(f"Querying LLM ({stage or 'default'}) with prompt length: {len(prompt) + len(system or '')}")
+    
+    def compute():
+        # Queries of a batch share identical generations
+        shared = current_shared_results()
+        if shared is not None:
+            key = result_key("llm", stage, system, prompt, options, output_format)
+            return shared.get_or_compute(key, lambda: _generate(prompt, system, stage, options, output_format,
+                                                                timeout, deadline, stats), timeout)
+        return _generate(prompt, system, stage, options, output_format, timeout, deadline, stats)
+
+    with span("llm", stage or "default", prompt_chars=len(prompt) + len(system or "")):
+        cassette = current_cassette()
+        if cassette is not None:
+            return cassette.call("llm", stage or "default", (stage, system, prompt, options, output_format),
+                                 prompt, compute)
+        return compute()
+
+def _generate(prompt, system, stage, options, output_format, timeout, deadline, stats=None) -> str:
+    pool = get_pool()
+    tried = []
     
-    try:
-        r = requests.post(OLLAMA_GENERATE_URL, json=payload, stream=True)
-        logger.info(f"LLM request sent, status: {r.status_code}")
-        
-        output = ""
-        for line in r.iter_lines():
-            if line:
-                data = json.loads(line)
-                if "response" in data:
-                    output += data["response"]
-        
-        logger.info(f"LLM response received (length: {len(output)})")
-        return output.strip()
-        
-    except Exception as e:
-        logger.error(f"LLM query failed: {e}")
-        raise
\ No newline at end of file
+    while True:
+        backend = pool.acquire(stage, exclude=tried)
+        try:
+            output = backend.generate(prompt, system, options, output_format, timeout=timeout, deadline=deadline,
+                                      stats=stats)
+            pool.release(backend, success=True)
+            if stats is not None:
+                stats["backend"] = backend.name
+            logger.info(f"LLM response received from {backend.name} (length: {len(output)})")
+            return output.strip()
+        except DeadlineExceeded:
+            pool.release(backend, success=None)
+            logger.warning(f"LLM stage '{stage}' ran out of time on {backend.name}")
+            raise
+        except RequestCancelled:
+            pool.release(backend, success=None)
+            logger.info(f"LLM stage '{stage}' cancelled on {backend.name}")
+            raise
+        except requests.ConnectionError as e:
+            # Nothing was generated yet, so another backend can take the request
+            pool.release(backend, success=False)
+            tried.append(backend)
+            logger.warning(f"LLM backend {backend.name} unreachable, trying another: {e}")
+            if len(tried) >= len(pool.backends):
+                raise
+        except Exception as e:
+            pool.release(backend, success=False)
+            logger.error(f"LLM query failed on {backend.name}: {e}")
+            raise
@@ -0,0 +1,26 @@
+import threading
+from collections import Counter
+from typing import Dict
+
+# Process-wide request counters, exposed on /health
+_counters = Counter()
+_lock = threading.Lock()
+
+REQUESTS_CANCELLED = "requests_cancelled"
+
+def increment(name: str, amount: int = 1):
+    with _lock:
+        _counters[name] += amount
+
+def get(name: str) -> int:
+    with _lock:
+        return _counters[name]
+
+def snapshot() -> Dict[str, int]:
+    """Copy of all counters"""
+    with _lock:
+        return dict(_counters)
+
+def reset():
+    with _lock:
+        _counters.clear()
@@ -1,44 +1,100 @@
 import json
 import logging
 from lexicon import classify_query
-from prompts import load_prompt
+from prompts import format_prompt_parts
 from llm_client import query_llm
 from db_utils import run_sql, run_project_sql, run_mutation_sql
+from renderer import choose_response_mode, render_response
+from result_merge import merge_results, should_merge, rows_shown
+from result_set import ResultSet, dumps_limited
+from result_pages import ResultPages
+from sql_index import get_sql_index
+from protein_cards import answer_from_card
+from enrichment_store import get_enrichment_store
+from knowledge_store import get_knowledge_store
 from conversation_manager import ConversationManager
+from resilience import Deadline, RequestCancelled, CircuitOpen
+import metrics
+from config import (SPECULATIVE_SQL, SPECULATIVE_EXECUTE, SPECULATIVE_WORKERS,
+                    REQUEST_DEADLINE, STAGE_BUDGETS, SUMMARY_MIN_SECONDS)
+from structured_logging import setup_logging, request_scope, stage_timings, StageClock, log_body
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import re
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chatbot.log'),
-        logging.StreamHandler()  # Also print to console
-    ]
-)
+# Configure logging, written to chatbot.log and the console by a background thread
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # Global conversation manager instance
 conversation_manager = ConversationManager(max_history=4)
 
-def handle_query(user_query: str):
-    """Main conversational query handler with logging"""
-    global conversation_manager
-    
+SQL_TEMPLATES = {"scop3p": "sql_scop3p.txt", "scop3ptm": "sql_scop3ptm.txt"}
+
+# Workers for SQL generation that overlaps intent classification
+_speculation_executor = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative-sql")
+
+def handle_query(user_query: str, response_mode: str = None, deadline: Deadline = None,
+                 manager: ConversationManager = None):
+    """Main conversational query handler with logging; raises RequestCancelled
+    if the deadline is cancelled (e.g. the client disconnected). manager holds the
+    conversation state, the global conversation by default"""
+    deadline = deadline or Deadline(REQUEST_DEADLINE)
+    manager = manager or conversation_manager
+    with request_scope():
+        try:
+            return _handle_query(user_query, response_mode, deadline, manager)
+        except RequestCancelled as e:
+            metrics.increment(metrics.REQUESTS_CANCELLED)
+            logger.warning(f"Query cancelled after {deadline.elapsed():.1f}s: {e}")
+            raise
+        finally:
+            logger.info("Request finished", extra={"stages": stage_timings(), "elapsed": round(deadline.elapsed(), 4)})
+
+def _handle_query(user_query: str, response_mode: str, deadline: Deadline, manager: ConversationManager):
     logger.info(f"Processing query: '{user_query}'")
+    clock = StageClock()
+    
+    # Overview questions about one protein are answered from its precomputed card
+    card_answer = answer_from_card(user_query, response_mode, deadline)
+    if card_answer is not None:
+        response, card = card_answer
+        clock.lap("card")
+        logger.info(f"Answered from the protein card for {card['accession']}")
+        manager.state.current_context["recent_entities"] = [card["accession"]]
+        manager.record_interaction(user_query, response)
+        return response
+    
+    # Start SQL generation alongside intent classification when the lexicon is sure
+    speculation = start_speculation(user_query, deadline) if SPECULATIVE_SQL else None
     
     # Step 1: Classify intent using LLM
     logger.info("Step 1: Classifying intent...")
     try:
-        processing_result = conversation_manager.process_query(user_query)
-        logger.info(f"Intent classification result: {processing_result}")
+        processing_result = manager.process_query(user_query, deadline=deadline)
+        clock.lap("classification")
+        log_body(logger, "Intent classification result", processing_result)
+    except RequestCancelled:
+        if speculation:
+            speculation.cancel()
+        raise
     except Exception as e:
         logger.error(f"Intent classification failed: {e}")
+        if speculation:
+            speculation.cancel()
         return "I'm having trouble understanding your question. Could you please rephrase it?"
     
+    if deadline.cancelled:
+        if speculation:
+            speculation.cancel()
+        deadline.check("routing")
+    
     # Step 2: Route based on classification
     if processing_result["skip_pipeline"]:
         logger.info("Using direct response (skipping database pipeline)")
+        if speculation:
+            logger.info(f"Discarding speculative SQL for {processing_result['action']}")
+            speculation.cancel()
         response = processing_result["response"]
     else:
         logger.info("Proceeding to database pipeline...")
@@ -48,18 +104,30 @@ def handle_query(user_query: str):
             logger.warning("No resolved query found, using original")
             actual_query = user_query
         
+        if speculation and not speculation.matches(actual_query):
+            logger.info("Resolved query differs from original, discarding speculative SQL")
+            speculation.cancel()
+            speculation = None
+        
         logger.info(f"Database query: '{actual_query}'")
-        response = handle_domain_query(actual_query)
+        response = handle_domain_query(actual_query, response_mode, speculation=speculation, deadline=deadline,
+                                       manager=manager)
     
-    # Step 3: Record the interaction
-    conversation_manager.record_interaction(user_query, response)
+    # Step 3: Record the interaction, unless nobody is waiting for it any more
+    if deadline.cancelled:
+        deadline.check("recording")
+    manager.record_interaction(user_query, response)
     logger.info(f"Response generated (length: {len(response)})")
     
     return response
 
-def handle_domain_query(user_query: str):
+def handle_domain_query(user_query: str, response_mode: str = None, speculation=None, deadline: Deadline = None,
+                        manager: ConversationManager = None):
     """Handle domain-specific queries with logging"""
     logger.info(f"Starting domain query processing for: '{user_query}'")
+    deadline = deadline or Deadline(REQUEST_DEADLINE)
+    manager = manager or conversation_manager
+    clock = StageClock()
     
     # Step 1: Lexicon route
     logger.info("Step 1: Lexicon routing...")
@@ -68,11 +136,13 @@ def handle_domain_query(user_query: str):
 
     # Step 2: Router fallback if ambiguous
     if routing["mode"] == "llm":
+        _check_cancelled(deadline, "routing")
         logger.info("Step 2: Using LLM router fallback...")
         try:
-            router_prompt = load_prompt("router.txt").format(user_query=user_query)
-            router_response = query_llm(router_prompt)
-            logger.info(f"Router LLM response: {router_response}")
+            router_system, router_prompt = format_prompt_parts("router.txt", user_query=user_query)
+            router_response = query_llm(router_prompt, system=router_system, stage="router",
+                                        timeout=deadline.budget("routing"), deadline=deadline)
+            log_body(logger, "Router LLM response", router_response)
             routing = safe_json_parse(router_response)
             logger.info(f"Parsed router result: {routing}")
         except Exception as e:
@@ -80,210 +150,322 @@ def handle_domain_query(user_query: str):
             routing = {
                 "mode": "sql",
                 "db": "both", 
-                "needs_projects": False,
-                "needs_mutations": False
+                "needs_projects": routing.get("needs_projects", False),
+                "needs_mutations": routing.get("needs_mutations", False)
             }
 
+    clock.lap("routing")
     results = {}
+    sql_used = {}
+    unavailable = []
     
     # Step 3: SQL generation with error handling
     logger.info("Step 3: SQL generation and execution...")
+    sql_index = get_sql_index()
     
-    if routing["db"] in ["scop3p", "both"]:
-        logger.info("Processing SCOP3P database...")
+    for db in route_databases(routing):
+        label = db.upper()
+        _check_cancelled(deadline, "sql", speculation)
+        if deadline.expired:
+            logger.warning(f"Deadline reached, skipping {label} and returning partial results")
+            break
+        logger.info(f"Processing {label} database...")
         try:
-            sql_prompt = build_sql_prompt("sql_scop3p.txt", user_query, "scop3p")
-            raw_sql = query_llm(sql_prompt)
-            cleaned_sql = clean_sql_response(raw_sql)
-            logger.info(f"Generated SCOP3P SQL: {cleaned_sql}")
-            
-            if cleaned_sql and cleaned_sql.strip():
-                results["scop3p"] = run_sql("scop3p", cleaned_sql)
-                logger.info(f"SCOP3P results: {len(results['scop3p'])} rows")
+            # Known-good SQL for questions from the training corpus skips generation
+            indexed_sql = sql_index.lookup(user_query, db) if sql_index else None
+            speculative = speculation.take(db) if speculation and not indexed_sql else None
+            if indexed_sql:
+                cleaned_sql, rows = indexed_sql, None
+                logger.info(f"Using indexed {label} SQL: {cleaned_sql}", extra={"sql": cleaned_sql})
+            elif speculative:
+                cleaned_sql, rows = speculative
+                logger.info(f"Using speculative {label} SQL: {cleaned_sql}", extra={"sql": cleaned_sql})
             else:
-                logger.warning("Empty SQL generated for SCOP3P")
-                results["scop3p"] = []
-                
-        except Exception as e:
-            logger.error(f"SCOP3P processing failed: {e}")
-            results["scop3p"] = []
-
-    if routing["db"] in ["scop3ptm", "both"]:
-        logger.info("Processing SCOP3PTM database...")
-        try:
-            sql_prompt = build_sql_prompt("sql_scop3ptm.txt", user_query, "scop3ptm")
-            raw_sql = query_llm(sql_prompt)
-            cleaned_sql = clean_sql_response(raw_sql)
-            logger.info(f"Generated SCOP3PTM SQL: {cleaned_sql}")
+                cleaned_sql, rows = generate_sql(db, user_query, timeout=deadline.budget("sql"), deadline=deadline), None
+                logger.info(f"Generated {label} SQL: {cleaned_sql}", extra={"sql": cleaned_sql})
             
             if cleaned_sql and cleaned_sql.strip():
-                results["scop3ptm"] = run_sql("scop3ptm", cleaned_sql)
-                logger.info(f"SCOP3PTM results: {len(results['scop3ptm'])} rows")
+                sql_used[db] = cleaned_sql
+                results[db] = rows if rows is not None else run_sql(db, cleaned_sql, timeout=deadline.budget("sql"),
+                                                                    deadline=deadline)
+                logger.info(f"{label} results: {len(results[db])} rows")
             else:
-                logger.warning("Empty SQL generated for SCOP3PTM")
-                results["scop3ptm"] = []
+                logger.warning(f"Empty SQL generated for {label}")
+                results[db] = ResultSet()
                 
+        except CircuitOpen as e:
+            logger.error(f"{label} database unavailable: {e}")
+            unavailable.append(db)
+            results[db] = ResultSet()
         except Exception as e:
-            logger.error(f"SCOP3PTM processing failed: {e}")
-            results["scop3ptm"] = []
+            logger.error(f"{label} processing failed: {e}")
+            results[db] = ResultSet()
 
+    if speculation:
+        speculation.cancel()
+
+    clock.lap("sql")
+    
     # Log total results
     total_results = sum(len(res) for res in results.values())
     logger.info(f"Total database results: {total_results} rows")
+    
+    # A database that is down is not an answer of "no results"
+    if unavailable and not total_results:
+        names = " and ".join(db.upper() for db in unavailable)
+        return (f"The {names} {'databases are' if len(unavailable) > 1 else 'database is'} temporarily "
+                f"unavailable, so I can't look this up right now. Please try again in a minute.")
 
     # Step 4: Enrichment with error handling
+    _check_cancelled(deadline, "enrichment")
     logger.info("Step 4: Enrichment processing...")
     projects, mutations = {}, {}
     
+    # Enrichment is the first thing dropped when the summary would run out of time
+    if deadline.remaining() < STAGE_BUDGETS["enrichment"] + SUMMARY_MIN_SECONDS:
+        logger.warning(f"Skipping enrichment, only {deadline.remaining():.1f}s left")
+        routing = dict(routing, needs_projects=False, needs_mutations=False)
+    
+    # Precomputed per-protein lists answer without a query when they're current
+    enrichment = get_enrichment_store()
+    
     if routing.get("needs_projects"):
         logger.info("Fetching project information...")
         for db, res in results.items():
             try:
                 ids = extract_ids(res)
                 logger.info(f"Extracted {len(ids)} protein IDs from {db}")
-                if ids:
+                precomputed = enrichment.projects(db, ids) if enrichment and ids else None
+                if precomputed is not None:
+                    projects[db] = precomputed
+                    logger.info(f"Found {len(projects[db])} precomputed projects for {db}")
+                elif ids:
                     proj_sql = build_project_sql(db, ids)
-                    projects[db] = run_project_sql(db, proj_sql)
+                    projects[db] = run_project_sql(db, proj_sql, timeout=deadline.budget("enrichment"),
+                                                   deadline=deadline)
                     logger.info(f"Found {len(projects[db])} projects for {db}")
                 else:
-                    projects[db] = []
+                    projects[db] = ResultSet()
             except Exception as e:
                 logger.error(f"Project enrichment failed for {db}: {e}")
-                projects[db] = []
+                projects[db] = ResultSet()
 
     if routing.get("needs_mutations"):
         logger.info("Fetching mutation information...")
         for db, res in results.items():
             try:
                 ids = extract_ids(res)
-                if ids:
-                    mutations[db] = run_mutation_sql(db, ids)
+                precomputed = enrichment.mutations(db, ids) if enrichment and ids else None
+                if precomputed is not None:
+                    mutations[db] = precomputed
+                    logger.info(f"Found {len(mutations[db])} precomputed mutations for {db}")
+                elif ids:
+                    mutations[db] = run_mutation_sql(db, ids, timeout=deadline.budget("enrichment"),
+                                                     deadline=deadline)
                     logger.info(f"Found {len(mutations[db])} mutations for {db}")
                 else:
-                    mutations[db] = []
+                    mutations[db] = ResultSet()
             except Exception as e:
                 logger.error(f"Mutation enrichment failed for {db}: {e}")
-                mutations[db] = []
+                mutations[db] = ResultSet()
 
-    # Step 5: Summarizer with conversation context
-    logger.info("Step 5: Generating summary...")
+    clock.lap("enrichment")
+    
+    # Step 5: Render directly when the results don't need explaining
+    _check_cancelled(deadline, "rendering")
+    try:
+        mode = choose_response_mode(results, projects, mutations, response_mode)
+    except ValueError as e:
+        logger.warning(f"{e}, using summarizer instead")
+        mode = "prose"
+    
+    # Out of time for the summarizer: return the partial results as they are
+    if mode == "prose" and total_results and deadline.remaining() < SUMMARY_MIN_SECONDS:
+        logger.warning(f"Only {deadline.remaining():.1f}s left, rendering results without summarizer")
+        mode = "table"
+    logger.info(f"Response mode: {mode}")
+
+    if mode != "prose":
+        answer = render_response(mode, user_query, results, projects, mutations)
+        clock.lap("render")
+        logger.info(f"Rendered {mode} response without summarizer (length: {len(answer)})")
+        return _keep_pages(manager, user_query, results, sql_used, results_shown(results), answer)
+
+    # Step 6: Summarizer with conversation context
+    logger.info("Step 6: Generating summary...")
     try:
         def has_meaningful_data(data_dict):
             if not data_dict:
                 return False
             for key, value in data_dict.items():
-                if isinstance(value, list) and len(value) > 0:
+                if isinstance(value, (list, ResultSet)) and len(value) > 0:
                     return True
                 elif value and value != []:
                     return True
             return False
         
-        # Build the dynamic prompt
+        # Build the dynamic prompt, starting with the knowledge relevant to this query
+        store = get_knowledge_store()
         prompt_sections = []
+        prompt_sections.append(store.knowledge_section(user_query))
         prompt_sections.append(f"USER QUERY: {user_query}")
         
         # Add context status to prevent hallucination
-        context = conversation_manager.get_conversation_context()
+        context = manager.get_conversation_context()
         if context:
             prompt_sections.append(f"CONVERSATION CONTEXT (reference this if relevant):\n{context}")
         else:
             prompt_sections.append("CONVERSATION CONTEXT: None - treat as standalone query")
         
-        # Add database results if available
-        if has_meaningful_data(results):
-            primary_json = json.dumps(results, indent=2, default=str)[:2000]
+        # Add database results if available; "show more" continues after the rows the summarizer saw
+        shown = {}
+        if has_meaningful_data(results) and should_merge(results):
+            # Rows for the same site from both databases are sent once, with a source column
+            merged = merge_results(results)
+            included = {}
+            merged_rows = ResultSet(merged["columns"], merged["rows"])
+            merged_json = f"{json.dumps(merged['counts'])}\n{dumps_limited({'merged': merged_rows}, 2000, included)}"
+            # Paging goes on after the database rows the merged rows shown came from
+            shown = rows_shown(merged, included["merged"])
+            prompt_sections.append(f"DATABASE RESULTS (Scop3P and Scop3PTM merged by accession, position and "
+                                   f"residue; 'source' shows which database has each row):\n{merged_json}")
+            logger.info(f"Added merged database results to prompt: {merged['counts']}")
+        elif has_meaningful_data(results):
+            primary_json = dumps_limited(results, 2000, included=shown)
             prompt_sections.append(f"DATABASE RESULTS:\n{primary_json}")
             logger.info("Added database results to prompt")
         else:
             prompt_sections.append("DATABASE RESULTS: No results found in the database for this query.")
             logger.warning("No database results found")
         
+        if unavailable:
+            prompt_sections.append(f"DATABASE STATUS: {', '.join(db.upper() for db in unavailable)} could not be "
+                                   f"reached, so its results are missing; say so in the answer.")
+        
         # Add project information if available
         if has_meaningful_data(projects):
-            project_json = json.dumps(projects, indent=2, default=str)[:2000]
+            project_json = dumps_limited(projects, 2000)
             prompt_sections.append(f"PROJECT INFORMATION:\n{project_json}")
             logger.info("Added project info to prompt")
         
         # Add mutation data if available
         if has_meaningful_data(mutations):
-            mutation_json = json.dumps(mutations, indent=2, default=str)[:2000]
+            mutation_json = dumps_limited(mutations, 2000)
             prompt_sections.append(f"MUTATION DATA:\n{mutation_json}")
             logger.info("Added mutation data to prompt")
         
-        # Load the base template and combine with data sections
-        base_template = load_prompt("summarizer.txt")
-        data_content = "\n\n".join(prompt_sections)
-        summary_prompt = f"{base_template}\n\n{data_content}"
+        # The static instructions are identical on every call, the data goes in the user message
+        summary_prompt = "\n\n".join(prompt_sections)
         
-        logger.info(f"Summary prompt length: {len(summary_prompt)} chars")
+        logger.info(f"Summary prompt length: {len(store.static_prefix) + len(summary_prompt)} chars")
         logger.info("Sending to LLM for final response...")
         
-        answer = query_llm(summary_prompt, num_predict=800)
+        answer = query_llm(summary_prompt, system=store.static_prefix, stage="summary",
+                           timeout=deadline.budget("summary"), deadline=deadline)
+        clock.lap("summary")
         logger.info(f"Final answer generated (length: {len(answer)})")
         
-        return answer
+        return _keep_pages(manager, user_query, results, sql_used, shown, answer)
+    except RequestCancelled:
+        raise
     except Exception as e:
         logger.error(f"Summary generation failed: {e}")
+        if total_results:
+            answer = render_response("table", user_query, results, projects, mutations)
+            return _keep_pages(manager, user_query, results, sql_used, results_shown(results), answer)
         import traceback
         traceback.print_exc()
         return f"I encountered an error processing your query: {user_query}. Please try rephrasing your question."
         
-def build_sql_prompt(template_file, user_query, database):
-    """Build SQL generation prompt for specific database"""
-    try:
-        template = load_prompt(template_file)
-        return template.format(user_query=user_query, database=database)
-    except Exception:
-        return f"Generate a simple SQL query for {database} database based on: {user_query}"
+def results_shown(results):
+    """Rendered tables show every row"""
+    return {db: len(rows) for db, rows in results.items()}
 
-def extract_ids(results):
-    """Extract protein IDs from query results for enrichment"""
-    if not results:
-        return []
+def _keep_pages(manager, user_query, results, sql_used, shown, answer):
+    """Keep the results for "show more" follow-ups and offer the rows not shown yet"""
+    pages = ResultPages(user_query, results, sql_used, shown)
+    manager.state.pages = pages
+    return pages.offer(answer)
+
+def _check_cancelled(deadline, stage, speculation=None):
+    """Stage boundary: stop here if the request was cancelled"""
+    if deadline.cancelled:
+        if speculation:
+            speculation.cancel()
+        deadline.check(stage)
+
+def route_databases(routing):
+    """Databases to query for a routing decision"""
+    if routing.get("db") == "both":
+        return ["scop3p", "scop3ptm"]
+    if routing.get("db") in SQL_TEMPLATES:
+        return [routing["db"]]
+    return []
+
+def generate_sql(database, user_query, timeout=None, deadline=None, stats=None):
+    """Generate and clean SQL for one database; stats receives the LLM token counts"""
+    sql_system, sql_prompt = build_sql_prompt_parts(SQL_TEMPLATES[database], user_query, database)
+    raw_sql = query_llm(sql_prompt, system=sql_system, stage="sql", timeout=timeout, deadline=deadline,
+                        stats=stats)
+    return clean_sql_response(raw_sql)
+
+def _speculative_sql(database, user_query, execute, deadline):
+    cleaned_sql = generate_sql(database, user_query, timeout=deadline.budget("sql"), deadline=deadline)
+    rows = None
+    if execute and cleaned_sql and cleaned_sql.strip():
+        rows = run_sql(database, cleaned_sql, timeout=deadline.budget("sql"), deadline=deadline)
+    return cleaned_sql, rows
+
+class SpeculativeSQL:
+    """SQL generation started before intent classification has finished"""
     
-    protein_ids = set()
-    for row in results:
+    def __init__(self, user_query, routing, execute=False, deadline=None):
+        self.user_query = user_query
+        self.routing = routing
+        deadline = deadline or Deadline(REQUEST_DEADLINE)
+        self.futures = {
+            # Run in a copy of the request context so the worker's logs keep the request id
+            db: _speculation_executor.submit(contextvars.copy_context().run,
+                                             _speculative_sql, db, user_query, execute, deadline)
+            for db in route_databases(routing)
+        }
+    
+    def matches(self, query):
+        """Whether the speculative work was done for this query"""
+        return _normalize_query(query) == _normalize_query(self.user_query)
+    
+    def take(self, database):
+        """Wait for the speculative (sql, rows) of a database, None if unavailable or empty"""
+        future = self.futures.pop(database, None)
+        if future is None or future.cancelled():
+            return None
         try:
-            if 'id' in row and row['id'] is not None:
-                protein_ids.add(row['id'])
-            if 'l_protein_id' in row and row['l_protein_id'] is not None:
-                protein_ids.add(row['l_protein_id'])
-            if 'protein_id' in row and row['protein_id'] is not None:
-                protein_ids.add(row['protein_id'])
-        except Exception:
-            continue
+            cleaned_sql, rows = future.result()
+        except Exception as e:
+            logger.warning(f"Speculative SQL for {database} failed: {e}")
+            return None
+        if not cleaned_sql or not cleaned_sql.strip():
+            logger.warning(f"Speculative SQL for {database} was empty, generating again")
+            return None
+        return cleaned_sql, rows
     
-    return list(protein_ids)
+    def cancel(self):
+        """Cancel pending work; generations already running are discarded"""
+        for future in self.futures.values():
+            future.cancel()
+        self.futures = {}
 
-def build_project_sql(database, protein_ids):
-    """Build SQL to fetch project information"""
-    if not protein_ids:
-        return "SELECT 1 WHERE FALSE"
-    
-    ids_str = ','.join(map(str, protein_ids))
+def start_speculation(user_query, deadline=None):
+    """Start speculative SQL generation if the lexicon routes straight to SQL"""
+    routing = classify_query(user_query)
+    if routing["mode"] != "sql":
+        return None
     
-    if database == "scop3p":
-        return f"""
-        SELECT DISTINCT proj.project_id, proj.project_title, proj.species, 
-               proj.publication_date, proj.submission_type, proj.tissues,
-               p.protein_name, p.accession
-        FROM project proj
-        JOIN peptide pep ON proj.id = pep.l_project_id
-        JOIN protein p ON pep.l_protein_id = p.id
-        WHERE p.id IN ({ids_str})
-        LIMIT 20
-        """
-    else:  # scop3ptm
-        return f"""
-        SELECT DISTINCT proj.project_id, proj.project_title, proj.species,
-               proj.publication_date, proj.tissue, proj.disease, proj.instrument,
-               p.protein_name, p.accession
-        FROM project proj
-        JOIN peptide_modification pm ON proj.id = pm.l_project_id
-        JOIN protein p ON pm.l_protein_id = p.id
-        WHERE p.id IN ({ids_str})
-        LIMIT 20
-        """
+    logger.info(f"Starting speculative SQL generation for {routing['db']}")
+    return SpeculativeSQL(user_query, routing, execute=SPECULATIVE_EXECUTE, deadline=deadline)
+
+def _normalize_query(query):
+    return re.sub(r'\s+', ' ', (query or "").strip().lower()).rstrip('?.! ')
 
 def reset_conversation():
     """Reset the conversation state"""
@@ -306,18 +488,25 @@ def clean_sql_response(sql_response):
 
 def build_sql_prompt(template_file, user_query, database):
     """Build SQL generation prompt for specific database"""
+    system, prompt = build_sql_prompt_parts(template_file, user_query, database)
+    return f"{system}\n\n{prompt}" if system else prompt
+
+def build_sql_prompt_parts(template_file, user_query, database):
+    """Build (system, user) SQL generation prompts; the schema part never changes"""
     try:
-        template = load_prompt(template_file)
-        return template.format(user_query=user_query, database=database)
+        return format_prompt_parts(template_file, user_query=user_query, database=database)
     except Exception as e:
         logger.error(f"Failed to build SQL prompt: {e}")
-        return f"Generate a simple SQL query for {database} database based on: {user_query}"
+        return "", f"Generate a simple SQL query for {database} database based on: {user_query}"
 
 def extract_ids(results):
     """Extract protein IDs from query results for enrichment"""
     if not results:
         return []
     
+    if isinstance(results, ResultSet):
+        return results.ids()
+    
     protein_ids = set()
     for row in results:
         try:
@@ -364,6 +553,14 @@ def build_project_sql(database, protein_ids):
 
 def safe_json_parse(json_string):
     """Safely parse JSON with fallback"""
+    # Structured output from the router stage is plain JSON, skip the salvage
+    try:
+        parsed = json.loads(json_string)
+        if isinstance(parsed, dict) and parsed.get("db") in ["scop3p", "scop3ptm", "both"]:
+            return parsed
+    except (json.JSONDecodeError, TypeError, ValueError):
+        pass
+    
     try:
         cleaned = clean_json_response(json_string)
         if not cleaned or cleaned == "{}":
@@ -0,0 +1,293 @@
+# profiling.py - opt-in profiling of a single request
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from structured_logging import current_request_id, safe_request_id, stage_timings
+from config import (PROFILE_ENABLED, PROFILE_DIR, PROFILE_DEFAULT_MODE, PROFILE_SAMPLE_INTERVAL,
+                    PROFILE_MAX_SAMPLER_OVERHEAD, PROFILE_OVERHEAD_BUDGET, PROFILE_BUDGET_WINDOW)
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("sampling", "cprofile")
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+def parse_mode(value) -> Optional[str]:
+    """Profiling mode from a header or request flag, None when not requested"""
+    if value is None or value is False:
+        return None
+    if value is True:
+        return PROFILE_DEFAULT_MODE
+    value = str(value).strip().lower()
+    if value in ("", "0", "false", "no", "off"):
+        return None
+    if value in ("1", "true", "yes", "on"):
+        return PROFILE_DEFAULT_MODE
+    if value == "deterministic":
+        return "cprofile"
+    if value not in PROFILE_MODES:
+        raise ValueError(f"profile must be one of {', '.join(PROFILE_MODES)}")
+    return value
+
+@contextmanager
+def span(kind: str, label: str, **detail):
+    """Record an LLM or SQL call on the profiled request's timeline; yields a dict
+    for details known only afterwards. Costs one context lookup when not profiling"""
+    profile = _current.get()
+    if profile is None:
+        yield {}
+        return
+    entry = dict(detail)
+    start = time.perf_counter()
+    try:
+        yield entry
+    except BaseException as e:
+        entry["error"] = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        entry.update({
+            "kind": kind,
+            "label": label,
+            "start": round(start - profile.started, 4),
+            "duration": round(end - start, 4),
+            "thread": threading.current_thread().name
+        })
+        profile.spans.append(entry)
+
+class ProfileBudget:
+    """One profiled request at a time, and no more than `seconds` of profiling
+    overhead per `window` seconds"""
+
+    def __init__(self, seconds: float = PROFILE_OVERHEAD_BUDGET, window: float = PROFILE_BUDGET_WINDOW,
+                 clock=time.monotonic):
+        self.seconds = seconds
+        self.window = window
+        self.clock = clock
+        self.costs = deque()  # (finished at, overhead seconds)
+        self.active = False
+        self._lock = threading.Lock()
+
+    def spent(self) -> float:
+        with self._lock:
+            return self._spent()
+
+    def _spent(self) -> float:
+        cutoff = self.clock() - self.window
+        while self.costs and self.costs[0][0] < cutoff:
+            self.costs.popleft()
+        return sum(cost for _, cost in self.costs)
+
+    def acquire(self) -> Optional[str]:
+        """None if the request may be profiled, otherwise why not"""
+        with self._lock:
+            if self.active:
+                return "another request is being profiled"
+            if self._spent() >= self.seconds:
+                return "profiling overhead budget used up"
+            self.active = True
+            return None
+
+    def release(self, cost: float):
+        with self._lock:
+            self.active = False
+            self.costs.append((self.clock(), cost))
+
+class Sampler(threading.Thread):
+    """Samples one thread's stack at an interval, collapsing stacks in the folded
+    format flame graph tools read; backs off when it costs more than allowed"""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL,
+                 max_overhead: float = PROFILE_MAX_SAMPLER_OVERHEAD):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.stacks = Counter()
+        self.samples = 0
+        self.overhead = 0.0
+        self._done = threading.Event()
+
+    def run(self):
+        started = time.perf_counter()
+        while not self._done.wait(self.interval):
+            t0 = time.perf_counter()
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                break
+            self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+            del frame
+            now = time.perf_counter()
+            self.overhead += now - t0
+            if self.overhead > self.max_overhead * (now - started):
+                self.interval = min(self.interval * 2, 0.1)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+def _union_seconds(spans: List[Dict]) -> float:
+    """Wall time covered by at least one span, overlapping speculative calls counted once"""
+    total, end = 0.0, None
+    for start, stop in sorted((s["start"], s["start"] + s["duration"]) for s in spans):
+        if end is None or start > end:
+            total += stop - start
+            end = stop
+        elif stop > end:
+            total += stop - end
+            end = stop
+    return total
+
+class RequestProfile:
+    """Profiler and call timeline of one request"""
+
+    def __init__(self, mode: str, request_id: Optional[str] = None):
+        self.mode = mode
+        # Also the file name, so never a path
+        self.request_id = safe_request_id(request_id or current_request_id() or time.strftime("%Y%m%d-%H%M%S"))
+        self.spans: List[Dict] = []
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        self.stages: Dict[str, float] = {}
+        self.path: Optional[str] = None
+        # Why profiling was not granted, if it wasn't
+        self.refused: Optional[str] = None
+        self._profiler: Optional[cProfile.Profile] = None
+        self._sampler: Optional[Sampler] = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = Sampler(threading.get_ident())
+            self._sampler.start()
+
+    def stop(self):
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self._sampler is not None:
+            self._sampler.stop()
+        self.elapsed = time.perf_counter() - self.started
+        self.stages = stage_timings()
+
+    @property
+    def overhead(self) -> float:
+        """Seconds charged to the budget; a deterministic profile's overhead
+        can't be measured, so all of it counts"""
+        if self._sampler is not None:
+            return self._sampler.overhead
+        return self.elapsed
+
+    def top_functions(self, limit: int = 15) -> List[Dict]:
+        """Where the Python-side time went: functions by own time, or leaf frames by samples"""
+        if self._profiler is not None:
+            stats = pstats.Stats(self._profiler).stats
+            ranked = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+            return [{
+                "function": f"{os.path.basename(filename)}:{line}:{name}",
+                "calls": calls,
+                "own_seconds": round(tottime, 4),
+                "cumulative_seconds": round(cumtime, 4)
+            } for (filename, line, name), (_, calls, tottime, cumtime, _) in ranked]
+
+        leaves = Counter()
+        for stack, count in self._sampler.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{"function": name, "samples": count, "share": round(count / total, 3)}
+                for name, count in leaves.most_common(limit)]
+
+    def summary(self) -> Dict:
+        if self.refused:
+            return {"request_id": self.request_id, "mode": self.mode, "skipped": self.refused}
+        waiting = _union_seconds(self.spans)
+        summary = {
+            "request_id": self.request_id,
+            "mode": self.mode,
+            "elapsed": round(self.elapsed, 4),
+            "llm_seconds": round(sum(s["duration"] for s in self.spans if s["kind"] == "llm"), 4),
+            "sql_seconds": round(sum(s["duration"] for s in self.spans if s["kind"] == "sql"), 4),
+            # Time not spent waiting on any LLM or SQL call
+            "other_seconds": round(max(self.elapsed - waiting, 0.0), 4),
+            "calls": len(self.spans),
+            "overhead_seconds": round(self.overhead, 4),
+            "file": self.path
+        }
+        if self._sampler is not None:
+            summary["samples"] = self._sampler.samples
+        return summary
+
+    def save(self, directory: str = PROFILE_DIR) -> str:
+        """Write <request_id>.json with the timeline and hot spots, plus the raw profile"""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, safe_request_id(self.request_id))
+        self.path = base + ".json"
+        if self._profiler is not None:
+            self._profiler.dump_stats(base + ".prof")
+        else:
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                for stack, count in self._sampler.stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({
+                "summary": self.summary(),
+                "stages": self.stages,
+                "timeline": sorted(self.spans, key=lambda s: s["start"]),
+                "top_functions": self.top_functions()
+            }, f, indent=1, default=str)
+        return self.path
+
+_budget = ProfileBudget()
+
+def get_budget() -> ProfileBudget:
+    return _budget
+
+@contextmanager
+def profile_request(mode: Optional[str] = None, request_id: Optional[str] = None,
+                    budget: Optional[ProfileBudget] = None, directory: str = PROFILE_DIR):
+    """Profile the work done in this block when the budget allows; yields the
+    RequestProfile, whose `refused` says why when profiling was not granted"""
+    profile = RequestProfile(parse_mode(mode) or PROFILE_DEFAULT_MODE, request_id)
+    budget = budget or _budget
+    profile.refused = "profiling is disabled" if not PROFILE_ENABLED else budget.acquire()
+    if profile.refused:
+        logger.info(f"Not profiling request: {profile.refused}")
+        yield profile
+        return
+
+    token = _current.set(profile)
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        _current.reset(token)
+        budget.release(profile.overhead)
+        try:
+            profile.save(directory)
+            logger.info(f"Saved {profile.mode} profile to {profile.path}", extra={"profile": profile.summary()})
+        except OSError as e:
+            logger.warning(f"Could not save profile: {e}")
@@ -1,9 +1,33 @@
 import os
 
+# Separates the static part of a template (sent as the system prompt, byte-identical
+# across calls so the model server can reuse its KV cache) from the per-call part
+DYNAMIC_MARKER = "<<DYNAMIC>>"
+
 def load_prompt(filename):
     """Load prompt template from prompts directory"""
     prompts_dir = os.path.join(os.path.dirname(__file__), 'prompts')
     filepath = os.path.join(prompts_dir, filename)
     
     with open(filepath, 'r', encoding='utf-8') as f:
-        return f.read().strip()
\ No newline at end of file
+        content = f.read().strip()
+    
+    return "\n".join(line for line in content.split("\n") if line.strip() != DYNAMIC_MARKER)
+
+def load_prompt_parts(filename):
+    """Load a template as (static, dynamic) parts split at the dynamic marker"""
+    prompts_dir = os.path.join(os.path.dirname(__file__), 'prompts')
+    filepath = os.path.join(prompts_dir, filename)
+    
+    with open(filepath, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    
+    static, marker, dynamic = content.partition(f"\n{DYNAMIC_MARKER}\n")
+    if not marker:
+        return "", content
+    return static.strip(), dynamic.strip()
+
+def format_prompt_parts(filename, **kwargs):
+    """Fill a template and return (system, user) prompts"""
+    static, dynamic = load_prompt_parts(filename)
+    return static.format(), dynamic.format(**kwargs)
@@ -0,0 +1,451 @@
+# protein_cards.py - precomputed per-protein summary cards for overview questions
+import os
+import re
+import sys
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from db_utils import get_read_connection
+from fetch_sql import QueryStream, DATABASES
+from conversation_memory import ACCESSION_PATTERN, MODIFICATION_TERMS
+from structured_logging import setup_logging
+from renderer import DB_LABELS
+from config import (PROTEIN_CARDS_ENABLED, PROTEIN_CARDS_FILE, PROTEIN_CARD_MAX_SITES, PROTEIN_CARD_TOP_PROJECTS,
+                    PROTEIN_CARD_POLISH, PROTEIN_CARD_MAX_CHANGED, DB_STATEMENT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+# Aggregates per protein, keyed by accession; {where} restricts an incremental
+# build to the proteins that changed
+CARD_SQL = {
+    "scop3p": {
+        "protein": "SELECT p.accession, p.protein_name, p.uniprot_id, NULL FROM protein p {where}",
+        "sites": """
+            SELECT p.accession, m.modification_name, m.evidence, count(*)
+            FROM modification m JOIN protein p ON m.l_protein_id = p.id {where}
+            GROUP BY 1, 2, 3""",
+        "site_list": """
+            SELECT p.accession, m.modification_name, m.uniprot_position, m.modified_residue
+            FROM modification m JOIN protein p ON m.l_protein_id = p.id {where}
+            ORDER BY 1, 2, 3""",
+        "structure": """
+            SELECT p.accession, count(DISTINCT m.uniprot_position),
+                   count(DISTINCT s.uniprot_position)
+            FROM protein p
+            JOIN modification m ON m.l_protein_id = p.id
+            LEFT JOIN structure s ON s.l_protein_id = p.id AND s.uniprot_position = m.uniprot_position {where}
+            GROUP BY 1""",
+        "projects": """
+            SELECT p.accession, proj.project_id, proj.project_title, count(*)
+            FROM project proj
+            JOIN peptide pep ON proj.id = pep.l_project_id
+            JOIN protein p ON pep.l_protein_id = p.id {where}
+            GROUP BY 1, 2, 3 ORDER BY 1, 4 DESC, 2""",
+        "mutations": """
+            SELECT p.accession, count(*), count(*) FILTER (WHERE coalesce(m.disease, '') <> '')
+            FROM mutation m JOIN protein p ON m.l_protein_id = p.id {where}
+            GROUP BY 1"""
+    },
+    "scop3ptm": {
+        "protein": "SELECT p.accession, p.protein_name, p.entry_name, p.protein_length FROM protein p {where}",
+        "sites": """
+            SELECT p.accession, m.unimod_modification_name, pm.evidence, count(*)
+            FROM protein_modification pm
+            JOIN protein p ON pm.l_protein_id = p.id
+            JOIN modification m ON pm.l_modification_id = m.id {where}
+            GROUP BY 1, 2, 3""",
+        "site_list": """
+            SELECT p.accession, m.unimod_modification_name, pm.uniprot_position, pm.modified_residue
+            FROM protein_modification pm
+            JOIN protein p ON pm.l_protein_id = p.id
+            JOIN modification m ON pm.l_modification_id = m.id {where}
+            ORDER BY 1, 2, 3""",
+        "structure": """
+            SELECT p.accession, count(DISTINCT pm.uniprot_position), count(DISTINCT sm.uniprot_position)
+            FROM protein p
+            JOIN protein_modification pm ON pm.l_protein_id = p.id
+            LEFT JOIN structure_modification sm
+                   ON sm.l_protein_id = p.id AND sm.uniprot_position = pm.uniprot_position {where}
+            GROUP BY 1""",
+        "secondary_structure": """
+            SELECT p.accession, sm.secondary_structure, count(DISTINCT sm.uniprot_position)
+            FROM structure_modification sm JOIN protein p ON sm.l_protein_id = p.id {where}
+            GROUP BY 1, 2""",
+        "projects": """
+            SELECT p.accession, proj.project_id, proj.project_title, count(*)
+            FROM project proj
+            JOIN peptide_modification pm ON proj.id = pm.l_project_id
+            JOIN protein p ON pm.l_protein_id = p.id {where}
+            GROUP BY 1, 2, 3 ORDER BY 1, 4 DESC, 2""",
+        "mutations": """
+            SELECT p.accession, count(*), count(*) FILTER (WHERE coalesce(m.disease, '') <> '')
+            FROM mutation m JOIN protein p ON m.l_protein_id = p.id {where}
+            GROUP BY 1"""
+    }
+}
+
+# Tables the cards are computed from; new rows in them mark their protein as changed.
+# Releases only add rows, a build with --full picks up edits and deletions
+WATERMARK_TABLES = {
+    "scop3p": ["modification", "structure", "peptide", "mutation"],
+    "scop3ptm": ["protein_modification", "structure_modification", "peptide_modification", "mutation"]
+}
+
+# --- Building ----------------------------------------------------------------
+
+def _query(database: str, sql: str) -> List[Tuple]:
+    conn = get_read_connection(DATABASES[database], statement_timeout=DB_STATEMENT_TIMEOUT)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql)
+        return cur.fetchall()
+    finally:
+        conn.close()
+
+def stream_rows(database: str, sql: str) -> Iterable[Tuple]:
+    with QueryStream(database, sql) as stream:
+        for chunk in stream.chunks():
+            yield from chunk
+
+def read_watermarks(database: str) -> Dict[str, int]:
+    """Newest row id of the protein table and every table the cards use"""
+    tables = ["protein"] + WATERMARK_TABLES[database]
+    row = _query(database, "SELECT " + ", ".join(f"(SELECT max(id) FROM {table})" for table in tables))[0]
+    return {table: int(value or 0) for table, value in zip(tables, row)}
+
+def changed_proteins(database: str, since: Dict[str, int]) -> List[int]:
+    """Ids of proteins that are new or have rows added since the watermarks"""
+    parts = [f"SELECT id FROM protein WHERE id > {int(since.get('protein', 0))}"]
+    parts += [f"SELECT l_protein_id FROM {table} WHERE id > {int(since.get(table, 0))}"
+              for table in WATERMARK_TABLES[database]]
+    return sorted(int(row[0]) for row in _query(database, " UNION ".join(parts)) if row[0] is not None)
+
+def compute_sections(database: str, fetch: Callable[[str, str], Iterable[Tuple]],
+                     protein_ids: Optional[List[int]] = None) -> Dict[str, Dict]:
+    """{accession: card section} for one database, for the given proteins or all of them"""
+    where = f"WHERE p.id IN ({','.join(str(int(i)) for i in protein_ids)})" if protein_ids is not None else ""
+    cards: Dict[str, Dict] = {}
+
+    def card(accession):
+        return cards.setdefault(accession, {"sites": {}, "site_total": 0})
+
+    for accession, name, entry_name, length in fetch(database, CARD_SQL[database]["protein"].format(where=where)):
+        section = card(accession)
+        section.update(name=name, entry_name=entry_name, length=length)
+    for accession, modification, evidence, count in fetch(database, CARD_SQL[database]["sites"].format(where=where)):
+        sites = card(accession)["sites"].setdefault(modification or "unknown", {})
+        sites[evidence or "unknown"] = sites.get(evidence or "unknown", 0) + int(count)
+        card(accession)["site_total"] += int(count)
+    for accession, modification, position, residue in fetch(database,
+                                                            CARD_SQL[database]["site_list"].format(where=where)):
+        listed = card(accession).setdefault("site_list", {}).setdefault(modification or "unknown", [])
+        if len(listed) < PROTEIN_CARD_MAX_SITES:
+            listed.append([position, residue])
+    for accession, modified, structured in fetch(database, CARD_SQL[database]["structure"].format(where=where)):
+        card(accession)["structure"] = {"modified_positions": int(modified), "with_structure": int(structured)}
+    if "secondary_structure" in CARD_SQL[database]:
+        for accession, kind, count in fetch(database, CARD_SQL[database]["secondary_structure"].format(where=where)):
+            structure = card(accession).setdefault("structure", {"modified_positions": 0, "with_structure": 0})
+            structure.setdefault("secondary_structure", {})[kind or "unknown"] = int(count)
+    for accession, project_id, title, peptides in fetch(database, CARD_SQL[database]["projects"].format(where=where)):
+        projects = card(accession).setdefault("projects", [])
+        if len(projects) < PROTEIN_CARD_TOP_PROJECTS:
+            projects.append({"project_id": project_id, "title": title, "peptides": int(peptides)})
+    for accession, total, disease in fetch(database, CARD_SQL[database]["mutations"].format(where=where)):
+        card(accession)["mutations"] = {"total": int(total), "disease_associated": int(disease)}
+    return cards
+
+def build(database: str, path: str = PROTEIN_CARDS_FILE, full: bool = False,
+          fetch: Callable[[str, str], Iterable[Tuple]] = stream_rows,
+          watermarks: Callable[[str], Dict[str, int]] = read_watermarks,
+          changed: Callable[[str, Dict[str, int]], List[int]] = changed_proteins) -> Dict:
+    """Bring one database's part of the cards up to its current release, recomputing
+    only the proteins with new rows unless the build is full or has no earlier state"""
+    started = time.monotonic()
+    cards = ProteinCards(path)
+    try:
+        marks = watermarks(database)
+        previous = cards.watermarks(database)
+        if previous == marks and not full:
+            logger.info(f"{database} cards are current")
+            return {"database": database, "mode": "current", "proteins": 0}
+
+        protein_ids = None
+        if previous is not None and not full:
+            protein_ids = changed(database, previous)
+            if len(protein_ids) > PROTEIN_CARD_MAX_CHANGED:
+                # A big release is quicker as one pass over the tables
+                protein_ids = None
+        mode = "incremental" if protein_ids is not None else "full"
+        sections = compute_sections(database, fetch, protein_ids) if protein_ids != [] else {}
+        cards.update(database, sections, marks, replace=mode == "full")
+    finally:
+        cards.close()
+    logger.info(f"Built {len(sections)} {database} cards ({mode}) in {time.monotonic() - started:.1f}s")
+    return {"database": database, "mode": mode, "proteins": len(sections)}
+
+# --- Storage -----------------------------------------------------------------
+
+def normalize_name(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", (text or "").lower()))
+
+def card_aliases(card: Dict) -> List[Tuple[str, int]]:
+    """(alias, weight) names a card can be found by; the gene part of the UniProt
+    entry name (P53 in P53_HUMAN) counts most, then the full name, then name
+    words with a digit in them (p53, brca1)"""
+    aliases = {}
+    for section in card["databases"].values():
+        entry = (section.get("entry_name") or "").split("_")[0]
+        if entry:
+            aliases[normalize_name(entry)] = max(aliases.get(normalize_name(entry), 0), 3)
+        name = normalize_name(section.get("name"))
+        if name:
+            aliases[name] = max(aliases.get(name, 0), 2)
+            for word in name.split():
+                if len(word) >= 3 and any(c.isdigit() for c in word) and not word.isdigit():
+                    aliases.setdefault(word, 1)
+    return [(alias, weight) for alias, weight in aliases.items() if alias]
+
+class ProteinCards:
+    """Summary cards in a SQLite file, indexed by accession and by name"""
+
+    def __init__(self, path: str = PROTEIN_CARDS_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS cards (accession TEXT PRIMARY KEY, name TEXT, "
+                              "card TEXT NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS aliases (alias TEXT NOT NULL, accession TEXT NOT NULL, "
+                              "weight INTEGER NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_aliases_alias ON aliases (alias)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_aliases_accession ON aliases (accession)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS builds (database TEXT PRIMARY KEY, watermarks TEXT, "
+                              "built_at TEXT)")
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, accession: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT card FROM cards WHERE accession = ?", (accession,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def resolve(self, text: str) -> Optional[str]:
+        """Accession a protein reference names, None if unknown or ambiguous. The whole
+        reference has to be the accession or an alias, so a question that merely
+        mentions a protein ("site S15 of P04637") isn't taken for an overview"""
+        match = ACCESSION_PATTERN.fullmatch((text or "").strip().upper())
+        if match and self.get(match.group(0)):
+            return match.group(0)
+        with self._lock:
+            rows = self.conn.execute("SELECT accession, weight FROM aliases WHERE alias = ? ORDER BY weight DESC",
+                                     (normalize_name(text),)).fetchall()
+        best = {accession for accession, weight in rows if weight == rows[0][1]} if rows else set()
+        return best.pop() if len(best) == 1 else None
+
+    def watermarks(self, database: str) -> Optional[Dict[str, int]]:
+        with self._lock:
+            row = self.conn.execute("SELECT watermarks FROM builds WHERE database = ?", (database,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, database: str, sections: Dict[str, Dict], watermarks: Dict[str, int], replace: bool = False):
+        """Store one database's sections in the cards in a single transaction; replace
+        drops that database from the cards not in sections"""
+        with self._lock, self.conn:
+            if replace:
+                for accession, text in self.conn.execute("SELECT accession, card FROM cards").fetchall():
+                    if accession not in sections:
+                        card = json.loads(text)
+                        if card["databases"].pop(database, None) is not None:
+                            self._write(card)
+            for accession, section in sections.items():
+                row = self.conn.execute("SELECT card FROM cards WHERE accession = ?", (accession,)).fetchone()
+                card = json.loads(row[0]) if row else {"accession": accession, "databases": {}}
+                card["databases"][database] = section
+                self._write(card)
+            self.conn.execute("INSERT OR REPLACE INTO builds (database, watermarks, built_at) VALUES (?, ?, ?)",
+                              (database, json.dumps(watermarks), time.strftime("%Y-%m-%dT%H:%M:%S")))
+
+    def _write(self, card: Dict):
+        accession = card["accession"]
+        self.conn.execute("DELETE FROM aliases WHERE accession = ?", (accession,))
+        if not card["databases"]:
+            self.conn.execute("DELETE FROM cards WHERE accession = ?", (accession,))
+            return
+        name = next((s.get("name") for s in card["databases"].values() if s.get("name")), None)
+        card["name"] = name
+        self.conn.execute("INSERT OR REPLACE INTO cards (accession, name, card) VALUES (?, ?, ?)",
+                          (accession, name, json.dumps(card, default=str)))
+        self.conn.executemany("INSERT INTO aliases (alias, accession, weight) VALUES (?, ?, ?)",
+                              [(alias, accession, weight) for alias, weight in card_aliases(card)])
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT count(*) FROM cards").fetchone()[0]
+
+# --- Answering ---------------------------------------------------------------
+
+OVERVIEW_PATTERN = re.compile(
+    r"^(?:please\s+)?(?:tell me (?:more )?about|what (?:do you know|is known) about|(?:give me )?an? overview of|"
+    r"overview of|summari[sz]e|(?:a )?summary of|describe|info(?:rmation)? (?:on|about))\s+"
+    r"(?:the\s+)?(?:protein\s+)?(?P<protein>[\w\-/ ]+?)(?:\s+protein)?$")
+SITES_PATTERNS = [
+    re.compile(r"^(?:(?:please\s+)?(?:show|list|give)(?: me)?\s+)?(?:the\s+)?(?:protein\s+)?(?P<protein>[\w\-/]+)\s+"
+               r"(?P<modification>[a-z]+)\s+sites$"),
+    re.compile(r"^(?:(?:please\s+)?(?:show|list|give)(?: me)?\s+)?(?:the\s+)?(?P<modification>[a-z]+)\s+sites\s+"
+               r"(?:in|of|for|on)\s+(?:the\s+)?(?:protein\s+)?(?P<protein>[\w\-/]+)$")
+]
+
+def parse_card_query(query: str) -> Optional[Tuple[str, Optional[str]]]:
+    """(protein reference, modification stem or None) of an overview question"""
+    text = re.sub(r"[?.!]+$", "", (query or "").strip().lower()).strip()
+    match = OVERVIEW_PATTERN.match(text)
+    if match:
+        return match.group("protein").strip(), None
+    for pattern in SITES_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            stem = next((s for s in MODIFICATION_TERMS if match.group("modification").startswith(s)), None)
+            return (match.group("protein"), stem) if stem else None
+    return None
+
+def _site_counts(sites: Dict[str, int]) -> str:
+    total = sum(sites.values())
+    breakdown = ", ".join(f"{evidence} {count}" for evidence, count in sorted(sites.items(), key=lambda i: -i[1]))
+    return f"{total} ({breakdown})" if len(sites) > 1 else str(total)
+
+def render_card(card: Dict, modification: Optional[str] = None) -> Optional[str]:
+    """Markdown answer from a card; None when the sites asked for aren't all on it"""
+    databases = card["databases"]
+    length = next((s.get("length") for s in databases.values() if s.get("length")), None)
+    title = f"**{card.get('name') or card['accession']} ({card['accession']})**"
+    lines = [title + (f", {length} residues" if length else "")]
+
+    for db in ("scop3p", "scop3ptm"):
+        section = databases.get(db)
+        if section is None:
+            continue
+        label = DB_LABELS.get(db, db)
+        sites = section.get("sites", {})
+        if modification:
+            matching = {name: counts for name, counts in sites.items() if modification in name.lower()}
+            if not matching:
+                lines.append(f"{label}: no {MODIFICATION_TERMS[modification]} sites recorded.")
+                continue
+            for name, counts in sorted(matching.items()):
+                listed = (section.get("site_list") or {}).get(name, [])
+                if len(listed) < sum(counts.values()):
+                    return None
+                positions = ", ".join(f"{residue or ''}{position}" for position, residue in listed)
+                lines.append(f"{label} {name} sites: {_site_counts(counts)}: {positions}")
+            continue
+
+        parts = []
+        if sites:
+            by_modification = "; ".join(f"{name} {_site_counts(counts)}"
+                                        for name, counts in sorted(sites.items(), key=lambda i: -sum(i[1].values())))
+            parts.append(f"{section.get('site_total', 0)} modified sites - {by_modification}")
+        else:
+            parts.append("no modified sites recorded")
+        structure = section.get("structure")
+        if structure and structure.get("modified_positions"):
+            coverage = (f"{structure['with_structure']} of {structure['modified_positions']} modified positions "
+                        f"have structure data")
+            if structure.get("secondary_structure"):
+                coverage += " (" + ", ".join(f"{kind} {count}" for kind, count in
+                                             sorted(structure["secondary_structure"].items(),
+                                                    key=lambda i: -i[1])) + ")"
+            parts.append(coverage)
+        mutations = section.get("mutations")
+        if mutations:
+            parts.append(f"{mutations['total']} mutations, {mutations['disease_associated']} disease-associated")
+        lines.append(f"{label}: " + "; ".join(parts) + ".")
+        if section.get("projects"):
+            lines.append(f"{label} top projects: " + ", ".join(
+                f"{p['project_id']} ({p['peptides']} peptides)" for p in section["projects"]))
+    return "\n\n".join(lines)
+
+def polish(answer: str, user_query: str, deadline=None) -> str:
+    """Short LLM rewrite of a card answer into prose, the card itself on failure"""
+    from llm_client import query_llm
+    from prompts import format_prompt_parts
+    try:
+        system, prompt = format_prompt_parts("card_polish.txt", user_query=user_query, card=answer)
+        polished = query_llm(prompt, system=system, stage="polish",
+                             timeout=deadline.budget("summary") if deadline else None, deadline=deadline)
+        return polished.strip() or answer
+    except Exception as e:
+        logger.warning(f"Card polish failed, returning the card: {e}")
+        return answer
+
+def answer_from_card(user_query: str, response_mode: Optional[str] = None, deadline=None,
+                     cards: Optional["ProteinCards"] = None) -> Optional[Tuple[str, Dict]]:
+    """(answer, card) for an overview question about a protein with a current card,
+    None when the question should go through SQL generation"""
+    parsed = parse_card_query(user_query)
+    if parsed is None:
+        return None
+    cards = cards or get_protein_cards()
+    if cards is None:
+        return None
+    protein, modification = parsed
+    accession = cards.resolve(protein)
+    card = cards.get(accession) if accession else None
+    if card is None:
+        return None
+
+    if response_mode == "json":
+        return json.dumps({"query": user_query, "card": card}), card
+    answer = render_card(card, modification)
+    if answer is None:
+        return None
+    if PROTEIN_CARD_POLISH and response_mode in (None, "auto", "prose"):
+        answer = polish(answer, user_query, deadline)
+    return answer, card
+
+_cards: Optional[ProteinCards] = None
+_cards_loaded = False
+_cards_lock = threading.Lock()
+
+def get_protein_cards() -> Optional[ProteinCards]:
+    """Shared cards, None if disabled or not built yet"""
+    global _cards, _cards_loaded
+    with _cards_lock:
+        if not _cards_loaded:
+            _cards_loaded = True
+            path = os.path.join(os.path.dirname(os.path.abspath(__file__)), PROTEIN_CARDS_FILE)
+            if PROTEIN_CARDS_ENABLED and os.path.exists(path):
+                try:
+                    _cards = ProteinCards(path)
+                    logger.info(f"Loaded {len(_cards)} protein cards from {path}")
+                except Exception as e:
+                    logger.warning(f"Could not load protein cards: {e}")
+        return _cards
+
+def set_protein_cards(cards: Optional[ProteinCards]):
+    global _cards, _cards_loaded
+    with _cards_lock:
+        _cards, _cards_loaded = cards, True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build per-protein summary cards, incrementally per release")
+    parser.add_argument("--db", choices=sorted(DATABASES), action="append")
+    parser.add_argument("--output", "-o", default=PROTEIN_CARDS_FILE)
+    parser.add_argument("--full", action="store_true", help="Recompute every card, e.g. after edits or deletions")
+    args = parser.parse_args(argv)
+
+    setup_logging(log_file=None, console=True, force=True)
+    for database in args.db or sorted(DATABASES):
+        result = build(database, args.output, args.full)
+        print(f"{database}: {result['mode']} build, {result['proteins']} proteins updated")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
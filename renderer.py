@@ -0,0 +1,139 @@
+import json
+from typing import Dict, List, Any, Optional
+from result_set import json_default
+from config import RESPONSE_MODE, RENDER_MAX_ROWS, RENDER_MAX_COLUMNS, RENDER_MAX_CELL_CHARS
+
+RESPONSE_MODES = ("auto", "prose", "table", "json")
+
+DB_LABELS = {"scop3p": "Scop3P", "scop3ptm": "Scop3PTM"}
+
+def choose_response_mode(results: Dict, projects: Dict, mutations: Dict,
+                         requested: Optional[str] = None) -> str:
+    """Pick how a domain answer is rendered, resolving "auto" by result shape"""
+    mode = (requested or RESPONSE_MODE).lower()
+    if mode not in RESPONSE_MODES:
+        raise ValueError(f"Unknown response mode: {mode}")
+    if mode != "auto":
+        return mode
+
+    sections = [results, projects, mutations]
+    total_rows = sum(count_rows(section) for section in sections)
+
+    # Nothing to show means the answer has to come from the knowledge base
+    if count_rows(results) == 0:
+        return "prose"
+    if total_rows > RENDER_MAX_ROWS:
+        return "prose"
+
+    for section in sections:
+        for rows in section.values():
+            for row in rows:
+                if len(row) > RENDER_MAX_COLUMNS:
+                    return "prose"
+                if any(isinstance(v, str) and len(v) > RENDER_MAX_CELL_CHARS for v in row.values()):
+                    return "prose"
+
+    return "table"
+
+def count_rows(section: Dict) -> int:
+    """Count rows across all databases in a results section"""
+    if not section:
+        return 0
+    return sum(len(rows) for rows in section.values() if rows)
+
+def render_response(mode: str, user_query: str, results: Dict,
+                    projects: Optional[Dict] = None, mutations: Optional[Dict] = None) -> str:
+    """Render results without the LLM in the given non-prose mode"""
+    projects = projects or {}
+    mutations = mutations or {}
+
+    if mode == "json":
+        return render_json(user_query, results, projects, mutations)
+    if mode == "table":
+        return render_tables(user_query, results, projects, mutations)
+    raise ValueError(f"Response mode '{mode}' cannot be rendered deterministically")
+
+def summary_sentence(user_query: str, results: Dict, projects: Dict, mutations: Dict) -> str:
+    """Short templated sentence describing what was found"""
+    if count_rows(results) == 0:
+        return f'I could not find any database results for "{user_query}".'
+
+    found = [f"{len(rows)} {'row' if len(rows) == 1 else 'rows'} in {DB_LABELS.get(db, db)}"
+             for db, rows in results.items() if rows]
+    sentence = f'Looking at the data, I found {_join_words(found)} for "{user_query}"'
+
+    extras = []
+    if count_rows(projects):
+        extras.append(f"{count_rows(projects)} related projects")
+    if count_rows(mutations):
+        extras.append(f"{count_rows(mutations)} mutations")
+    if extras:
+        sentence += f", along with {_join_words(extras)}"
+
+    return sentence + "."
+
+def render_tables(user_query: str, results: Dict, projects: Dict, mutations: Dict) -> str:
+    """Render results, projects and mutations as markdown tables"""
+    parts = [summary_sentence(user_query, results, projects, mutations)]
+
+    for title, section in [("Results", results), ("Projects", projects), ("Mutations", mutations)]:
+        for db, rows in section.items():
+            if not rows:
+                continue
+            parts.append(f"**{title} - {DB_LABELS.get(db, db)}** ({len(rows)} rows)\n{format_table(rows)}")
+
+    return "\n\n".join(parts)
+
+def render_page(user_query: str, page: Dict[str, Dict]) -> str:
+    """Render a page of earlier results as markdown tables with their row positions"""
+    if not page:
+        return f'There are no more results for "{user_query}".'
+    parts = [f'More results for "{user_query}":']
+    for db, section in page.items():
+        parts.append(f"**Results - {DB_LABELS.get(db, db)}** (rows {section['first']}-{section['last']} "
+                     f"of {section['total']})\n{format_table(section['rows'])}")
+    return "\n\n".join(parts)
+
+def render_json(user_query: str, results: Dict, projects: Dict, mutations: Dict) -> str:
+    """Render results as a JSON document with a summary sentence"""
+    payload = {
+        "query": user_query,
+        "summary": summary_sentence(user_query, results, projects, mutations),
+        "counts": {
+            "results": {db: len(rows) for db, rows in results.items()},
+            "projects": {db: len(rows) for db, rows in projects.items()},
+            "mutations": {db: len(rows) for db, rows in mutations.items()}
+        },
+        "results": results,
+        "projects": projects,
+        "mutations": mutations
+    }
+    return json.dumps(payload, default=json_default)
+
+def format_table(rows: List[Dict[str, Any]]) -> str:
+    """Format a list of row dicts as a markdown table"""
+    if not rows:
+        return ""
+
+    columns = list(rows[0].keys())
+    lines = [
+        "| " + " | ".join(columns) + " |",
+        "|" + "|".join(" --- " for _ in columns) + "|"
+    ]
+    for row in rows:
+        lines.append("| " + " | ".join(_format_cell(row.get(col)) for col in columns) + " |")
+
+    return "\n".join(lines)
+
+def _format_cell(value) -> str:
+    if value is None:
+        return ""
+    text = str(value).replace("|", "/").replace("\n", " ")
+    if len(text) > RENDER_MAX_CELL_CHARS:
+        text = text[:RENDER_MAX_CELL_CHARS - 3] + "..."
+    return text
+
+def _join_words(items: List[str]) -> str:
+    if len(items) <= 1:
+        return "".join(items)
+    return ", ".join(items[:-1]) + " and " + items[-1]
@@ -0,0 +1,148 @@
+import time
+import logging
+import threading
+from typing import Optional
+from config import STAGE_BUDGETS, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class DeadlineExceeded(Exception):
+    """Raised when a request or stage runs out of time"""
+
+class CircuitOpen(Exception):
+    """Raised when a dependency's circuit breaker is rejecting calls"""
+
+class RequestCancelled(Exception):
+    """Raised at a stage boundary once the request has been cancelled"""
+
+class Deadline:
+    """Per-request time budget passed through every pipeline stage"""
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds if seconds else None
+        self.cancel_reason: Optional[str] = None
+        self._callbacks = {}
+        self._next_callback = 0
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def budget(self, stage: str) -> float:
+        """Seconds a stage may use: its own budget capped by what is left"""
+        return min(self.remaining(), STAGE_BUDGETS.get(stage, float("inf")))
+
+    def allows(self, stage: str, minimum: float = 1.0) -> bool:
+        """Whether enough time is left to start a stage"""
+        return self.budget(stage) >= minimum
+
+    def check(self, stage: str = "request"):
+        """Stage boundary: stop a cancelled request, or one that ran out of time"""
+        if self.cancelled:
+            raise RequestCancelled(f"Request cancelled before {stage}: {self.cancel_reason}")
+        if self.expired:
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}")
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_reason is not None
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the request and abort in-flight LLM generations and SQL queries"""
+        with self._lock:
+            if self.cancel_reason is not None:
+                return
+            self.cancel_reason = reason
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+
+        logger.info(f"Cancelling request ({reason}), aborting {len(callbacks)} in-flight calls")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancel callback failed: {e}")
+
+    def on_cancel(self, callback):
+        """Register an abort callback for an in-flight call, returns an unregister function"""
+        with self._lock:
+            if self.cancel_reason is None:
+                key = self._next_callback
+                self._next_callback += 1
+                self._callbacks[key] = callback
+                return lambda: self._callbacks.pop(key, None)
+
+        # Already cancelled: abort right away
+        callback()
+        return lambda: None
+
+class CircuitBreaker:
+    """Stops calls to a failing dependency until it has had time to recover"""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_seconds: float = BREAKER_RESET_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        """Raise CircuitOpen unless a call is allowed; half-open lets one trial through"""
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return
+        raise CircuitOpen(f"Circuit for {self.name} is open")
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial_running:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self._trial_running = False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Shared circuit breaker for a named dependency"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
@@ -0,0 +1,137 @@
+from typing import Any, Dict, List, Optional, Tuple
+from conversation_memory import MODIFICATION_TERMS
+
+# Column names the two databases (and generated SQL) use for the join keys
+ACCESSION_COLUMNS = ("accession",)
+POSITION_COLUMNS = ("uniprot_position", "position")
+RESIDUE_COLUMNS = ("modified_residue", "residue")
+MODIFICATION_COLUMNS = ("modification_name", "unimod_modification_name", "modification")
+
+MERGE_DATABASES = ("scop3p", "scop3ptm")
+
+class PerDatabase(dict):
+    """Values of a column that differ between the databases"""
+
+def _first(row: Dict, columns) -> Tuple[Optional[str], Any]:
+    for column in columns:
+        if column in row:
+            return column, row[column]
+    return None, None
+
+def _is_internal_id(column: str) -> bool:
+    # Row ids and foreign keys differ between the databases and mean nothing to a reader
+    return column == "id" or column.startswith("l_")
+
+def site_key(row: Dict) -> Optional[Tuple]:
+    """(accession, position, residue) of a site row, None if the row has no accession
+    or position; without the protein, sites of different proteins would look the same"""
+    _, accession = _first(row, ACCESSION_COLUMNS)
+    if accession is None or not str(accession).strip():
+        return None
+    _, position = _first(row, POSITION_COLUMNS)
+    if position is None:
+        return None
+    try:
+        position = int(position)
+    except (TypeError, ValueError):
+        return None
+    _, residue = _first(row, RESIDUE_COLUMNS)
+    return (
+        str(accession).strip().upper(),
+        position,
+        str(residue).strip().upper() if residue else None
+    )
+
+def modification_key(row: Dict) -> Optional[str]:
+    """Modification of a row with the databases' names folded together
+    ("Phospho" and "Phosphorylation"), None if the row doesn't say"""
+    _, name = _first(row, MODIFICATION_COLUMNS)
+    if name is None or not str(name).strip():
+        return None
+    name = str(name).strip().lower()
+    return next((full for stem, full in MODIFICATION_TERMS.items() if name.startswith(stem)), name)
+
+def merge_results(results: Dict[str, List[Dict]]) -> Dict:
+    """Join Scop3P and Scop3PTM rows describing the same site into one table with a
+    source column; values the databases disagree on are kept per database"""
+    merged: Dict[Any, Dict] = {}
+    sources: Dict[Any, List[str]] = {}
+    origins: Dict[Any, Dict[str, int]] = {}
+    counts = {db: len(results.get(db) or []) for db in MERGE_DATABASES}
+    # Different modifications of one residue (Phospho vs O-GlcNAc) are different rows,
+    # which can only be told apart when both databases name the modification
+    by_modification = all(any(modification_key(row) for row in results.get(db) or []) for db in MERGE_DATABASES)
+
+    for db in MERGE_DATABASES:
+        seen: Dict[Tuple, int] = {}
+        for i, row in enumerate(results.get(db) or []):
+            site = site_key(row)
+            if site is None:
+                # Rows without a site are never merged
+                key = (db, i)
+            else:
+                # The n-th row of a site (and modification) in one database pairs with the n-th in the other
+                site_modification = (site, modification_key(row) if by_modification else None)
+                occurrence = seen.get(site_modification, 0)
+                seen[site_modification] = occurrence + 1
+                key = (site_modification, occurrence)
+            target = merged.setdefault(key, {})
+            sources.setdefault(key, []).append(db)
+            origins.setdefault(key, {})[db] = i
+            _merge_row(target, row, db, site)
+
+    columns = ["accession", "position", "residue", "source"]
+    for row in merged.values():
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+    # Drop columns no row has a value for
+    columns = [c for c in columns if c == "source" or any(row.get(c) is not None for row in merged.values())]
+
+    rows = []
+    for key, row in merged.items():
+        row["source"] = "+".join(sources[key])
+        rows.append([row.get(column) for column in columns])
+
+    counts["shared"] = sum(1 for dbs in sources.values() if len(dbs) > 1)
+    counts["merged"] = len(rows)
+    # origins[i] is {database: row index} of the rows merged into rows[i]
+    return {"counts": counts, "columns": columns, "rows": rows, "origins": list(origins.values())}
+
+def rows_shown(merged: Dict, count: int) -> Dict[str, int]:
+    """Per database, how many leading rows are covered by the first count merged rows,
+    for paging on from there"""
+    seen: Dict[str, set] = {db: set() for db in MERGE_DATABASES}
+    for origin in merged["origins"][:count]:
+        for db, i in origin.items():
+            seen[db].add(i)
+    shown = {}
+    for db, indices in seen.items():
+        shown[db] = 0
+        while shown[db] in indices:
+            shown[db] += 1
+    return shown
+
+def _merge_row(target: Dict, row: Dict, db: str, site: Optional[Tuple]):
+    if site is not None:
+        accession, position, residue = site
+        target.setdefault("accession", accession)
+        target.setdefault("position", position)
+        target.setdefault("residue", residue)
+        skip = {c for c in ACCESSION_COLUMNS + POSITION_COLUMNS + RESIDUE_COLUMNS if c in row}
+    else:
+        skip = set()
+
+    for column, value in row.items():
+        if column in skip or _is_internal_id(column):
+            continue
+        if column not in target:
+            target[column] = value
+        elif target[column] != value:
+            # Each database contributes one row per merged row, so the value came from the other one
+            other = next(d for d in MERGE_DATABASES if d != db)
+            target[column] = PerDatabase({other: target[column], db: value})
+
+def should_merge(results: Dict[str, List[Dict]]) -> bool:
+    """Only worth it when both databases returned rows"""
+    return all(results.get(db) for db in MERGE_DATABASES)
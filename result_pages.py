@@ -0,0 +1,100 @@
+# result_pages.py - the last answer's rows, kept per conversation so "show more" pages through them
+import re
+import time
+import logging
+from typing import Callable, Dict
+from result_set import ResultSet
+from config import PAGE_SIZE, PAGES_MAX_ROWS, PAGES_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Requests for more rows, matched against the normalized follow-up
+MORE_REQUEST = re.compile(
+    r"^(?:(?:yes|yeah|yep|sure|ok|okay)\s+)?(?:please\s+)?(?:(?:show|give|list|display|tell)\s+(?:me\s+)?)?"
+    r"(?:(?:the|some)\s+)?(?:more|rest|next|remaining|others|next page|more rows|more results|remaining rows|"
+    r"remaining results|rest of (?:them|the rows|the results))(?:\s+(?:rows|results))?(?:\s+please)?$")
+
+AFFIRMATIVES = {"yes", "yes please", "yeah", "yep", "sure", "ok", "okay", "please", "please do",
+                "go on", "continue", "go ahead"}
+
+def normalize_follow_up(query: str) -> str:
+    return " ".join(re.findall(r"[a-z]+", (query or "").lower()))
+
+def paged_sql(sql: str, limit: int, offset: int) -> str:
+    """The query's rows from offset on; without an ORDER BY in the query the server
+    may return them in a different order than the first time"""
+    return f"SELECT * FROM ({sql.strip().rstrip(';')}) AS page LIMIT {int(limit)} OFFSET {int(offset)}"
+
+class ResultPages:
+    """Rows of the last database answer and how many of them the user has seen.
+    At most max_rows rows per database are kept, later pages re-run the SQL"""
+
+    def __init__(self, query: str, results: Dict[str, ResultSet], sql: Dict[str, str],
+                 shown: Dict[str, int], max_rows: int = PAGES_MAX_ROWS, clock: Callable[[], float] = time.monotonic):
+        self.query = query
+        self.sql = dict(sql)
+        self.totals = {db: len(rows) for db, rows in results.items()}
+        self.rows = {db: rows[:max_rows] for db, rows in results.items()}
+        self.offsets = {db: min(shown.get(db, 0), total) for db, total in self.totals.items()}
+        self.offered = False
+        self.hint = ""
+        self._clock = clock
+        self.created = clock()
+
+    @property
+    def expired(self) -> bool:
+        return self._clock() - self.created > PAGES_TTL_SECONDS
+
+    def remaining(self) -> int:
+        return sum(self.totals[db] - self.offsets[db] for db in self.totals)
+
+    @property
+    def pending(self) -> bool:
+        """More rows were offered in the last response and can still be shown"""
+        return self.offered and not self.expired and self.remaining() > 0
+
+    def wants_more(self, query: str) -> bool:
+        """Whether a follow-up asks for the next page of these results; only right
+        after a response that offered more rows, so "yes" after anything else isn't taken as one"""
+        if not self.pending:
+            return False
+        text = normalize_follow_up(query)
+        return bool(MORE_REQUEST.match(text)) or text in AFFIRMATIVES
+
+    def next_page(self, fetch: Callable[[str, str], ResultSet], page_size: int = PAGE_SIZE) -> Dict[str, Dict]:
+        """{database: {"rows", "first", "last", "total"}} for the next page_size rows.
+        Rows past the kept ones come from fetch(database, sql); a failed fetch ends paging there"""
+        page = {}
+        for db, total in self.totals.items():
+            start = self.offsets[db]
+            end = min(total, start + page_size)
+            if start >= end:
+                continue
+            if end <= len(self.rows[db]):
+                rows = self.rows[db][start:end]
+            elif self.sql.get(db):
+                logger.info(f"Fetching {db} rows {start + 1}-{end} of the previous query")
+                rows = fetch(db, paged_sql(self.sql[db], end - start, start))
+            else:
+                rows = ResultSet()
+            if not rows:
+                # Nothing more can be shown, don't offer it again
+                self.totals[db] = start
+                continue
+            self.offsets[db] = start + len(rows)
+            page[db] = {"rows": rows, "first": start + 1, "last": start + len(rows), "total": total}
+            page_size -= len(rows)
+            if page_size <= 0:
+                break
+        return page
+
+    def offer(self, answer: str) -> str:
+        """The answer with a note on how many rows are left, if any"""
+        remaining = self.remaining()
+        self.hint = (f"\n\n({remaining} more {'row' if remaining == 1 else 'rows'} not shown. "
+                     f"Say \"show more\" to see them.)") if remaining else ""
+        return answer + self.hint
+
+    def record_response(self, response: str):
+        """Note whether the response sent to the user ended with the offer"""
+        self.offered = bool(self.hint) and response.endswith(self.hint)
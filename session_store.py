@@ -0,0 +1,282 @@
+# session_store.py - conversations that outlive the process, shared by the workers
+import os
+import json
+import time
+import sqlite3
+import atexit
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+from conversation_manager import ConversationManager
+from config import (SESSION_BACKEND, SESSION_DB_FILE, SESSION_TTL_SECONDS, SESSION_CACHE_SIZE,
+                    SESSION_FLUSH_SECONDS, SESSION_COMPACT_SECONDS)
+
+logger = logging.getLogger(__name__)
+
+class SessionStore(ABC):
+    """Where serialized conversation states live. A networked store (Redis, Postgres)
+    implements the same five methods; versions only have to increase per session"""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Dict]:
+        """{"version", "updated_at", "state"} of a session, None if unknown"""
+
+    @abstractmethod
+    def version(self, session_id: str) -> Optional[int]:
+        """Current version of a session without loading it"""
+
+    @abstractmethod
+    def save_many(self, states: Dict[str, Dict]) -> Dict[str, int]:
+        """Write several session states at once; returns their new versions"""
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        """Remove a session, if it exists"""
+
+    @abstractmethod
+    def compact(self, older_than: float) -> int:
+        """Drop sessions not updated since older_than (epoch seconds); returns how many"""
+
+class MemorySessionStore(SessionStore):
+    """Sessions for this process only, e.g. for tests"""
+
+    def __init__(self):
+        self._rows: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def load(self, session_id):
+        with self._lock:
+            row = self._rows.get(session_id)
+            return dict(row) if row else None
+
+    def version(self, session_id):
+        with self._lock:
+            row = self._rows.get(session_id)
+            return row["version"] if row else None
+
+    def save_many(self, states):
+        now = time.time()
+        versions = {}
+        with self._lock:
+            for session_id, state in states.items():
+                versions[session_id] = self._rows.get(session_id, {}).get("version", 0) + 1
+                self._rows[session_id] = {"version": versions[session_id], "updated_at": now, "state": state}
+        return versions
+
+    def delete(self, session_id):
+        with self._lock:
+            self._rows.pop(session_id, None)
+
+    def compact(self, older_than):
+        with self._lock:
+            expired = [sid for sid, row in self._rows.items() if row["updated_at"] < older_than]
+            for session_id in expired:
+                del self._rows[session_id]
+            return len(expired)
+
+class SQLiteSessionStore(SessionStore):
+    """Sessions in a local SQLite file; WAL mode lets every worker process on the host
+    read while one writes"""
+
+    def __init__(self, path: str = SESSION_DB_FILE):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, "
+                         "version INTEGER NOT NULL, updated_at REAL NOT NULL, state TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread, sqlite3 connections can't be shared between them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def load(self, session_id):
+        row = self._connect().execute("SELECT version, updated_at, state FROM sessions WHERE session_id = ?",
+                                      (session_id,)).fetchone()
+        if row is None:
+            return None
+        return {"version": row[0], "updated_at": row[1], "state": json.loads(row[2])}
+
+    def version(self, session_id):
+        row = self._connect().execute("SELECT version FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_many(self, states):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO sessions (session_id, version, updated_at, state) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET version = version + 1, "
+                "updated_at = excluded.updated_at, state = excluded.state",
+                [(session_id, now, json.dumps(state)) for session_id, state in states.items()])
+            return {session_id: conn.execute("SELECT version FROM sessions WHERE session_id = ?",
+                                             (session_id,)).fetchone()[0] for session_id in states}
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def compact(self, older_than):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (older_than,)).rowcount
+
+class SessionManager:
+    """Conversations by session id. A session is loaded from the store on first use
+    and reloaded when another worker has saved a newer version; saves only snapshot
+    the state, a background thread writes the snapshots in batches"""
+
+    def __init__(self, store: SessionStore, cache_size: int = SESSION_CACHE_SIZE,
+                 flush_seconds: float = SESSION_FLUSH_SECONDS, ttl: float = SESSION_TTL_SECONDS,
+                 compact_seconds: float = SESSION_COMPACT_SECONDS,
+                 factory: Callable[[], ConversationManager] = lambda: ConversationManager(max_history=4)):
+        self.store = store
+        self.cache_size = cache_size
+        self.flush_seconds = flush_seconds
+        self.ttl = ttl
+        self.compact_seconds = compact_seconds
+        self.factory = factory
+        # session id -> [manager, store version it is based on]
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._dirty: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._last_compact = time.monotonic()
+        self._writer = threading.Thread(target=self._write_loop, name="session-writer", daemon=True)
+        self._writer.start()
+
+    def get(self, session_id: str) -> ConversationManager:
+        """The session's conversation, loaded lazily and kept current across workers"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                self._sessions.move_to_end(session_id)
+                # Our own unwritten changes are the newest state
+                if session_id in self._dirty:
+                    return entry[0]
+
+        version = self.store.version(session_id)
+        if entry is not None and version == entry[1]:
+            return entry[0]
+
+        record = self.store.load(session_id) if version is not None else None
+        manager = self.factory()
+        if record is not None:
+            manager.state.restore(record["state"])
+        with self._lock:
+            current = self._sessions.get(session_id)
+            if current is not None and session_id in self._dirty:
+                # Saved here while we were loading
+                return current[0]
+            self._sessions[session_id] = [manager, record["version"] if record else None]
+            self._sessions.move_to_end(session_id)
+            self._evict()
+        return manager
+
+    def save(self, session_id: str, manager: ConversationManager):
+        """Queue the session's current state for writing, returns at once"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None or entry[0] is not manager:
+                # Evicted or replaced while the turn ran, this state is the newest
+                entry = self._sessions[session_id] = [manager, entry[1] if entry else None]
+            self._dirty[session_id] = manager.state.snapshot()
+        self._wake.set()
+
+    def reset(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._dirty.pop(session_id, None)
+        self.store.delete(session_id)
+
+    def _evict(self):
+        # Called with the lock held; unwritten sessions stay until the writer has them,
+        # and the session just used stays too
+        while len(self._sessions) > self.cache_size:
+            victim = next((sid for sid in list(self._sessions)[:-1] if sid not in self._dirty), None)
+            if victim is None:
+                break
+            del self._sessions[victim]
+
+    def flush(self) -> int:
+        """Write the queued states now; returns how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                batch = dict(self._dirty)
+            if not batch:
+                return 0
+            try:
+                versions = self.store.save_many(batch)
+            except Exception as e:
+                logger.error(f"Writing {len(batch)} sessions failed, will retry: {e}")
+                return 0
+            with self._lock:
+                for session_id, state in batch.items():
+                    # Sessions saved again meanwhile stay queued with the newer state
+                    if self._dirty.get(session_id) is state:
+                        del self._dirty[session_id]
+                    entry = self._sessions.get(session_id)
+                    if entry is not None:
+                        entry[1] = versions[session_id]
+                self._evict()
+            return len(batch)
+
+    def compact(self) -> int:
+        """Drop sessions idle longer than the TTL from the store"""
+        removed = self.store.compact(time.time() - self.ttl)
+        if removed:
+            logger.info(f"Compacted {removed} expired sessions")
+        return removed
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            # Let a burst of turns collect into one batch
+            time.sleep(min(self.flush_seconds, 0.05))
+            try:
+                self.flush()
+                if time.monotonic() - self._last_compact >= self.compact_seconds:
+                    self._last_compact = time.monotonic()
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Session writer failed: {e}")
+
+    def close(self):
+        """Write whatever is queued and stop the writer"""
+        self._closed = True
+        self._wake.set()
+        self._writer.join(timeout=5)
+        self.flush()
+
+_manager: Optional[SessionManager] = None
+_manager_lock = threading.Lock()
+
+def get_session_manager() -> SessionManager:
+    """Shared session manager for SESSION_BACKEND, created on first use"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            if SESSION_BACKEND == "sqlite":
+                store = SQLiteSessionStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), SESSION_DB_FILE))
+            elif SESSION_BACKEND == "memory":
+                store = MemorySessionStore()
+            else:
+                raise ValueError(f"Unknown session backend: {SESSION_BACKEND}")
+            _manager = SessionManager(store)
+            # Queued turns are written before the process exits, e.g. in a rolling restart
+            atexit.register(_manager.close)
+        return _manager
+
+def set_session_manager(manager: Optional[SessionManager]):
+    global _manager
+    with _manager_lock:
+        _manager = manager
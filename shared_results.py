@@ -0,0 +1,77 @@
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Callable, Dict, Optional
+from resilience import DeadlineExceeded
+
+_current = contextvars.ContextVar("shared_results", default=None)
+
+# Given to the callers waiting on a computation whose owner failed
+_FAILED = object()
+
+def result_key(*parts) -> str:
+    """Hash of an LLM prompt or SQL query and its options"""
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class SharedResults:
+    """Results of identical LLM calls and SQL queries, shared by the queries of a
+    batch; a call already running for the same key is waited on, not repeated"""
+
+    def __init__(self):
+        self._futures: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: str, compute: Callable, timeout: Optional[float] = None):
+        started = time.monotonic()
+        with self._lock:
+            future = self._futures.get(key)
+            owner = future is None
+            if owner:
+                future = self._futures[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if owner:
+            try:
+                value = compute()
+            except BaseException:
+                # Failures are not shared, e.g. the owner's own deadline running out:
+                # callers waiting on it and the next caller try again themselves
+                with self._lock:
+                    self._futures.pop(key, None)
+                future.set_result(_FAILED)
+                raise
+            future.set_result(value)
+            return value
+
+        try:
+            value = future.result(timeout)
+        except FutureTimeout:
+            raise DeadlineExceeded("Timed out waiting for a shared result")
+        if value is _FAILED:
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - started))
+            return self.get_or_compute(key, compute, remaining)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"shared_hits": self.hits, "shared_misses": self.misses}
+
+def current_shared_results() -> Optional[SharedResults]:
+    return _current.get()
+
+@contextmanager
+def use_shared_results(shared: SharedResults):
+    """Let query_llm and run_sql calls in this context share results"""
+    token = _current.set(shared)
+    try:
+        yield shared
+    finally:
+        _current.reset(token)
@@ -0,0 +1,510 @@
+# sql_eval.py - SQL generation evaluation over the training corpus
+import os
+import re
+import sys
+import json
+import time
+import math
+import sqlite3
+import hashlib
+import logging
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from index_advisor import table_aliases
+from sql_index import DATABASES, COMBINED_DB_ID
+from pipeline import generate_sql, SQL_TEMPLATES
+from llm_backends import LLMBackend, BackendPool, get_pool, set_pool
+from db_utils import get_read_connection
+from structured_logging import setup_logging
+from config import (SQL_INDEX_TRAINING_FILE, SQL_EVAL_WORKERS, SQL_EVAL_REPORT_FILE, SQL_EVAL_FIXTURE_ROWS,
+                    GENERATION_PROFILES, DB_STATEMENT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+REPORT_VERSION = 1
+
+# Summary metrics compared between two reports, and whether higher is better
+COMPARED_METRICS = {
+    "execution_accuracy": True,
+    "result_match": True,
+    "exact_match": True,
+    "tokens_mean": False,
+    "latency_p50": False,
+    "latency_p90": False,
+    "latency_p99": False
+}
+
+def load_cases(training: List[Dict], db_ids: Optional[List[str]] = None, limit: Optional[int] = None) -> List[Dict]:
+    """One case per training pair and database it runs on; pairs for both databases
+    are tried on each, like the SQL index does"""
+    cases = []
+    for i, item in enumerate(training[:limit] if limit else training):
+        question, target = item.get("question", "").strip(), item.get("target", "").strip().rstrip(";")
+        db_id = item.get("db_id")
+        if not question or not target or (db_ids and db_id not in db_ids):
+            continue
+        for database in (list(DATABASES) if db_id == COMBINED_DB_ID else [db_id]):
+            if database in DATABASES:
+                cases.append({"id": f"{i}:{database}", "db_id": db_id, "database": database,
+                              "question": question, "target": target})
+    return cases
+
+# --- Result comparison -------------------------------------------------------
+
+def _normalize_value(value):
+    if isinstance(value, (float, Decimal)):
+        return round(float(value), 6)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    if value is None or isinstance(value, (int, str)):
+        return value
+    return str(value)
+
+def has_top_level_order(sql: str) -> bool:
+    """ORDER BY outside any parentheses, i.e. the row order is part of the answer"""
+    depth = 0
+    for token in re.findall(r"\(|\)|\border\s+by\b", re.sub(r"'(?:[^']|'')*'", "''", sql), re.IGNORECASE):
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            return True
+    return False
+
+def results_match(expected: List[tuple], actual: List[tuple], ordered: bool = False) -> bool:
+    """Same rows with the same column order; as a multiset unless ordered"""
+    expected = [tuple(_normalize_value(v) for v in row) for row in expected]
+    actual = [tuple(_normalize_value(v) for v in row) for row in actual]
+    return expected == actual if ordered else Counter(expected) == Counter(actual)
+
+def normalize_sql(sql: str) -> str:
+    return re.sub(r"\s+", " ", (sql or "").strip().rstrip(";")).lower()
+
+# --- Executors ---------------------------------------------------------------
+
+def execute_rows(database: str, sql: str) -> List[tuple]:
+    """Rows of a query in a read-only transaction on the live database; raises on failure"""
+    conn = get_read_connection(DATABASES[database], statement_timeout=DB_STATEMENT_TIMEOUT)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql)
+        return cur.fetchall() if cur.description else []
+    finally:
+        conn.close()
+
+def sqlite_dialect(sql: str) -> str:
+    """The Postgres constructs the SQL prompts use, in SQLite's spelling"""
+    sql = re.sub(r"\bilike\b", "LIKE", sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bstring_agg\s*\(", "group_concat(", sql, flags=re.IGNORECASE)
+    return re.sub(r"::\s*\w+(?:\s*\[\])?", "", sql)
+
+class FixtureExecutor:
+    """Runs queries read-only against fixture databases built by build_fixture"""
+
+    def __init__(self, paths: Dict[str, str]):
+        self.paths = paths
+        self._local = threading.local()
+
+    def __call__(self, database: str, sql: str) -> List[tuple]:
+        connections = self._local.__dict__.setdefault("connections", {})
+        conn = connections.get(database)
+        if conn is None:
+            conn = connections[database] = sqlite3.connect(f"file:{self.paths[database]}?mode=ro", uri=True)
+        return conn.execute(sqlite_dialect(sql)).fetchall()
+
+# --- Fixture databases -------------------------------------------------------
+
+def parse_schema(text: str) -> Dict[str, Dict[str, str]]:
+    """{table: {column: type}} from a training input's 'Schema:' part"""
+    tables = {}
+    for part in text.split("Schema:", 1)[-1].split("[SEP]"):
+        part = re.split(r",\s*(?:foreign_key|primary key):", part)[0]
+        names = re.findall(r'"(\w+)"', part)
+        if not names:
+            continue
+        columns = tables.setdefault(names[0], {})
+        for column, kind in re.findall(r'"(\w+)"\s+(\w+)', part[part.index(names[0]) + len(names[0]) + 1:]):
+            columns.setdefault(column, kind)
+    return tables
+
+def target_literals(sql: str) -> Dict[tuple, List]:
+    """(table, column) -> literals a query compares the column with"""
+    aliases = table_aliases(sql)
+    tables = set(aliases.values())
+    found: Dict[tuple, List] = {}
+    for reference, text, number in re.findall(
+            r"([\w.]+)\s*(?:=|i?like)\s*(?:'((?:[^']|'')*)'|(-?\d+(?:\.\d+)?)\b)", sql, re.IGNORECASE):
+        parts = reference.lower().split(".")
+        table = aliases.get(parts[0]) if len(parts) == 2 else (next(iter(tables)) if len(tables) == 1 else None)
+        if table:
+            value = text.replace("''", "'").strip("%") if not number else float(number) if "." in number else int(number)
+            found.setdefault((table, parts[-1]), []).append(value)
+    return found
+
+def target_columns(sql: str) -> List[tuple]:
+    """(table, column) pairs a query references as alias.column"""
+    aliases = table_aliases(sql)
+    return [(aliases[alias], column) for alias, column in re.findall(r"\b(\w+)\.(\w+)\b", sql.lower())
+            if alias in aliases]
+
+def _fixture_rows(tables: Dict[str, Dict[str, str]], literals: Dict[tuple, List], max_rows: int) -> Dict[str, List]:
+    """Synthetic rows: every literal a target query looks for exists, and child rows
+    cycle through their parents so joins on l_<table>_id find matches"""
+    rows: Dict[str, List] = {}
+    pending = dict(tables)
+
+    def parents_of(table):
+        return {column: column[2:-3] for column in tables[table]
+                if column.startswith("l_") and column.endswith("_id") and column[2:-3] in tables}
+
+    while pending:
+        # Parents first; on a reference cycle the first remaining table goes ahead anyway
+        ready = [table for table in pending
+                 if all(parent in rows or parent == table for parent in parents_of(table).values())]
+        for table in ready or [next(iter(pending))]:
+            columns, parents = tables[table], parents_of(table)
+            values = {column: sorted(set(literals.get((table, column), [])), key=str) for column in columns}
+            sizes = {column: max(len(rows.get(parent, [])), 1) for column, parent in parents.items()}
+            combinations = math.prod(sizes.values())
+            count = min(max([len(v) for v in values.values()] + [3]) * combinations, max_rows)
+
+            table_rows = []
+            for r in range(count):
+                # Low digits of r pick the parents, the rest picks the literal or synthetic value
+                row, stride, own = [], 1, r // combinations
+                for column, kind in columns.items():
+                    if column == "id":
+                        row.append(r + 1)
+                    elif column in parents:
+                        row.append((r // stride) % sizes[column] + 1)
+                        stride *= sizes[column]
+                    elif own < len(values[column]):
+                        row.append(values[column][own])
+                    elif kind == "int":
+                        row.append(r * 7 % 500 + 1)
+                    elif kind == "real":
+                        row.append(round((r * 13 % 100) / 100, 2))
+                    else:
+                        row.append(f"{column}_{r + 1}")
+                table_rows.append(row)
+            rows[table] = table_rows
+            del pending[table]
+    return rows
+
+def build_fixture(training: List[Dict], directory: str, max_rows: int = SQL_EVAL_FIXTURE_ROWS) -> Dict[str, str]:
+    """SQLite stand-ins for the databases, with the tables from the training schemas
+    and rows for the values the target queries filter on; returns {database: path}"""
+    schemas: Dict[str, Dict[str, Dict[str, str]]] = {database: {} for database in DATABASES}
+    literals: Dict[str, Dict[tuple, List]] = {database: {} for database in DATABASES}
+    for item in training:
+        # The combined schema mixes both databases' tables, only the single-database ones are used
+        if item.get("db_id") in schemas:
+            for table, columns in parse_schema(item.get("input", "")).items():
+                for column, kind in columns.items():
+                    schemas[item["db_id"]].setdefault(table, {}).setdefault(column, kind)
+    for item in training:
+        databases = list(DATABASES) if item.get("db_id") == COMBINED_DB_ID else [item.get("db_id")]
+        for database in databases:
+            if database not in DATABASES:
+                continue
+            tables = schemas[database]
+            # Columns the targets use that the training schema leaves out; combined pairs
+            # don't add any, they only run where their columns exist
+            for table, column in target_columns(item.get("target", "")) if database == item["db_id"] else []:
+                if table in tables and column not in tables[table]:
+                    tables[table][column] = "int" if column.endswith(("_id", "position")) else "text"
+            for key, values in target_literals(item.get("target", "")).items():
+                literals[database].setdefault(key, []).extend(values)
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for database, tables in schemas.items():
+        path = paths[database] = os.path.join(directory, f"{database}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        conn = sqlite3.connect(path)
+        try:
+            rows = _fixture_rows(tables, literals[database], max_rows)
+            for table, columns in tables.items():
+                definition = ", ".join(f"{column} {'INTEGER PRIMARY KEY' if column == 'id' else kind.upper()}"
+                                       for column, kind in columns.items())
+                conn.execute(f"CREATE TABLE {table} ({definition})")
+                conn.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * len(columns))})", rows[table])
+            conn.commit()
+        finally:
+            conn.close()
+        logger.info(f"Built {database} fixture with {len(tables)} tables in {path}")
+    return paths
+
+# --- Fake LLM ----------------------------------------------------------------
+
+class FakeSQLModel(BaseHTTPRequestHandler):
+    """Ollama API that answers SQL prompts from server.answers by their USER QUESTION,
+    streaming one token per word and reporting token counts like Ollama does"""
+
+    def do_GET(self):
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{"models": []}')
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = payload.get("prompt") or "\n".join(m.get("content", "") for m in payload.get("messages", []))
+        match = re.search(r"USER QUESTION:\s*(.+)", prompt)
+        answer = self.server.answers.get(match.group(1).strip() if match else "", "SELECT 1")
+        for stop in (payload.get("options") or {}).get("stop") or []:
+            answer = answer.split(stop)[0]
+
+        self.send_response(200)
+        self.end_headers()
+        key = "message" if self.path == "/api/chat" else "response"
+        words = re.findall(r"\s*\S+", answer)
+        try:
+            for word in words:
+                chunk = {"message": {"content": word}} if key == "message" else {"response": word}
+                self.wfile.write((json.dumps(chunk) + "\n").encode())
+                self.wfile.flush()
+                time.sleep(self.server.delay)
+            done = {"done": True, "prompt_eval_count": len(prompt.split()), "eval_count": len(words)}
+            self.wfile.write((json.dumps(done) + "\n").encode())
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+def start_fake_llm(answers: Dict[str, str], delay: float = 0.0) -> ThreadingHTTPServer:
+    """Serve FakeSQLModel on a free local port; answers maps questions to SQL"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeSQLModel)
+    server.answers = answers
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def fake_llm_pool(server: ThreadingHTTPServer) -> BackendPool:
+    return BackendPool([LLMBackend(f"http://127.0.0.1:{server.server_address[1]}", name="fake-sql")])
+
+# --- Evaluation --------------------------------------------------------------
+
+def evaluate_case(case: Dict, execute: Callable[[str, str], List[tuple]],
+                  generate: Callable = generate_sql) -> Optional[Dict]:
+    """Generate SQL for one case and compare what it returns with the target's rows.
+    None for a combined pair whose target doesn't run on the case's database"""
+    result = {key: case[key] for key in ("id", "db_id", "database", "question")}
+    try:
+        expected = execute(case["database"], case["target"])
+    except Exception as e:
+        if case["db_id"] == COMBINED_DB_ID:
+            return None
+        result.update(status="target_error", error=str(e).strip()[:200])
+        return result
+    result["target_rows"] = len(expected)
+
+    stats = {}
+    started = time.perf_counter()
+    try:
+        sql = generate(case["database"], case["question"], stats=stats)
+    except Exception as e:
+        result.update(status="generation_error", latency=round(time.perf_counter() - started, 4),
+                      error=str(e).strip()[:200])
+        return result
+    result.update(latency=round(time.perf_counter() - started, 4), sql=sql,
+                  tokens=stats.get("completion_tokens"), prompt_tokens=stats.get("prompt_tokens"),
+                  exact=normalize_sql(sql) == normalize_sql(case["target"]))
+    if not sql:
+        result["status"] = "no_sql"
+        return result
+
+    started = time.perf_counter()
+    try:
+        actual = execute(case["database"], sql)
+    except Exception as e:
+        result.update(status="execution_error", sql_latency=round(time.perf_counter() - started, 4),
+                      error=str(e).strip()[:200])
+        return result
+    result.update(sql_latency=round(time.perf_counter() - started, 4), rows=len(actual),
+                  status="match" if results_match(expected, actual, has_top_level_order(case["target"]))
+                  else "mismatch")
+    return result
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile, None without values"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+def summarize(results: List[Dict]) -> Dict:
+    """Metrics over the evaluated cases; target errors are counted but not scored.
+    execution_accuracy is the share of generated queries that run, result_match the
+    share that return the target's rows"""
+    scored = [r for r in results if r["status"] != "target_error"]
+    statuses = Counter(r["status"] for r in results)
+    latencies = [r["latency"] for r in scored if r.get("latency") is not None]
+    sql_latencies = [r["sql_latency"] for r in scored if r.get("sql_latency") is not None]
+    tokens = [r["tokens"] for r in scored if r.get("tokens") is not None]
+
+    def share(count):
+        return round(count / len(scored), 4) if scored else None
+
+    return {
+        "cases": len(scored),
+        "statuses": dict(sorted(statuses.items())),
+        "execution_accuracy": share(statuses["match"] + statuses["mismatch"]),
+        "result_match": share(statuses["match"]),
+        "exact_match": share(sum(1 for r in scored if r.get("exact"))),
+        "tokens_total": sum(tokens),
+        "tokens_mean": round(sum(tokens) / len(tokens), 2) if tokens else None,
+        "tokens_per_second": round(sum(tokens) / sum(latencies), 2) if tokens and sum(latencies) else None,
+        "latency_mean": round(sum(latencies) / len(latencies), 4) if latencies else None,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p90": percentile(latencies, 90),
+        "latency_p99": percentile(latencies, 99),
+        "latency_max": max(latencies) if latencies else None,
+        "sql_latency_p50": percentile(sql_latencies, 50),
+        "sql_latency_p99": percentile(sql_latencies, 99)
+    }
+
+def template_fingerprints() -> Dict[str, str]:
+    """Hashes of the SQL prompt templates, so reports show which versions ran"""
+    fingerprints = {}
+    for database, template in SQL_TEMPLATES.items():
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts", template)
+        with open(path, "rb") as f:
+            fingerprints[template] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return fingerprints
+
+def run_eval(cases: List[Dict], execute: Callable[[str, str], List[tuple]], workers: int = SQL_EVAL_WORKERS,
+             generate: Callable = generate_sql, progress: Optional[Callable[[int, int, Dict], None]] = None) -> Dict:
+    """Evaluate the cases on a worker pool; the report has a summary overall and per
+    db_id plus every case's outcome, ordered by case id"""
+    started = time.monotonic()
+    results = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sql-eval") as executor:
+        futures = [executor.submit(evaluate_case, case, execute, generate) for case in cases]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            if result is not None:
+                results.append(result)
+                if progress:
+                    progress(done, len(futures), result)
+    wall = time.monotonic() - started
+
+    order = {case["id"]: i for i, case in enumerate(cases)}
+    results.sort(key=lambda r: order[r["id"]])
+    summary = {"overall": summarize(results)}
+    for db_id in sorted({r["db_id"] for r in results}):
+        summary[db_id] = summarize([r for r in results if r["db_id"] == db_id])
+    pool = get_pool()
+    return {
+        "version": REPORT_VERSION,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - wall)),
+        "wall_seconds": round(wall, 3),
+        "workers": workers,
+        "config": {
+            "backends": [{"name": b.name, "kind": b.kind, "model": b.model} for b in pool.backends],
+            "sql_profile": GENERATION_PROFILES["sql"],
+            "templates": template_fingerprints()
+        },
+        "summary": summary,
+        "cases": results
+    }
+
+def compare_reports(baseline: Dict, current: Dict) -> Dict:
+    """Metric deltas per summary group, and the cases whose result match changed"""
+    groups = {}
+    for group in current["summary"]:
+        before, after = baseline["summary"].get(group, {}), current["summary"][group]
+        groups[group] = {}
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            old, new = before.get(metric), after.get(metric)
+            delta = round(new - old, 4) if old is not None and new is not None else None
+            groups[group][metric] = {"baseline": old, "current": new, "delta": delta,
+                                     "improved": (delta > 0) == higher_is_better if delta else None}
+    before = {r["id"]: r["status"] == "match" for r in baseline.get("cases", [])}
+    after = {r["id"]: r["status"] == "match" for r in current.get("cases", [])}
+    common = sorted(set(before) & set(after), key=lambda i: (int(i.split(":")[0]), i))
+    return {
+        "groups": groups,
+        "regressions": [i for i in common if before[i] and not after[i]],
+        "fixes": [i for i in common if after[i] and not before[i]]
+    }
+
+def _format_metric(value, metric):
+    if value is None:
+        return "-"
+    if metric.startswith("latency"):
+        return f"{value * 1000:.0f}ms"
+    return f"{value:.1%}" if metric.endswith(("accuracy", "match")) else str(value)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Evaluate SQL generation on the training question/SQL pairs")
+    parser.add_argument("--training", default=SQL_INDEX_TRAINING_FILE)
+    parser.add_argument("--workers", type=int, default=SQL_EVAL_WORKERS)
+    parser.add_argument("--db-id", action="append", help="Only pairs with this db_id (repeatable)")
+    parser.add_argument("--limit", type=int, help="Only the first N training pairs")
+    parser.add_argument("--output", "-o", default=SQL_EVAL_REPORT_FILE)
+    parser.add_argument("--compare", help="Earlier report to compare the metrics with")
+    parser.add_argument("--offline", action="store_true", help="Same as --llm fake --db fixture")
+    parser.add_argument("--llm", choices=["live", "fake"], default="live",
+                        help="fake answers every question with its target SQL")
+    parser.add_argument("--db", choices=["live", "fixture"], default="live",
+                        help="fixture runs the SQL on SQLite databases built from the training schemas")
+    parser.add_argument("--fixture-dir", help="Where to build the fixture databases, a temporary directory if omitted")
+    parser.add_argument("--fake-delay", type=float, default=0.0, help="Seconds per token of the fake LLM")
+    args = parser.parse_args(argv)
+
+    setup_logging(console=False, force=True)
+    with open(args.training, "r", encoding="utf-8") as f:
+        training = json.load(f)
+    cases = load_cases(training, args.db_id, args.limit)
+    llm, db = ("fake", "fixture") if args.offline else (args.llm, args.db)
+
+    server = None
+    if llm == "fake":
+        server = start_fake_llm({item["question"].strip(): item["target"] for item in training}, args.fake_delay)
+        set_pool(fake_llm_pool(server))
+    if db == "fixture":
+        execute = FixtureExecutor(build_fixture(training, args.fixture_dir or tempfile.mkdtemp(prefix="sql_eval_")))
+    else:
+        execute = execute_rows
+
+    def progress(done, total, result):
+        print(f"[{done}/{total}] {result['status']} {result['id']}: {result['question']}", file=sys.stderr)
+
+    try:
+        report = run_eval(cases, execute, args.workers, progress=progress)
+    finally:
+        if server is not None:
+            server.shutdown()
+    report["config"].update(llm=llm, db=db, training=args.training)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1)
+
+    for group, metrics in report["summary"].items():
+        print(f"{group}: {metrics['cases']} cases, execution accuracy "
+              f"{_format_metric(metrics['execution_accuracy'], 'execution_accuracy')}, result match "
+              f"{_format_metric(metrics['result_match'], 'result_match')}, {metrics['tokens_total']} tokens, latency p50/p90/p99 "
+              + "/".join(_format_metric(metrics[f"latency_p{q}"], "latency") for q in (50, 90, 99)))
+    print(f"Report written to {args.output} ({report['wall_seconds']:.1f}s with {args.workers} workers)")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            comparison = compare_reports(json.load(f), report)
+        for group, metrics in comparison["groups"].items():
+            changes = [f"{metric} {_format_metric(m['baseline'], metric)} -> {_format_metric(m['current'], metric)}"
+                       for metric, m in metrics.items() if m["delta"]]
+            print(f"{group}: {', '.join(changes) or 'no change'}")
+        print(f"{len(comparison['regressions'])} regressions: {', '.join(comparison['regressions'][:20])}")
+        print(f"{len(comparison['fixes'])} fixes: {', '.join(comparison['fixes'][:20])}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
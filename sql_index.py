@@ -0,0 +1,152 @@
+# sql_index.py - validated question -> SQL lookup built from the training corpus
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from typing import Callable, Dict, List, Optional
+from semantic_cache import STOPWORDS
+from db_utils import get_read_connection
+from structured_logging import setup_logging
+from config import (DB_NAME_SCOP3P, DB_NAME_SCOP3PTM, SQL_INDEX_FILE, SQL_INDEX_TRAINING_FILE,
+                    SQL_INDEX_ENABLED, DB_STATEMENT_TIMEOUT)
+
+logger = logging.getLogger(__name__)
+
+DATABASES = {"scop3p": DB_NAME_SCOP3P, "scop3ptm": DB_NAME_SCOP3PTM}
+
+# Training entries for both databases are validated against each of them
+COMBINED_DB_ID = "protein_databases_combined"
+
+def normalize_question(question: str) -> str:
+    """Lowercase words and numbers only, for exact matching"""
+    return " ".join(re.findall(r"[a-z0-9]+(?:[/\-][a-z0-9]+)*", (question or "").lower()))
+
+# Question words and connectives change what is asked for ("who detected" vs
+# "how was ... detected", "phosphorylation and acetylation" vs "... or acetylation"),
+# so unlike in the answer cache they are part of the key
+QUESTION_WORDS = {"who", "whom", "how", "why", "when", "where"}
+CONNECTIVES = {"and", "or", "with", "in"}
+KEY_STOPWORDS = STOPWORDS - QUESTION_WORDS - CONNECTIVES
+
+def token_key(question: str) -> str:
+    """Order-free content words with plurals folded, for near-exact matching.
+    Every content word must match, so questions about different proteins never do"""
+    words = {w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith("ss") else w
+             for w in re.findall(r"[a-z0-9][a-z0-9\-]*", (question or "").lower()) if w not in KEY_STOPWORDS}
+    return " ".join(sorted(words))
+
+class SqlIndex:
+    """Known-good SQL for questions from the training corpus"""
+
+    def __init__(self, entries: List[Dict]):
+        self.entries = entries
+        self.exact: Dict[tuple, Dict] = {}
+        self.near: Dict[tuple, Dict] = {}
+        for entry in entries:
+            self.exact.setdefault((entry["db"], normalize_question(entry["question"])), entry)
+            key = token_key(entry["question"])
+            if key:
+                self.near.setdefault((entry["db"], key), entry)
+
+    def lookup(self, question: str, database: str) -> Optional[str]:
+        """Stored SQL for an exact or near-exact match of the question, else None"""
+        entry = self.exact.get((database, normalize_question(question)))
+        if entry is None:
+            key = token_key(question)
+            entry = self.near.get((database, key)) if key else None
+        if entry is None:
+            return None
+        logger.info(f"SQL index hit for {database}: '{question}' ~ '{entry['question']}'")
+        return entry["sql"]
+
+    def __len__(self):
+        return len(self.entries)
+
+    @classmethod
+    def load(cls, path: str) -> "SqlIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f)["entries"])
+
+def execute_readonly(database: str, sql: str) -> int:
+    """Run a query in a read-only transaction and return its row count; raises on failure"""
+    conn = get_read_connection(DATABASES[database], statement_timeout=DB_STATEMENT_TIMEOUT)
+    try:
+        cur = conn.cursor()
+        cur.execute(sql)
+        return len(cur.fetchall()) if cur.description else 0
+    finally:
+        conn.close()
+
+def build_index(training: List[Dict], execute: Callable[[str, str], int] = execute_readonly,
+                require_rows: bool = False) -> List[Dict]:
+    """Keep the training pairs whose SQL executes, one entry per database it runs on"""
+    entries = []
+    for i, item in enumerate(training, 1):
+        question, sql = item.get("question", "").strip(), item.get("target", "").strip().rstrip(";")
+        if not question or not sql:
+            continue
+        databases = list(DATABASES) if item.get("db_id") == COMBINED_DB_ID else [item.get("db_id")]
+        for database in databases:
+            if database not in DATABASES:
+                continue
+            try:
+                rows = execute(database, sql)
+            except Exception as e:
+                logger.info(f"[{i}/{len(training)}] {database} rejected '{question}': {str(e).strip()[:120]}")
+                continue
+            if require_rows and not rows:
+                continue
+            entries.append({"question": question, "db": database, "sql": sql, "rows": rows})
+    return entries
+
+def write_index(entries: List[Dict], path: str = SQL_INDEX_FILE):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"built_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "entries": entries}, f, indent=1)
+
+_index: Optional[SqlIndex] = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+def get_sql_index() -> Optional[SqlIndex]:
+    """Shared index loaded from SQL_INDEX_FILE, None if disabled or not built yet"""
+    global _index, _index_loaded
+    with _index_lock:
+        if not _index_loaded:
+            _index_loaded = True
+            path = os.path.join(os.path.dirname(__file__), SQL_INDEX_FILE)
+            if SQL_INDEX_ENABLED and os.path.exists(path):
+                try:
+                    _index = SqlIndex.load(path)
+                    logger.info(f"Loaded {len(_index)} validated SQL entries from {path}")
+                except Exception as e:
+                    logger.warning(f"Could not load SQL index: {e}")
+        return _index
+
+def set_sql_index(index: Optional[SqlIndex]):
+    """Replace the shared index, e.g. after a rebuild"""
+    global _index, _index_loaded
+    with _index_lock:
+        _index, _index_loaded = index, True
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the validated question -> SQL index")
+    parser.add_argument("--training", default=SQL_INDEX_TRAINING_FILE)
+    parser.add_argument("--output", "-o", default=SQL_INDEX_FILE)
+    parser.add_argument("--require-rows", action="store_true", help="Drop queries that return no rows")
+    args = parser.parse_args(argv)
+
+    setup_logging(log_file=None, console=True, force=True)
+    with open(args.training, "r", encoding="utf-8") as f:
+        training = json.load(f)
+
+    entries = build_index(training, require_rows=args.require_rows)
+    write_index(entries, args.output)
+    print(f"Kept {len(entries)} validated queries from {len(training)} training pairs in {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import re
+import json
+import time
+import uuid
+import queue
+import atexit
+import random
+import logging
+import contextvars
+import logging.handlers
+from contextlib import contextmanager
+from typing import Dict, Optional
+from config import (LOG_FILE, LOG_LEVEL, LOG_FORMAT, LOG_ROTATION, LOG_MAX_BYTES, LOG_ROTATE_WHEN,
+                    LOG_BACKUP_COUNT, LOG_BODY_SAMPLE_RATE, LOG_BODY_MAX_CHARS, LOG_MESSAGE_MAX_CHARS)
+
+logger = logging.getLogger(__name__)
+
+_request_id = contextvars.ContextVar("request_id", default=None)
+_stage_timings = contextvars.ContextVar("stage_timings", default=None)
+
+# Record attributes set by logging itself, everything else came in via extra=
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Client-supplied request ids end up in log records and profile file names
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+def current_request_id() -> Optional[str]:
+    return _request_id.get()
+
+def safe_request_id(request_id: Optional[str] = None) -> str:
+    """The given id if it is a plain token, otherwise a new one"""
+    if isinstance(request_id, str) and REQUEST_ID_PATTERN.match(request_id):
+        return request_id
+    return uuid.uuid4().hex[:12]
+
+@contextmanager
+def request_scope(request_id: Optional[str] = None):
+    """Tag log records in this context with a request id and collect stage timings;
+    nested scopes reuse the outer request"""
+    if _request_id.get() is not None and request_id in (None, _request_id.get()):
+        yield _request_id.get()
+        return
+
+    id_token = _request_id.set(request_id or uuid.uuid4().hex[:12])
+    timings_token = _stage_timings.set({})
+    try:
+        yield _request_id.get()
+    finally:
+        _stage_timings.reset(timings_token)
+        _request_id.reset(id_token)
+
+class StageClock:
+    """Lap timer adding the time since the previous lap to the request's stage timings"""
+
+    def __init__(self):
+        self.last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] = round(timings.get(stage, 0.0) + now - self.last, 4)
+        self.last = now
+
+def stage_timings() -> Dict[str, float]:
+    return dict(_stage_timings.get() or {})
+
+def log_body(log: logging.Logger, label: str, body, level: int = logging.INFO):
+    """Log a prompt or response body; handlers sample and truncate it off the request path"""
+    if log.isEnabledFor(level):
+        size = f" (length: {len(body)})" if isinstance(body, str) else ""
+        log.log(level, f"{label}{size}", extra={"body": body})
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the request id and sample prompt/response bodies"""
+
+    def __init__(self, body_sample_rate: float = LOG_BODY_SAMPLE_RATE):
+        super().__init__()
+        self.body_sample_rate = body_sample_rate
+
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        if getattr(record, "body", None) is not None and random.random() >= self.body_sample_rate:
+            record.body = None
+            record.body_sampled_out = True
+        return True
+
+def _truncate(text: str, limit: int) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... (+{len(text) - limit} chars)"
+    return text
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def __init__(self, body_max_chars: int = LOG_BODY_MAX_CHARS, message_max_chars: int = LOG_MESSAGE_MAX_CHARS):
+        super().__init__()
+        self.body_max_chars = body_max_chars
+        self.message_max_chars = message_max_chars
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": _truncate(record.getMessage(), self.message_max_chars)
+        }
+        for key, value in vars(record).items():
+            if key in _RESERVED or key in entry or value is None:
+                continue
+            if key == "body":
+                value = _truncate(value if isinstance(value, str) else json.dumps(value, default=str),
+                                  self.body_max_chars)
+            entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class TextFormatter(logging.Formatter):
+    """The classic one-line format, with the request id and any sampled body"""
+
+    def __init__(self, body_max_chars: int = LOG_BODY_MAX_CHARS, message_max_chars: int = LOG_MESSAGE_MAX_CHARS):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        self.body_max_chars = body_max_chars
+        self.message_max_chars = message_max_chars
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            line = f"[{request_id}] {line}"
+        # Generated SQL (extra={"sql": ...}) is kept whole for the index advisor
+        if getattr(record, "sql", None) is None:
+            line = _truncate(line, self.message_max_chars)
+        stages = getattr(record, "stages", None)
+        if stages:
+            line += " " + ", ".join(f"{stage}={seconds:.3f}s" for stage, seconds in stages.items())
+        body = getattr(record, "body", None)
+        if body is not None:
+            line += ": " + _truncate(str(body), self.body_max_chars)
+        return line
+
+def build_file_handler(path: str = LOG_FILE, rotation: str = LOG_ROTATION) -> logging.Handler:
+    """Size- or time-rotated log file"""
+    if rotation == "time":
+        return logging.handlers.TimedRotatingFileHandler(path, when=LOG_ROTATE_WHEN,
+                                                         backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    if rotation == "size":
+        return logging.handlers.RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES,
+                                                    backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    return logging.FileHandler(path, encoding="utf-8")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+
+def setup_logging(log_file: Optional[str] = LOG_FILE, console: bool = True, level=LOG_LEVEL,
+                  log_format: str = LOG_FORMAT, body_sample_rate: float = LOG_BODY_SAMPLE_RATE,
+                  force: bool = False) -> bool:
+    """Route all logging through a queue to a background writer thread.
+    Like basicConfig, does nothing if the root logger is already configured
+    unless force is set; returns whether logging was (re)configured"""
+    global _listener, _queue_handler
+    root = logging.getLogger()
+    if root.handlers and not force:
+        return False
+    shutdown_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+
+    handlers = []
+    if log_file:
+        file_handler = build_file_handler(log_file)
+        file_handler.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(TextFormatter())
+        handlers.append(console_handler)
+
+    _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(RequestContextFilter(body_sample_rate))
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+    return True
+
+def shutdown_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,104 @@
+import sys
+sys.path.append('.')
+
+import time
+import threading
+import batch
+from resilience import DeadlineExceeded
+from batch import run_batch
+from shared_results import SharedResults, use_shared_results
+from llm_backends import BackendPool, set_pool
+from llm_client import query_llm
+from test_llm_backends import start_fake_server, backend_for
+
+def test_shared_results():
+    print("=== Testing Shared Results ===")
+    
+    shared = SharedResults()
+    calls = []
+    assert shared.get_or_compute("k", lambda: calls.append(1) or "v") == "v"
+    assert shared.get_or_compute("k", lambda: calls.append(1) or "other") == "v"
+    assert len(calls) == 1
+    
+    # Failures are not shared
+    try:
+        shared.get_or_compute("bad", lambda: 1 / 0)
+    except ZeroDivisionError:
+        pass
+    assert shared.get_or_compute("bad", lambda: "retried") == "retried"
+    
+    # Callers already waiting when the owner fails compute it themselves
+    started = threading.Event()
+    
+    def failing_owner():
+        started.set()
+        time.sleep(0.1)
+        raise DeadlineExceeded("owner ran out of time")
+    
+    def own():
+        try:
+            shared.get_or_compute("slow", failing_owner)
+        except DeadlineExceeded:
+            pass
+    
+    owner = threading.Thread(target=own)
+    owner.start()
+    started.wait(5)
+    assert shared.get_or_compute("slow", lambda: "mine", timeout=5) == "mine"
+    owner.join()
+    
+    # Concurrent identical LLM calls in a batch reach the server once
+    server = start_fake_server("shared")
+    set_pool(BackendPool([backend_for(server)]))
+    answers = []
+    
+    def ask():
+        with use_shared_results(shared):
+            answers.append(query_llm("same prompt", stage="sql", system="schema"))
+    
+    try:
+        threads = [threading.Thread(target=ask) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        print(f"Answers: {answers}, server requests: {server.requests}")
+        assert answers == ["shared ok"] * 4 and server.requests == 1
+        
+        # Outside a batch nothing is shared
+        query_llm("same prompt", stage="sql", system="schema")
+        assert server.requests == 2
+    finally:
+        set_pool(None)
+        server.shutdown()
+
+def test_run_batch():
+    print("=== Testing Batch Runner ===")
+    
+    managers = []
+    
+    def fake_handle_query(query, response_mode=None, deadline=None, manager=None):
+        if query == "boom":
+            raise RuntimeError("failed")
+        # Each query sees a fresh conversation
+        assert not manager.state.conversation_history
+        manager.record_interaction(query, "answer")
+        managers.append(manager)
+        return f"answer to {query}"
+    
+    original = batch.handle_query
+    batch.handle_query = fake_handle_query
+    try:
+        results = list(run_batch(["a", "boom", "c"], max_workers=2))
+    finally:
+        batch.handle_query = original
+    
+    results.sort(key=lambda r: r["index"])
+    print(f"Results: {results}")
+    assert [r["status"] for r in results] == ["success", "error", "success"]
+    assert results[2]["response"] == "answer to c"
+    assert len({id(m) for m in managers}) == 2
+
+if __name__ == "__main__":
+    test_shared_results()
+    test_run_batch()
@@ -0,0 +1,86 @@
+import sys
+sys.path.append('.')
+
+import os
+import tempfile
+import db_utils
+from result_set import ResultSet
+from cassette import use_cassette, recorded, current_cassette, CassetteMiss
+from llm_backends import BackendPool, set_pool
+from llm_client import query_llm
+from db_utils import run_sql
+from test_llm_backends import start_fake_server, backend_for
+
+def test_record_and_replay():
+    print("=== Testing Cassette Record/Replay ===")
+    
+    path = os.path.join(tempfile.mkdtemp(), "session.json.gz")
+    server = start_fake_server("recorded")
+    set_pool(BackendPool([backend_for(server)]))
+    execute = db_utils._execute
+    db_utils._execute = lambda dbname, sql, *args: ResultSet(["accession", "count"], [("P04637", 3)])
+    try:
+        with use_cassette(path, "record") as cassette:
+            answer = query_llm("classify this", stage="router", system="schema")
+            rows = run_sql("scop3p", "SELECT 1")
+        print(f"Recorded: {answer}, {rows}, {cassette.stats()}")
+        assert cassette.recorded == 2 and server.requests == 1
+    finally:
+        db_utils._execute = execute
+        server.shutdown()
+    
+    # Replay needs neither the LLM server nor the database
+    try:
+        with use_cassette(path, "replay", latency_scale=1.0) as cassette:
+            assert query_llm("classify this", stage="router", system="schema") == answer
+            replayed = run_sql("scop3p", "SELECT 1")
+            assert isinstance(replayed, ResultSet) and replayed == rows
+            assert run_sql("scop3p", "SELECT 1 ")[0]["count"] == 3
+        print(f"Replayed: {cassette.stats()}")
+        assert cassette.hits == 3 and cassette.simulated_latency > 0
+        
+        # A different prompt or option is a miss, reported even when the caller swallows it
+        try:
+            with use_cassette(path, "replay"):
+                try:
+                    query_llm("classify this", stage="sql", system="schema")
+                except CassetteMiss as e:
+                    print(f"Miss: {e}")
+            assert False, "expected CassetteMiss on exit"
+        except CassetteMiss as e:
+            assert "1 calls" in str(e)
+    finally:
+        set_pool(None)
+
+def test_script_default():
+    print("=== Testing Script Cassette Default ===")
+
+    directory = tempfile.mkdtemp()
+    mode = os.environ.pop("CHATBOT_CASSETTE", None)
+    try:
+        # Without a recording the script talks to the live services
+        @recorded("script", directory)
+        def live():
+            return current_cassette()
+        assert live() is None
+
+        # Once one is recorded it is replayed by default
+        execute = db_utils._execute
+        db_utils._execute = lambda dbname, sql, *args: ResultSet(["n"], [(1,)])
+        try:
+            with use_cassette(os.path.join(directory, "script.json.gz"), "record"):
+                run_sql("scop3p", "SELECT 1")
+        finally:
+            db_utils._execute = execute
+
+        @recorded("script", directory)
+        def replayed():
+            return current_cassette().mode, run_sql("scop3p", "SELECT 1")
+        assert replayed() == ("replay", ResultSet(["n"], [(1,)]))
+    finally:
+        if mode is not None:
+            os.environ["CHATBOT_CASSETTE"] = mode
+
+if __name__ == "__main__":
+    test_record_and_replay()
+    test_script_default()
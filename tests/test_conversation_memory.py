@@ -0,0 +1,80 @@
+import sys
+sys.path.append('.')
+
+import time
+import threading
+from conversation_memory import ConversationMemory
+from conversation_manager import ConversationManager
+from knowledge_store import CHARS_PER_TOKEN
+
+def fake_summarize(summary, user_query, bot_response):
+    # Keeps only the last few questions, like a bounded summary would
+    return " | ".join((summary.split(" | ") + [user_query])[-3:]) if summary else user_query
+
+def test_running_summary():
+    print("=== Testing Running Conversation Summary ===")
+    
+    memory = ConversationMemory(token_budget=120, summarize=fake_summarize)
+    for i in range(50):
+        memory.record(f"Show phospho sites in P04637 number {i}", "Found 12 phosphorylation sites. " * 40,
+                      {"recent_topics": ["phospho sites"]})
+        context = memory.render()
+        # The prompt footprint stays within the budget however long the conversation runs
+        assert len(context) <= 120 * CHARS_PER_TOKEN + 10, len(context)
+    memory.wait(5)
+    
+    context = memory.render()
+    print(context)
+    assert memory.summarized_turn == 50 and not memory.pending
+    assert "number 49" in context and "P04637" in context and "phosphorylation" in context
+    # Memoized until something changes
+    assert memory.render() is context
+
+def test_summary_off_critical_path():
+    print("=== Testing Background Summary Updates ===")
+    
+    release = threading.Event()
+    calls = []
+    
+    def slow_summarize(summary, user_query, bot_response):
+        calls.append(user_query)
+        release.wait(5)
+        if user_query == "fail":
+            raise RuntimeError("LLM down")
+        return f"Discussed {user_query}"
+    
+    memory = ConversationMemory(token_budget=200, summarize=slow_summarize)
+    started = time.monotonic()
+    memory.record("Q86US8 methylation", "Two methylation sites.")
+    memory.record("fail", "An answer")
+    assert time.monotonic() - started < 0.5
+    
+    # Turns not summarized yet are still in the context
+    context = memory.render()
+    print(context)
+    assert "fail" in context and "Q86US8" in context
+    
+    release.set()
+    memory.wait(5)
+    print(memory.summary)
+    assert calls == ["Q86US8 methylation", "fail"]
+    assert memory.summary.startswith("Discussed Q86US8 methylation") and "asked: fail" in memory.summary
+    
+    memory.reset()
+    assert memory.render() == ""
+
+def test_manager_summary_mode():
+    manager = ConversationManager(max_history=4, memory="summary")
+    manager.state.memory.summarize = fake_summarize
+    manager.record_interaction("What is CSS?", "CSS is the conserved surface score.")
+    manager.state.memory.wait(5)
+    assert "What is CSS?" in manager.get_conversation_context()
+    manager.reset()
+    assert manager.state.memory is not None and manager.get_conversation_context() == "No previous conversation"
+    
+    assert ConversationManager(max_history=4, memory="window").state.memory is None
+
+if __name__ == "__main__":
+    test_running_summary()
+    test_summary_off_critical_path()
+    test_manager_summary_mode()
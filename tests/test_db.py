@@ -2,7 +2,9 @@ import sys
 sys.path.append('.')
 
 from db_utils import run_sql
+from cassette import recorded
 
+@recorded("db")
 def test_database_connections():
     print("=== Testing Database Connections ===")
     
@@ -0,0 +1,195 @@
+import sys
+sys.path.append('.')
+
+import psycopg2
+import db_utils
+from resilience import get_breaker, Deadline, CircuitOpen
+from result_set import ResultSet
+from shared_results import SharedResults, use_shared_results, result_key
+
+class FakeConnection:
+    def __init__(self, host, options):
+        self.host = host
+        self.options = options
+        self.session = None
+
+    def set_session(self, **kwargs):
+        self.session = kwargs
+
+    def cursor(self):
+        return FakeCursor(self.host)
+
+    def close(self):
+        pass
+
+class FakeCursor:
+    description = [("x",)]
+
+    def __init__(self, host):
+        self.host = host
+
+    def execute(self, sql):
+        # Queries on the "slow" server run into statement_timeout
+        if self.host == "slow":
+            raise psycopg2.extensions.QueryCanceledError("canceling statement due to statement timeout")
+
+    def fetchall(self):
+        return [(1,)]
+
+def with_fake_servers(down, targets, run):
+    """Run with psycopg2.connect failing for the hosts in down"""
+    connect, configured = psycopg2.connect, dict(db_utils.DB_TARGETS)
+
+    def fake_connect(**kwargs):
+        if kwargs["host"] in down:
+            raise psycopg2.OperationalError(f"could not connect to {kwargs['host']}")
+        return FakeConnection(kwargs["host"], kwargs["options"])
+
+    psycopg2.connect = fake_connect
+    db_utils.DB_TARGETS.clear()
+    db_utils.DB_TARGETS.update(targets)
+    try:
+        return run()
+    finally:
+        psycopg2.connect = connect
+        db_utils.DB_TARGETS.clear()
+        db_utils.DB_TARGETS.update(configured)
+
+def test_read_only_sessions():
+    print("=== Testing Read-Only Sessions ===")
+
+    targets = {"routing_ro": {"primary": {"host": "primary", "port": 5432}, "replicas": []}}
+    conn = with_fake_servers(set(), targets, lambda: db_utils.get_read_connection("routing_ro"))
+    assert conn.host == "primary"
+    assert conn.session == {"readonly": True, "isolation_level": db_utils.DB_READ_ISOLATION}
+    assert "default_transaction_read_only=on" in conn.options
+
+    # Maintenance connections stay writable
+    conn = with_fake_servers(set(), targets, lambda: db_utils.get_db_connection("routing_ro"))
+    assert conn.session is None and "read_only" not in conn.options
+
+def test_replica_round_robin():
+    print("=== Testing Replica Round Robin ===")
+
+    targets = {"routing_rr": {"primary": {"host": "primary"},
+                              "replicas": [{"host": "replica1"}, {"host": "replica2"}]}}
+    hosts = with_fake_servers(set(), targets,
+                              lambda: [db_utils.get_read_connection("routing_rr").host for _ in range(4)])
+    assert sorted(hosts) == ["replica1", "replica1", "replica2", "replica2"]
+    assert hosts[0] != hosts[1]
+
+def test_failover():
+    print("=== Testing Replica Failover ===")
+
+    targets = {"routing_fo": {"primary": {"host": "primary"},
+                              "replicas": [{"host": "replica1"}, {"host": "replica2"}]}}
+    # A replica that is down is skipped
+    hosts = with_fake_servers({"replica1"}, targets,
+                              lambda: [db_utils.get_read_connection("routing_fo").host for _ in range(10)])
+    assert hosts == ["replica2"] * 10
+
+    # Enough failures open its breaker, after which it isn't even tried
+    breaker = get_breaker("db:routing_fo@replica1:5432")
+    assert breaker.state == breaker.OPEN
+    status = with_fake_servers(set(), targets, db_utils.database_status)["routing_fo"]
+    assert [s["circuit"] for s in status] == ["closed", "open", "closed"]
+
+    # With every replica down reads go to the primary
+    hosts = with_fake_servers({"replica1", "replica2"}, targets,
+                              lambda: [db_utils.get_read_connection("routing_fo").host for _ in range(2)])
+    assert hosts == ["primary", "primary"]
+
+    # Nothing reachable is an error
+    try:
+        with_fake_servers({"replica1", "replica2", "primary"}, targets,
+                          lambda: db_utils.get_read_connection("routing_fo"))
+        raised = False
+    except Exception as e:
+        raised = "No database server available" in str(e)
+    assert raised
+
+def test_half_open_trial_not_leaked():
+    print("=== Testing Half-Open Breaker Trial ===")
+
+    breaker = get_breaker("db:routing_trial@primary:5432")
+    breaker.opened_at = 0.0  # long enough ago to be half-open
+    assert breaker.state == breaker.HALF_OPEN
+
+    # A cancelled request never takes the trial call
+    deadline = Deadline(10)
+    deadline.cancel("client went away")
+    assert db_utils.run_sql("routing_trial", "SELECT 1", deadline=deadline) == ResultSet()
+    assert not breaker._trial_running
+
+    # Neither does a result shared within a batch
+    shared = SharedResults()
+    shared.get_or_compute(result_key("sql", "routing_trial", "SELECT 1"), lambda: ResultSet(["x"], [(1,)]))
+    with use_shared_results(shared):
+        rows = db_utils.run_sql("routing_trial", "SELECT 1")
+    assert rows == ResultSet(["x"], [(1,)]) and not breaker._trial_running
+
+    # So the next real query still gets the trial, and its outcome closes the breaker
+    targets = {"routing_trial": {"primary": {"host": "primary"}, "replicas": []}}
+    with_fake_servers(set(), targets, lambda: db_utils.run_sql("routing_trial", "SELECT 1"))
+    assert breaker.state == breaker.CLOSED and not breaker._trial_running
+
+def test_breaker_outcomes():
+    print("=== Testing Database Breaker Outcomes ===")
+
+    # Slow generated queries are a query outcome, they don't open the circuit for everyone
+    breaker = get_breaker("db:routing_slow@slow:5432")
+    targets = {"routing_slow": {"primary": {"host": "slow"}, "replicas": []}}
+    for _ in range(breaker.failure_threshold + 1):
+        rows = with_fake_servers(set(), targets, lambda: db_utils.run_sql("routing_slow", "SELECT pg_sleep(60)"))
+        assert rows == ResultSet()
+    assert breaker.state == breaker.CLOSED
+
+    # A failing replica doesn't stop queries from failing over to the primary
+    targets = {"routing_down": {"primary": {"host": "primary"}, "replicas": [{"host": "replica1"}]}}
+    for _ in range(get_breaker("db:routing_down@replica1:5432").failure_threshold + 1):
+        rows = with_fake_servers({"replica1"}, targets, lambda: db_utils.run_sql("routing_down", "SELECT 1"))
+        assert rows == ResultSet(["x"], [(1,)])
+    assert get_breaker("db:routing_down@replica1:5432").state == breaker.OPEN
+
+    # No server at all is an error, not an empty result
+    try:
+        with_fake_servers({"replica1", "primary"}, targets, lambda: db_utils.run_sql("routing_down", "SELECT 1"))
+        raised = False
+    except CircuitOpen:
+        raised = True
+    assert raised
+
+def test_cancel_while_connecting():
+    print("=== Testing Cancel While Connecting ===")
+
+    # The client goes away after the cancellation check but before the query runs
+    deadline = Deadline(10)
+    executed = []
+
+    class CountingCursor(FakeCursor):
+        def execute(self, sql):
+            executed.append(sql)
+
+    def connect(dbname, statement_timeout):
+        deadline.cancel("client went away")
+        conn = FakeConnection("primary", "")
+        conn.cursor = lambda: CountingCursor("primary")
+        conn.cancel = lambda: None
+        return conn
+
+    original = db_utils.get_read_connection
+    db_utils.get_read_connection = connect
+    try:
+        rows = db_utils.run_sql("routing_cancel", "SELECT pg_sleep(60)", deadline=deadline)
+    finally:
+        db_utils.get_read_connection = original
+    assert rows == ResultSet() and executed == []
+
+if __name__ == "__main__":
+    test_read_only_sessions()
+    test_replica_round_robin()
+    test_failover()
+    test_half_open_trial_not_leaked()
+    test_breaker_outcomes()
+    test_cancel_while_connecting()
+    print("All database routing tests passed")
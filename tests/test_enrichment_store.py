@@ -0,0 +1,92 @@
+import sys
+sys.path.append('.')
+
+import os
+import fcntl
+import datetime
+import threading
+import tempfile
+from enrichment_store import write_map, map_path, EnrichmentMap, EnrichmentStore, REBUILD_LOCK
+
+COLUMNS = ["protein_id", "project_id", "project_title", "publication_date", "accession"]
+
+def project_rows(count=3):
+    rows = [(7, f"PXD00{i}", f"Project {i}", datetime.date(2020, 1, i + 1), "P04637") for i in range(count)]
+    rows.append((12, "PXD100", "Other", None, "Q86US8"))
+    return rows
+
+def test_enrichment_map():
+    print("=== Testing Enrichment Map ===")
+    
+    path = os.path.join(tempfile.mkdtemp(), "scop3p_projects.map")
+    header = write_map(path, COLUMNS, project_rows(), release="1:2:3")
+    print(header)
+    assert header["proteins"] == 2 and header["rows"] == 4
+    
+    projects = EnrichmentMap(path)
+    assert projects.columns == COLUMNS[1:] and projects.release == "1:2:3"
+    rows = projects.lookup([12, 7, 99])
+    print(rows)
+    assert [r["project_id"] for r in rows] == ["PXD100", "PXD000", "PXD001", "PXD002"]
+    assert rows[1]["publication_date"] == "2020-01-01" and rows[0]["publication_date"] is None
+    assert len(projects.lookup([7, 12], limit=2)) == 2
+    assert projects.lookup([]) == [] and projects.lookup(["x"]) == []
+    
+    try:
+        write_map(path, COLUMNS, [(12, "a", "", None, ""), (7, "b", "", None, "")])
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    # The failed write left the old map in place
+    assert EnrichmentMap(path).lookup([12])[0]["project_id"] == "PXD100"
+
+def test_enrichment_store_refresh():
+    print("=== Testing Enrichment Store Refresh ===")
+    
+    directory = tempfile.mkdtemp()
+    write_map(map_path(directory, "scop3p", "projects"), COLUMNS, project_rows(), release="r1")
+    releases = {"scop3p": "r1", "scop3ptm": "r1"}
+    built = []
+    
+    def builder(database, kind, directory, release):
+        built.append((database, kind, release))
+        write_map(map_path(directory, database, kind), COLUMNS, project_rows(25), release=release)
+    
+    checked = threading.Event()
+    
+    def release_version(database):
+        checked.wait(5)
+        return releases[database]
+    
+    store = EnrichmentStore(directory, check_seconds=3600, release_version=release_version, builder=builder)
+    # Until the release has been checked, e.g. right after a restart, the map isn't trusted
+    assert store.projects("scop3p", [7]) is None
+    checked.set()
+    store._checking.join()
+    assert built == []
+    assert len(store.projects("scop3p", [7])) == 3
+    # No map for the other database or kind: the caller queries Postgres
+    assert store.projects("scop3ptm", [7]) is None and store.mutations("scop3p", [7]) is None
+    
+    # A new release makes the map stale until it is rebuilt
+    releases["scop3p"] = "r2"
+    store.auto_rebuild = False
+    store.check_releases()
+    assert store.projects("scop3p", [7]) is None
+    
+    # Only one process rebuilds at a time, the others skip it
+    store.auto_rebuild = True
+    with open(os.path.join(directory, REBUILD_LOCK), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store.check_releases()
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    assert built == []
+    
+    store.check_releases()
+    print(f"Rebuilt: {built}")
+    assert built == [("scop3p", "projects", "r2")]
+    assert len(store.projects("scop3p", [7, 12])) == 20
+
+if __name__ == "__main__":
+    test_enrichment_map()
+    test_enrichment_store_refresh()
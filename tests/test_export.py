@@ -0,0 +1,75 @@
+import sys
+sys.path.append('.')
+
+import json
+import datetime
+from decimal import Decimal
+from fetch_sql import (validate_export_sql, build_export_query, csv_chunks, ndjson_chunks, parquet_kinds,
+                       parquet_value)
+
+def test_validate_export_sql():
+    print("=== Testing Export SQL Validation ===")
+    
+    assert validate_export_sql("SELECT * FROM peptide;") == "SELECT * FROM peptide"
+    assert validate_export_sql("with p as (select 1) select * from p") == "with p as (select 1) select * from p"
+    # Semicolons inside literals and comments are fine
+    assert validate_export_sql("SELECT ';' AS sep -- done; really") 
+    
+    for sql in ["", "DELETE FROM protein", "SELECT 1; DROP TABLE protein", "/* SELECT */ UPDATE protein SET id = 1"]:
+        try:
+            validate_export_sql(sql)
+            rejected = False
+        except ValueError as e:
+            print(f"Rejected {sql!r}: {e}")
+            rejected = True
+        assert rejected
+
+def test_build_export_query():
+    print("=== Testing Export Query Builder ===")
+    
+    query, params = build_export_query("scop3p", "modification", ["uniprot_position", "modified_residue"],
+                                       {"evidence": "experimental", "l_protein_id": [1, 2]}, "uniprot_position")
+    print(repr(query))
+    # Names are quoted identifiers and values are parameters, never spliced into the SQL
+    assert "Identifier('modification')" in repr(query) and "Identifier('evidence')" in repr(query)
+    assert "experimental" not in repr(query)
+    assert params == ["experimental", [1, 2]]
+    
+    bad = [("scop3p", "pg_authid", None, None), ("scop3p", "protein", ["accession; DROP TABLE protein"], None),
+           ("scop3p", "protein", None, {"pg_read_file('/etc/passwd')": 1}), ("scop3p", "protein", [], None),
+           ("scop3p", "protein", None, {"accession": {"op": "x"}}), ("scop3p", "protein_modification", None, None),
+           ("other", "protein", None, None)]
+    for database, table, columns, filters in bad:
+        try:
+            build_export_query(database, table, columns, filters)
+            rejected = False
+        except ValueError as e:
+            print(f"Rejected {table} {columns} {filters}: {e}")
+            rejected = True
+        assert rejected
+
+def test_chunk_writers():
+    print("=== Testing Export Writers ===")
+    
+    columns = ["accession", "position", "score", "updated"]
+    chunks = [[("P04637", 15, Decimal("0.95"), datetime.date(2024, 1, 2))], [("Q9Y6K9", None, None, None)]]
+    
+    text = "".join(csv_chunks(columns, iter(chunks)))
+    print(text)
+    assert text.splitlines() == ["accession,position,score,updated", "P04637,15,0.95,2024-01-02", "Q9Y6K9,,,"]
+    
+    lines = "".join(ndjson_chunks(columns, iter(chunks))).splitlines()
+    assert json.loads(lines[0]) == {"accession": "P04637", "position": 15, "score": "0.95", "updated": "2024-01-02"}
+    assert json.loads(lines[1])["position"] is None
+    
+    # The Parquet schema comes from the column types, even when a chunk is all NULL
+    kinds = parquet_kinds([25, 23, 1700, 1082], len(columns))
+    assert kinds == ["string", "int64", "float64", "date"]
+    assert parquet_kinds([], 2) == ["string", "string"]
+    assert parquet_value("float64", Decimal("0.95")) == 0.95 and parquet_value("float64", None) is None
+    assert parquet_value("string", ["S", "T"]) == '["S", "T"]' and parquet_value("string", 3) == "3"
+
+if __name__ == "__main__":
+    test_validate_export_sql()
+    test_build_export_query()
+    test_chunk_writers()
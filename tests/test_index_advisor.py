@@ -0,0 +1,96 @@
+import sys
+sys.path.append('.')
+
+import os
+import json
+import logging
+import tempfile
+from structured_logging import setup_logging, shutdown_logging, request_scope
+from index_advisor import parse_predicates, read_generated_sql, advise, migration_statements
+
+SQL = """SELECT m.uniprot_position, m.modified_residue, s.secondary_structure
+FROM modification m
+JOIN protein p ON m.l_protein_id = p.id
+JOIN structure s ON s.l_protein_id = p.id AND s.uniprot_position = m.uniprot_position
+WHERE p.protein_name ILIKE '%p53%' AND m.modification_name = 'phosphorylation'"""
+
+def test_parse_predicates():
+    print("=== Testing SQL Predicate Parsing ===")
+    
+    found = parse_predicates(SQL)
+    print(found)
+    assert found[("protein", "protein_name", "trgm")] == 1
+    assert found[("modification", "modification_name", "btree")] == 1
+    assert found[("modification", "l_protein_id", "btree")] == 1
+    assert found[("structure", "uniprot_position", "btree")] == 1
+    
+    # Unqualified columns of a single-table query
+    assert parse_predicates("SELECT * FROM protein WHERE accession = 'P04637'") == {("protein", "accession", "btree"): 1}
+
+def test_advise():
+    print("=== Testing Index Advisor ===")
+    
+    path = os.path.join(tempfile.mkdtemp(), "chatbot.log")
+    with open(path, "w") as f:
+        f.write(json.dumps({"message": f"Generated SCOP3P SQL: {SQL}"}) + "\n")
+        f.write(json.dumps({"message": "Using indexed SCOP3PTM SQL: SELECT * FROM protein p WHERE p.protein_name ILIKE '%CS%'"}) + "\n")
+        f.write("2025-01-01 10:00:00,000 - pipeline - INFO - Generated SCOP3P SQL: SELECT *\n")
+        f.write("FROM protein p WHERE p.protein_name ILIKE '%tp53%'\n")
+        f.write("2025-01-01 10:00:01,000 - pipeline - INFO - SCOP3P results: 3 rows\n")
+    
+    queries = read_generated_sql(path)
+    print(queries)
+    assert [db for db, _ in queries] == ["scop3p", "scop3ptm", "scop3p"]
+    assert queries[2][1].endswith("'%tp53%'")
+    
+    indexed = {"scop3p": {("modification", "l_protein_id", "btree")}}
+    sizes = {"scop3p": {"protein": 20000, "modification": 500000, "structure": 100000}}
+    proposals = advise(queries, indexed, sizes)
+    for p in proposals:
+        print(p)
+    
+    names = [(p["database"], p["table"], p["column"], p["kind"]) for p in proposals]
+    assert ("scop3p", "modification", "l_protein_id", "btree") not in names
+    assert ("scop3p", "protein", "id", "btree") not in names
+    top = proposals[0]
+    assert (top["table"], top["column"]) == ("modification", "modification_name")
+    trgm = next(p for p in proposals if p["database"] == "scop3p" and p["column"] == "protein_name")
+    assert trgm["occurrences"] == 2 and "gin_trgm_ops" in trgm["sql"]
+
+def test_logged_sql():
+    print("=== Testing Logged SQL ===")
+    
+    # Long SQL under a request id with a dash survives both log formats whole
+    long_sql = SQL + " AND p.accession IN (" + ", ".join(f"'P{i:05d}'" for i in range(200)) + ")"
+    logger = logging.getLogger("pipeline")
+    for log_format in ("text", "json"):
+        path = os.path.join(tempfile.mkdtemp(), "chatbot.log")
+        try:
+            setup_logging(path, console=False, log_format=log_format, force=True)
+            with request_scope("req-1"):
+                logger.info(f"Generated SCOP3P SQL: {SQL}", extra={"sql": SQL})
+            with request_scope("web-42"):
+                logger.info(f"Generated SCOP3PTM SQL: {long_sql}", extra={"sql": long_sql})
+                logger.info("SCOP3PTM results: 0 rows")
+        finally:
+            shutdown_logging()
+        queries = read_generated_sql(path)
+        assert queries == [("scop3p", SQL), ("scop3ptm", long_sql)], log_format
+    setup_logging(console=False, force=True)
+
+def test_migration_statements():
+    columns = {"protein": {"id", "protein_name"}, "modification": {"id", "l_protein_id", "modification_name"},
+               "peptide": {"id", "l_protein_id", "l_project_id"}}
+    statements = migration_statements("scop3p", columns)
+    print("\n".join(statements))
+    assert statements[0] == "CREATE EXTENSION IF NOT EXISTS pg_trgm"
+    assert any("idx_protein_protein_name_trgm" in s for s in statements)
+    assert any("idx_peptide_l_project_id ON peptide (l_project_id)" in s for s in statements)
+    # Columns that don't exist in this database are skipped
+    assert not any("disease" in s for s in statements)
+
+if __name__ == "__main__":
+    test_parse_predicates()
+    test_advise()
+    test_logged_sql()
+    test_migration_statements()
@@ -0,0 +1,31 @@
+import sys
+sys.path.append('.')
+
+from knowledge_store import get_knowledge_store
+from prompts import load_prompt
+
+def test_knowledge_retrieval():
+    print("=== Testing Knowledge Retrieval ===")
+    
+    store = get_knowledge_store()
+    print(f"Indexed {len(store.chunks)} chunks")
+    assert len(store.chunks) > 10
+    
+    section = store.knowledge_section("Explain CSS")
+    print(section)
+    assert "Complexation Significance Score" in section
+    assert "Humsavar" not in section
+    
+    chunks = store.retrieve("What is a USI and how does Scop3P use it?", top_k=3, token_budget=100)
+    assert any("USI" in chunk for chunk in chunks)
+    assert len(chunks) <= 3
+    
+    full = load_prompt("summarizer.txt")
+    reduced = f"{store.static_prefix}\n\n{section}"
+    print(f"Summarizer template: {len(full)} -> {len(reduced)} characters")
+    assert len(reduced) < len(full)
+    assert "RESPONSE GUIDELINES:" in store.static_prefix
+    assert "KEY KNOWLEDGE BASE" not in store.static_prefix
+
+if __name__ == "__main__":
+    test_knowledge_retrieval()
@@ -1,8 +1,10 @@
 import sys
 sys.path.append('.')
 
-from llm_client import query_llm
+from llm_client import query_llm, build_options
+from cassette import recorded
 
+@recorded("llm")
 def test_llm_connection():
     print("=== Testing LLM Connection ===")
     
@@ -19,5 +21,22 @@ def test_llm_connection():
     except Exception as e:
         print(f"LLM connection failed: {e}")
 
+def test_generation_profiles():
+    print("=== Testing Generation Profiles ===")
+    
+    options, output_format = build_options("sql")
+    print(f"sql: {options}")
+    assert options["stop"] == [";"]
+    assert output_format is None
+    
+    options, output_format = build_options("router")
+    print(f"router: {options}, format keys: {list(output_format['properties'])}")
+    assert output_format["properties"]["db"]["enum"] == ["scop3p", "scop3ptm", "both"]
+    
+    # Explicit arguments override the stage profile
+    options, _ = build_options("sql", num_predict=200)
+    assert options["num_predict"] == 200
+
 if __name__ == "__main__":
-    test_llm_connection()
\ No newline at end of file
+    test_llm_connection()
+    test_generation_profiles()
\ No newline at end of file
@@ -0,0 +1,149 @@
+import sys
+sys.path.append('.')
+
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from llm_backends import LLMBackend, BackendPool, NoBackendAvailable, set_pool
+from llm_client import query_llm
+from resilience import Deadline, RequestCancelled
+
+class FakeOllama(BaseHTTPRequestHandler):
+    """Minimal Ollama API that answers with the server's name"""
+    
+    def do_GET(self):
+        self.send_response(500 if self.server.failing else 200)
+        self.end_headers()
+        self.wfile.write(b'{"models": []}')
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests += 1
+        if self.server.failing:
+            self.send_response(500)
+            self.end_headers()
+            return
+        
+        self.send_response(200)
+        self.end_headers()
+        key = "message" if self.path == "/api/chat" else "response"
+        words = [self.server.name, " ok"] if not self.server.delay else [" ..."] * 50
+        try:
+            for word in words:
+                chunk = {"message": {"content": word}} if key == "message" else {"response": word}
+                self.wfile.write((json.dumps(chunk) + "\n").encode())
+                self.wfile.flush()
+                time.sleep(self.server.delay)
+            self.wfile.write(json.dumps({"done": True}).encode() + b"\n")
+        except OSError:
+            # Client hung up mid-generation
+            self.server.aborted += 1
+    
+    def log_message(self, *args):
+        pass
+
+def start_fake_server(name):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllama)
+    server.name = name
+    server.failing = False
+    server.requests = 0
+    server.delay = 0
+    server.aborted = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def backend_for(server, **kwargs):
+    return LLMBackend(f"http://127.0.0.1:{server.server_address[1]}", name=server.name, **kwargs)
+
+def test_backend_pool():
+    print("=== Testing LLM Backend Pool ===")
+    
+    a, b, sql = start_fake_server("a"), start_fake_server("b"), start_fake_server("sql")
+    pool = BackendPool([backend_for(a), backend_for(b), backend_for(sql, stages=["sql"])],
+                       max_failures=2, eject_seconds=0, health_interval=0.05)
+    set_pool(pool)
+    
+    try:
+        # Requests spread across the general backends, SQL goes to its pinned node
+        answers = [query_llm("hello") for _ in range(4)]
+        print(f"Answers: {answers}")
+        assert a.requests == 2 and b.requests == 2
+        assert query_llm("SELECT", stage="sql", system="schema") == "sql ok"
+        
+        # A failing backend is ejected and traffic moves to the healthy one
+        a.failing = True
+        for _ in range(4):
+            try:
+                query_llm("hello")
+            except Exception:
+                pass
+        print(f"Status after failures: {pool.status()}")
+        assert pool.backends[0].ejected
+        assert query_llm("hello") == "b ok"
+        
+        # Once healthy again the health checks re-admit it
+        a.failing = False
+        for _ in range(50):
+            if not pool.backends[0].ejected:
+                break
+            time.sleep(0.05)
+        assert not pool.backends[0].ejected
+        assert {query_llm("hello") for _ in range(4)} == {"a ok", "b ok"}
+        
+        # With every general backend down the pool fails fast
+        a.failing = b.failing = True
+        for _ in range(4):
+            try:
+                query_llm("hello")
+            except Exception:
+                pass
+        try:
+            query_llm("hello")
+            raised = False
+        except NoBackendAvailable:
+            raised = True
+        assert raised
+    finally:
+        set_pool(None)
+        for server in (a, b, sql):
+            server.shutdown()
+
+def test_cancel_generation():
+    print("=== Testing LLM Generation Cancellation ===")
+    
+    slow = start_fake_server("slow")
+    slow.delay = 0.1
+    pool = BackendPool([backend_for(slow)])
+    set_pool(pool)
+    
+    try:
+        deadline = Deadline(30)
+        threading.Timer(0.3, deadline.cancel, args=("client disconnected",)).start()
+        started = time.monotonic()
+        try:
+            query_llm("hello", deadline=deadline)
+            cancelled = False
+        except RequestCancelled:
+            cancelled = True
+        elapsed = time.monotonic() - started
+        print(f"Cancelled after {elapsed:.2f}s")
+        assert cancelled and elapsed < 2
+        
+        # Cancelling is not the backend's fault
+        assert pool.backends[0].consecutive_failures == 0
+        assert pool.backends[0].outstanding == 0
+        
+        # The server sees the stream closed and stops generating
+        for _ in range(40):
+            if slow.aborted:
+                break
+            time.sleep(0.05)
+        assert slow.aborted == 1
+    finally:
+        set_pool(None)
+        slow.shutdown()
+
+if __name__ == "__main__":
+    test_backend_pool()
+    test_cancel_generation()
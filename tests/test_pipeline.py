@@ -1,21 +1,16 @@
 import sys
-import logging
 
-logging.getLogger().setLevel(logging.CRITICAL)
-for handler in logging.root.handlers[:]:
-    logging.root.removeHandler(handler)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('chatbot.log', mode='a')
-    ]
-)
 sys.path.append('.')
 
+from structured_logging import setup_logging
+
+# Log to chatbot.log only, keeping the test output readable
+setup_logging(console=False, force=True)
+
 from pipeline import handle_query, reset_conversation
+from cassette import recorded
 
+@recorded("pipeline")
 def test_full_pipeline():
     print("=== Testing Full Pipeline ===")
 
@@ -0,0 +1,103 @@
+import sys
+sys.path.append('.')
+
+import os
+import json
+import time
+import tempfile
+import threading
+import contextvars
+from profiling import ProfileBudget, profile_request, parse_mode, span
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        json.dumps({"rows": list(range(50))})
+
+def fake_request():
+    with span("llm", "classification"):
+        time.sleep(0.05)
+    busy(0.05)
+    # A speculative call overlapping the next one is only counted once as waiting
+    context = contextvars.copy_context()
+    worker = threading.Thread(target=lambda: context.run(span_sleep, "sql", "scop3p", 0.06), name="speculative-sql")
+    worker.start()
+    with span("sql", "scop3ptm", sql="SELECT 1") as details:
+        time.sleep(0.05)
+        details["rows"] = 1
+    worker.join()
+
+def span_sleep(kind, label, seconds):
+    with span(kind, label):
+        time.sleep(seconds)
+
+def test_profile_request():
+    print("=== Testing Request Profiling ===")
+    
+    directory = tempfile.mkdtemp()
+    for mode in ("sampling", "cprofile"):
+        budget = ProfileBudget(seconds=30, window=3600)
+        with profile_request(mode, f"req-{mode}", budget=budget, directory=directory) as profile:
+            fake_request()
+        summary = profile.summary()
+        print(json.dumps(summary, indent=2))
+        
+        assert summary["mode"] == mode and summary["calls"] == 3
+        assert 0.04 < summary["llm_seconds"] < 0.2
+        assert 0.09 < summary["sql_seconds"] < 0.3
+        assert 0.03 < summary["other_seconds"] < summary["elapsed"] - 0.1
+        assert not budget.active and budget.spent() > 0
+        
+        with open(os.path.join(directory, f"req-{mode}.json")) as f:
+            saved = json.load(f)
+        assert [s["label"] for s in saved["timeline"]][0] == "classification"
+        assert {s["thread"] for s in saved["timeline"]} >= {"speculative-sql"}
+        assert saved["top_functions"]
+        assert os.path.exists(os.path.join(directory, f"req-{mode}." + ("folded" if mode == "sampling" else "prof")))
+    
+    # A request id that is a path never leaves the profile directory
+    parent = tempfile.mkdtemp()
+    directory = os.path.join(parent, "profiles")
+    with profile_request("sampling", "../escaped_profile", budget=ProfileBudget(seconds=30, window=3600),
+                         directory=directory) as profile:
+        busy(0.01)
+    print(f"Saved to {profile.path}")
+    assert os.path.dirname(profile.path) == directory and profile.request_id != "../escaped_profile"
+    assert not [name for name in os.listdir(parent) if name.startswith("escaped_profile")]
+    
+    # Outside a profiled request spans record nothing
+    with span("llm", "summary") as details:
+        details["x"] = 1
+
+def test_profile_budget():
+    print("=== Testing Profiling Budget ===")
+    
+    now = [0.0]
+    budget = ProfileBudget(seconds=2, window=60, clock=lambda: now[0])
+    assert budget.acquire() is None
+    assert budget.acquire() == "another request is being profiled"
+    budget.release(2.5)
+    assert "budget" in budget.acquire()
+    
+    # Refused requests still run, just unprofiled
+    with profile_request("sampling", "refused", budget=budget, directory=tempfile.mkdtemp()) as profile:
+        with span("llm", "summary"):
+            pass
+    assert profile.summary()["skipped"] and not profile.spans
+    
+    now[0] = 61.0
+    assert budget.acquire() is None
+    budget.release(0.1)
+    
+    assert parse_mode(None) is None and parse_mode("0") is None
+    assert parse_mode(True) == parse_mode("1") == "sampling"
+    assert parse_mode("deterministic") == "cprofile"
+    try:
+        parse_mode("perf")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+if __name__ == "__main__":
+    test_profile_request()
+    test_profile_budget()
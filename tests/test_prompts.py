@@ -1,7 +1,7 @@
 import sys
 sys.path.append('.')
 
-from prompts import load_prompt
+from prompts import load_prompt, format_prompt_parts, DYNAMIC_MARKER
 
 def test_prompt_loading():
     print("=== Testing Prompt Loading ===")
@@ -15,5 +15,31 @@ def test_prompt_loading():
         except Exception as e:
             print(f"{prompt_file}: Failed to load - {e}")
 
+def test_stable_prefixes():
+    print("=== Testing Stable Prompt Prefixes ===")
+    
+    cases = [
+        ("router.txt", {"user_query": "{q}"}),
+        ("sql_scop3p.txt", {"user_query": "{q}", "database": "scop3p"}),
+        ("sql_scop3ptm.txt", {"user_query": "{q}", "database": "scop3ptm"}),
+        ("intent_classifier.txt", {"context": "{q}", "current_context": "None", "user_query": "{q}"}),
+        ("expand_previous.txt", {"previous_response": "{q}"}),
+        ("direct_response.txt", {"knowledge_section": "{q}", "query": "{q}"}),
+        ("memory_summary.txt", {"summary": "None yet", "user_query": "{q}", "bot_response": "ok", "max_words": "120"}),
+        ("page_intro.txt", {"user_query": "{q}", "rows": "[]"}),
+        ("card_polish.txt", {"user_query": "{q}", "card": "**P04637**"})
+    ]
+    
+    for prompt_file, fields in cases:
+        first = format_prompt_parts(prompt_file, **{k: v.format(q="phospho sites in P04637") for k, v in fields.items()})
+        second = format_prompt_parts(prompt_file, **{k: v.format(q="Explain CSS") for k, v in fields.items()})
+        print(f"{prompt_file}: {len(first[0])} static / {len(first[1])} dynamic characters")
+        
+        # The system part must be byte-identical across calls, the query only in the user part
+        assert first[0] and first[0] == second[0]
+        assert "Explain CSS" in second[1]
+        assert DYNAMIC_MARKER not in load_prompt(prompt_file)
+
 if __name__ == "__main__":
-    test_prompt_loading()
\ No newline at end of file
+    test_prompt_loading()
+    test_stable_prefixes()
\ No newline at end of file
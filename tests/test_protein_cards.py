@@ -0,0 +1,127 @@
+import sys
+sys.path.append('.')
+
+import os
+import re
+import tempfile
+from protein_cards import (CARD_SQL, ProteinCards, build, parse_card_query, render_card, answer_from_card)
+
+SCOP3P_ROWS = {
+    "protein": [("P04637", "Cellular tumor antigen p53", "P53_HUMAN", None),
+                ("Q86US8", "Telomerase-binding protein EST1A", "EST1A_HUMAN", None)],
+    "sites": [("P04637", "Phosphorylation", "experimental", 3), ("P04637", "Phosphorylation", "predicted", 1),
+              ("Q86US8", "Phosphorylation", "experimental", 2)],
+    "site_list": [("P04637", "Phosphorylation", 15, "S"), ("P04637", "Phosphorylation", 18, "T"),
+                  ("P04637", "Phosphorylation", 20, "S"), ("P04637", "Phosphorylation", 33, "S"),
+                  ("Q86US8", "Phosphorylation", 7, "S"), ("Q86US8", "Phosphorylation", 9, "S")],
+    "structure": [("P04637", 4, 2)],
+    "projects": [("P04637", "PXD000001", "Cancer lines", 12), ("P04637", "PXD000002", "Liver", 3)],
+    "mutations": [("P04637", 5, 3)]
+}
+
+def fake_fetch(rows, calls):
+    def fetch(database, sql):
+        where = re.search(r"WHERE p\.id IN \([^)]*\)", sql)
+        calls.append(where.group(0) if where else "")
+        for name, template in CARD_SQL[database].items():
+            if template.format(where=calls[-1]) == sql:
+                return rows.get(name, [])
+        raise AssertionError(f"unexpected SQL: {sql}")
+    return fetch
+
+def test_build_and_lookup():
+    print("=== Testing Protein Card Build ===")
+
+    path = os.path.join(tempfile.mkdtemp(), "cards.db")
+    calls = []
+    result = build("scop3p", path, fetch=fake_fetch(SCOP3P_ROWS, calls),
+                   watermarks=lambda db: {"protein": 2, "modification": 6})
+    assert result == {"database": "scop3p", "mode": "full", "proteins": 2}
+    assert set(calls) == {""}
+
+    cards = ProteinCards(path)
+    card = cards.get("P04637")
+    section = card["databases"]["scop3p"]
+    assert section["sites"] == {"Phosphorylation": {"experimental": 3, "predicted": 1}}
+    assert section["structure"] == {"modified_positions": 4, "with_structure": 2}
+    assert section["projects"][0]["project_id"] == "PXD000001"
+    assert section["mutations"] == {"total": 5, "disease_associated": 3}
+
+    # Accession, entry-name gene and full-name lookups; unknown names don't match
+    assert cards.resolve("p04637") == "P04637"
+    assert cards.resolve("p53") == "P04637"
+    assert cards.resolve("EST1A") == "Q86US8"
+    assert cards.resolve("cellular tumor antigen p53") == "P04637"
+    assert cards.resolve("kinase") is None
+    cards.close()
+
+def test_incremental_build():
+    print("=== Testing Incremental Card Build ===")
+
+    path = os.path.join(tempfile.mkdtemp(), "cards.db")
+    build("scop3p", path, fetch=fake_fetch(SCOP3P_ROWS, []), watermarks=lambda db: {"protein": 2, "modification": 6})
+
+    # Same release: nothing is queried
+    calls = []
+    result = build("scop3p", path, fetch=fake_fetch(SCOP3P_ROWS, calls),
+                   watermarks=lambda db: {"protein": 2, "modification": 6})
+    assert result["mode"] == "current" and not calls
+
+    # A release adding sites to one protein recomputes only that protein
+    updated = dict(SCOP3P_ROWS, protein=[SCOP3P_ROWS["protein"][1]],
+                   sites=[("Q86US8", "Phosphorylation", "experimental", 3)],
+                   site_list=SCOP3P_ROWS["site_list"][4:] + [("Q86US8", "Phosphorylation", 11, "T")],
+                   structure=[], projects=[], mutations=[])
+    seen = []
+    result = build("scop3p", path, fetch=fake_fetch(updated, calls),
+                   watermarks=lambda db: {"protein": 2, "modification": 7},
+                   changed=lambda db, since: seen.append(since) or [2])
+    assert result == {"database": "scop3p", "mode": "incremental", "proteins": 1}
+    assert seen == [{"protein": 2, "modification": 6}]
+    assert set(calls) == {"WHERE p.id IN (2)"}
+
+    cards = ProteinCards(path)
+    assert cards.get("Q86US8")["databases"]["scop3p"]["site_total"] == 3
+    # Untouched cards are kept as they were
+    assert cards.get("P04637")["databases"]["scop3p"]["site_total"] == 4
+    cards.close()
+
+def test_answers():
+    print("=== Testing Card Answers ===")
+
+    assert parse_card_query("Tell me about P02545?") == ("p02545", None)
+    assert parse_card_query("show me p53 phosphorylation sites") == ("p53", "phospho")
+    assert parse_card_query("phospho sites in Q86US8") == ("q86us8", "phospho")
+    assert parse_card_query("show me the active sites") is None
+    assert parse_card_query("which proteins have acetylation in helices?") is None
+
+    path = os.path.join(tempfile.mkdtemp(), "cards.db")
+    build("scop3p", path, fetch=fake_fetch(SCOP3P_ROWS, []), watermarks=lambda db: {"protein": 2})
+    cards = ProteinCards(path)
+
+    answer, card = answer_from_card("Tell me about P04637", cards=cards)
+    print(answer)
+    assert "Cellular tumor antigen p53 (P04637)" in answer
+    assert "4 modified sites" in answer and "2 of 4 modified positions" in answer and "PXD000001" in answer
+
+    answer, _ = answer_from_card("show me p53 phosphorylation sites", cards=cards)
+    assert "S15, T18, S20, S33" in answer
+    assert "no methylation sites" in answer_from_card("methyl sites in P04637", cards=cards)[0]
+
+    # Sites cut off by the card limit go through SQL instead
+    card["databases"]["scop3p"]["site_list"]["Phosphorylation"] = [[15, "S"]]
+    assert render_card(card, "phospho") is None
+    assert answer_from_card("show me the sites of BRCA1", cards=cards) is None
+
+    # Specific questions that mention a protein go through SQL, not the overview card
+    for query in ["describe the interaction between P04637 and P38398", "what is known about site S15 of P04637",
+                  "summarize disease mutations in P04637", "tell me about phosphorylation of P04637 in helices"]:
+        assert answer_from_card(query, cards=cards) is None, query
+    assert cards.resolve("p04637 in helices") is None
+    cards.close()
+
+if __name__ == "__main__":
+    test_build_and_lookup()
+    test_incremental_build()
+    test_answers()
+    print("All protein card tests passed")
@@ -0,0 +1,36 @@
+import sys
+sys.path.append('.')
+
+import json
+from renderer import choose_response_mode, render_response
+
+def test_response_rendering():
+    print("=== Testing Deterministic Rendering ===")
+
+    results = {
+        "scop3p": [
+            {"uniprot_position": 15, "modified_residue": "S", "evidence": "Combined"},
+            {"uniprot_position": 37, "modified_residue": "T", "evidence": "PRIDE"}
+        ]
+    }
+
+    mode = choose_response_mode(results, {}, {})
+    print(f"Small result set -> {mode}")
+    assert mode == "table"
+
+    many = {"scop3p": [{"uniprot_position": i} for i in range(50)]}
+    assert choose_response_mode(many, {}, {}) == "prose"
+    assert choose_response_mode({"scop3p": []}, {}, {}) == "prose"
+    assert choose_response_mode(many, {}, {}, requested="json") == "json"
+
+    table = render_response("table", "phospho sites in P04637", results)
+    print(table)
+    assert "| uniprot_position | modified_residue | evidence |" in table
+    assert "2 rows in Scop3P" in table
+
+    data = json.loads(render_response("json", "phospho sites in P04637", results))
+    assert data["counts"]["results"]["scop3p"] == 2
+    assert data["results"]["scop3p"][0]["evidence"] == "Combined"
+
+if __name__ == "__main__":
+    test_response_rendering()
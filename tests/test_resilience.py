@@ -0,0 +1,83 @@
+import sys
+sys.path.append('.')
+
+import time
+from resilience import Deadline, CircuitBreaker, CircuitOpen, DeadlineExceeded, RequestCancelled
+
+def test_deadline():
+    print("=== Testing Deadlines ===")
+    
+    deadline = Deadline(0.2)
+    assert deadline.budget("routing") <= 0.2
+    assert deadline.allows("routing", minimum=0.1)
+    time.sleep(0.25)
+    assert deadline.expired and not deadline.allows("summary")
+    try:
+        deadline.check("summary")
+        raised = False
+    except DeadlineExceeded:
+        raised = True
+    assert raised
+    
+    # Without a limit each stage still gets its own budget
+    assert Deadline().budget("routing") < float("inf")
+
+def test_cancellation():
+    print("=== Testing Cancellation ===")
+    
+    deadline = Deadline(30)
+    aborted = []
+    deadline.on_cancel(lambda: aborted.append("llm"))
+    unregister = deadline.on_cancel(lambda: aborted.append("finished"))
+    unregister()
+    
+    deadline.cancel("client disconnected")
+    deadline.cancel("again")
+    assert aborted == ["llm"]
+    assert deadline.cancelled and deadline.cancel_reason == "client disconnected"
+    
+    # Calls started after cancelling are aborted right away
+    deadline.on_cancel(lambda: aborted.append("sql"))
+    assert aborted == ["llm", "sql"]
+    
+    try:
+        deadline.check("summary")
+        raised = False
+    except RequestCancelled:
+        raised = True
+    assert raised
+
+def test_circuit_breaker():
+    print("=== Testing Circuit Breaker ===")
+    
+    breaker = CircuitBreaker("db:test", failure_threshold=2, reset_seconds=0.1)
+    breaker.before_call()
+    breaker.record_failure()
+    breaker.record_failure()
+    print(f"State after failures: {breaker.state}")
+    assert breaker.state == CircuitBreaker.OPEN
+    
+    try:
+        breaker.before_call()
+        rejected = False
+    except CircuitOpen:
+        rejected = True
+    assert rejected
+    
+    # After the reset period one trial call is let through
+    time.sleep(0.15)
+    breaker.before_call()
+    try:
+        breaker.before_call()
+        second_trial = True
+    except CircuitOpen:
+        second_trial = False
+    assert not second_trial
+    
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+if __name__ == "__main__":
+    test_deadline()
+    test_cancellation()
+    test_circuit_breaker()
@@ -0,0 +1,70 @@
+import sys
+sys.path.append('.')
+
+import json
+from result_merge import merge_results, should_merge, site_key, rows_shown
+
+def test_merge_results():
+    print("=== Testing Result Merge ===")
+    
+    results = {
+        "scop3p": [
+            {"id": 7, "accession": "P04637", "uniprot_position": 15, "modified_residue": "S", "evidence": "PRIDE"},
+            {"id": 7, "accession": "P04637", "uniprot_position": 20, "modified_residue": "S", "evidence": "UP"}
+        ],
+        "scop3ptm": [
+            {"id": 91, "accession": "p04637", "uniprot_position": "15", "modified_residue": "s",
+             "evidence": "Combined", "unimod_modification_name": "Phospho"},
+            {"id": 92, "accession": "P04637", "uniprot_position": 37, "modified_residue": "S", "evidence": "PRIDE"}
+        ]
+    }
+    assert should_merge(results) and not should_merge({"scop3p": results["scop3p"], "scop3ptm": []})
+    assert site_key(results["scop3ptm"][0]) == ("P04637", 15, "S")
+    
+    merged = merge_results(results)
+    print(json.dumps(merged, indent=2))
+    assert merged["counts"] == {"scop3p": 2, "scop3ptm": 2, "shared": 1, "merged": 3}
+    assert merged["columns"][:4] == ["accession", "position", "residue", "source"]
+    assert "id" not in merged["columns"]
+    
+    rows = [dict(zip(merged["columns"], row)) for row in merged["rows"]]
+    assert rows[0]["source"] == "scop3p+scop3ptm"
+    assert rows[0]["evidence"] == {"scop3p": "PRIDE", "scop3ptm": "Combined"}
+    assert rows[0]["unimod_modification_name"] == "Phospho"
+    assert [r["source"] for r in rows[1:]] == ["scop3p", "scop3ptm"]
+    
+    # Paging goes on after the database rows behind the merged rows shown
+    assert merged["origins"] == [{"scop3p": 0, "scop3ptm": 0}, {"scop3p": 1}, {"scop3ptm": 1}]
+    assert rows_shown(merged, 1) == {"scop3p": 1, "scop3ptm": 1}
+    assert rows_shown(merged, 2) == {"scop3p": 2, "scop3ptm": 1}
+    assert rows_shown(merged, 0) == {"scop3p": 0, "scop3ptm": 0}
+    
+    # Smaller than sending both result lists
+    assert len(json.dumps(merged)) < len(json.dumps(results))
+    
+    # Without an accession the protein is unknown, so same-position rows stay apart
+    no_accession = {
+        "scop3p": [{"uniprot_position": 15, "modified_residue": "S", "evidence": "PRIDE"}],
+        "scop3ptm": [{"uniprot_position": 15, "modified_residue": "S", "evidence": "Combined"}]
+    }
+    assert site_key(no_accession["scop3p"][0]) is None
+    merged = merge_results(no_accession)
+    assert merged["counts"]["shared"] == 0 and merged["counts"]["merged"] == 2
+    
+    # Different modifications of the same residue are not merged, the same one is
+    modifications = {
+        "scop3p": [{"accession": "P04637", "uniprot_position": 15, "modified_residue": "S",
+                    "modification_name": "Phosphorylation"}],
+        "scop3ptm": [{"accession": "P04637", "uniprot_position": 15, "modified_residue": "S",
+                      "unimod_modification_name": "HexNAc"},
+                     {"accession": "P04637", "uniprot_position": 15, "modified_residue": "S",
+                      "unimod_modification_name": "Phospho"}]
+    }
+    merged = merge_results(modifications)
+    rows = [dict(zip(merged["columns"], row)) for row in merged["rows"]]
+    assert merged["counts"]["shared"] == 1 and merged["counts"]["merged"] == 2
+    assert [(r["source"], r["unimod_modification_name"]) for r in rows] == [("scop3p+scop3ptm", "Phospho"),
+                                                                         ("scop3ptm", "HexNAc")]
+
+if __name__ == "__main__":
+    test_merge_results()
@@ -0,0 +1,91 @@
+import sys
+sys.path.append('.')
+
+import conversation_manager
+from conversation_manager import ConversationManager
+from result_pages import ResultPages, paged_sql
+from result_set import ResultSet
+
+def make_rows(n, start=0):
+    return ResultSet(["accession", "position"], [("P04637", i) for i in range(start, start + n)])
+
+def test_paging():
+    print("=== Testing Result Paging ===")
+
+    pages = ResultPages("sites of TP53", {"scop3p": make_rows(45), "scop3ptm": make_rows(5)},
+                        {"scop3p": "SELECT 1"}, {"scop3p": 10, "scop3ptm": 5})
+    assert pages.remaining() == 35
+    answer = pages.offer("Ten sites.")
+    assert "35 more rows" in answer
+
+    page = pages.next_page(lambda db, sql: ResultSet(), page_size=20)
+    assert list(page) == ["scop3p"]
+    assert (page["scop3p"]["first"], page["scop3p"]["last"], page["scop3p"]["total"]) == (11, 30, 45)
+    assert [row["position"] for row in page["scop3p"]["rows"]][:2] == [10, 11]
+    assert pages.remaining() == 15
+
+def test_fetch_past_kept_rows():
+    print("=== Testing Paging Past Kept Rows ===")
+
+    fetched = []
+    def fetch(db, sql):
+        fetched.append(sql)
+        return make_rows(5, start=8)
+
+    pages = ResultPages("q", {"scop3p": make_rows(13)}, {"scop3p": "SELECT * FROM site;"}, {"scop3p": 8},
+                        max_rows=6)
+    page = pages.next_page(fetch, page_size=10)
+    assert fetched == [paged_sql("SELECT * FROM site", 5, 8)]
+    assert page["scop3p"]["last"] == 13 and pages.remaining() == 0
+
+    # A failed fetch stops offering the rows
+    pages = ResultPages("q", {"scop3p": make_rows(13)}, {"scop3p": "SELECT 1"}, {"scop3p": 8}, max_rows=6)
+    assert pages.next_page(lambda db, sql: ResultSet()) == {}
+    assert pages.remaining() == 0
+
+def test_follow_up_detection():
+    print("=== Testing Show More Detection ===")
+
+    pages = ResultPages("q", {"scop3p": make_rows(30)}, {}, {"scop3p": 10})
+    # Nothing was offered yet
+    assert not pages.wants_more("show more")
+
+    pages.record_response(pages.offer("Answer"))
+    for follow_up in ["show more", "Tell me more!", "yes please", "show me the rest", "next page", "more results"]:
+        assert pages.wants_more(follow_up), follow_up
+    for follow_up in ["tell me more about BRCA1", "what is CSS?", "show sites of P53"]:
+        assert not pages.wants_more(follow_up), follow_up
+
+    # An answer in between without the offer makes "yes" mean something else
+    pages.record_response("CSS is a score.")
+    assert not pages.wants_more("yes")
+
+def test_manager_pages_without_llm():
+    print("=== Testing Show More In The Conversation ===")
+
+    def no_llm(*args, **kwargs):
+        raise AssertionError("show more should not call the LLM")
+
+    query_llm = conversation_manager.query_llm
+    conversation_manager.query_llm = no_llm
+    try:
+        manager = ConversationManager(max_history=4, memory="window")
+        pages = ResultPages("sites of TP53", {"scop3p": make_rows(30)}, {}, {"scop3p": 10})
+        manager.state.pages = pages
+        manager.record_interaction("sites of TP53", pages.offer("Ten sites."))
+
+        result = manager.process_query("show more")
+        assert result["action"] == "SHOW_MORE" and result["skip_pipeline"]
+        assert "rows 11-30 of 30" in result["response"]
+        assert "not shown" not in result["response"]
+        manager.record_interaction("show more", result["response"])
+        assert not pages.pending
+    finally:
+        conversation_manager.query_llm = query_llm
+
+if __name__ == "__main__":
+    test_paging()
+    test_fetch_past_kept_rows()
+    test_follow_up_detection()
+    test_manager_pages_without_llm()
+    print("All result paging tests passed")
@@ -0,0 +1,62 @@
+import sys
+sys.path.append('.')
+
+import json
+import datetime
+from decimal import Decimal
+from result_set import ResultSet, json_default, dumps_limited
+from result_merge import merge_results
+
+def sample(rows=3):
+    return ResultSet(["id", "accession", "uniprot_position", "functional_score", "updated"],
+                     [(7, "P04637", 15 + i, Decimal("0.25") * i, datetime.date(2024, 1, 1)) for i in range(rows)])
+
+def test_result_set():
+    print("=== Testing ResultSet ===")
+    
+    rs = sample()
+    row = rs[1]
+    print(rs, row)
+    assert row["uniprot_position"] == 16 and row.get("missing") is None
+    assert "accession" in row and "protein_name" not in row
+    assert list(row.keys()) == list(rs.columns) and len(row) == 5
+    assert dict(rs[0]) == rs.to_dicts()[0]
+    
+    # Slices share the row tuples
+    head = rs[:2]
+    assert isinstance(head, ResultSet) and len(head) == 2 and head.rows[0] is rs.rows[0]
+    assert not ResultSet() and ResultSet() == []
+    assert rs.column("uniprot_position") == [15, 16, 17]
+    assert ResultSet.from_dicts(rs.to_dicts()) == rs
+    
+    mixed = ResultSet(["id", "l_protein_id"], [(1, 7), (2, 7), (None, 9)])
+    assert mixed.ids() == [1, 2, 7, 9]
+    
+    # Existing consumers of row dicts work on Rows
+    merged = merge_results({"scop3p": rs, "scop3ptm": sample(1)})
+    assert merged["counts"]["shared"] == 1
+
+def test_serialization():
+    print("=== Testing ResultSet Serialization ===")
+    
+    rs = sample(200)
+    payload = json.loads(json.dumps({"results": rs}, default=json_default))
+    assert payload["results"][2]["functional_score"] == 0.5
+    assert payload["results"][0]["functional_score"] == 0
+    assert payload["results"][0]["updated"] == "2024-01-01"
+    
+    text = dumps_limited({"scop3p": rs, "scop3ptm": []}, 2000)
+    print(text[:200])
+    assert len(text) <= 2000
+    limited = json.loads(text)
+    assert limited["scop3p"]["columns"][0] == "id"
+    shown = len(limited["scop3p"]["rows"])
+    assert 0 < shown < 200 and limited["scop3p"]["omitted_rows"] == 200 - shown
+    assert limited["scop3ptm"] == {"columns": [], "rows": []}
+    
+    full = json.loads(dumps_limited({"scop3p": sample(2)}, 2000))
+    assert "omitted_rows" not in full["scop3p"]
+
+if __name__ == "__main__":
+    test_result_set()
+    test_serialization()
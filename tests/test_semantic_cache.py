@@ -0,0 +1,84 @@
+import sys
+sys.path.append('.')
+
+import semantic_cache
+from semantic_cache import SemanticCache, parse_results_file, is_informational
+from conversation_manager import ConversationManager
+
+def test_semantic_cache():
+    print("=== Testing Semantic Cache ===")
+    
+    cache = SemanticCache(threshold=0.85, ttl=3600, max_entries=2)
+    cache.add("What is CSS?", "CSS is the Complexation Significance Score.")
+    
+    for query in ["Explain CSS", "what is css"]:
+        hit = cache.lookup(query)
+        print(f"'{query}' -> {hit}")
+        assert hit and hit[0].startswith("CSS is")
+    
+    assert cache.lookup("Show me p53 phosphorylation sites") is None
+    
+    # Oldest entries are evicted beyond max_entries
+    cache.add("What is a USI?", "A Universal Spectrum Identifier.")
+    cache.add("What is the ProteomeXchange ID?", "A PXD accession.")
+    assert len(cache) == 2
+    assert cache.lookup("Explain CSS") is None
+    
+    # Expired entries are never served
+    cache.add("What is DSSP?", "Secondary structure assignment.", ttl=-3600 * 2)
+    assert cache.lookup("Explain DSSP") is None
+
+def test_seed_file():
+    pairs = parse_results_file("chatbot_results.txt")
+    print(f"Parsed {len(pairs)} seed answers")
+    assert pairs and pairs[0][0] == "What is the ProteomeXchange ID?"
+    # A response running into the separator doesn't swallow the next test
+    assert all("Test " not in answer for _, answer in pairs)
+    
+    # Only explanations are seeded, not data requests or refusals
+    seeded = [q for q, a in pairs if is_informational(q, a)]
+    assert "Explain CSS" in seeded
+    assert "I am looking for a list of proteins with variants related to breast cancer." not in seeded
+    assert "What is the time?" not in seeded and "How is the weather?" not in seeded
+    
+    cache = SemanticCache()
+    cache.seed_from_results("chatbot_results.txt")
+    assert cache.lookup("what does the CSS score mean")
+    assert cache.lookup("list of proteins with variants related to breast cancer") is None
+    assert cache.lookup("What time is it?") is None
+
+class ClassifiedManager(ConversationManager):
+    """Conversation with a fixed intent instead of the LLM classifier"""
+    
+    def __init__(self, intent_data):
+        super().__init__(max_history=4)
+        self.intent_data = intent_data
+    
+    def classify_intent_with_llm(self, query, deadline=None):
+        return dict(self.intent_data)
+
+def test_cache_after_classification():
+    print("=== Testing Semantic Cache After Classification ===")
+    
+    cache = SemanticCache()
+    cache.add("What is CSS?", "CSS is the Complexation Significance Score.")
+    cache.add("proteins with variants related to breast cancer", "A stale answer.")
+    original = semantic_cache._cache
+    semantic_cache._cache = cache
+    try:
+        informational = ClassifiedManager({"intent": "INFORMATIONAL", "action": "DIRECT_RESPONSE", "confidence": 0.9})
+        result = informational.process_query("Explain CSS")
+        assert result["response"].startswith("CSS is")
+        
+        # Database questions are never answered from the cache
+        search = ClassifiedManager({"intent": "RESEARCH", "action": "DATABASE_SEARCH", "confidence": 0.9})
+        result = search.process_query("proteins with variants related to breast cancer")
+        print(f"Action: {result['action']}")
+        assert result["action"] == "DATABASE_SEARCH" and "response" not in result
+    finally:
+        semantic_cache._cache = original
+
+if __name__ == "__main__":
+    test_semantic_cache()
+    test_seed_file()
+    test_cache_after_classification()
@@ -0,0 +1,135 @@
+import sys
+sys.path.append('.')
+
+import os
+import time
+import tempfile
+from conversation_manager import ConversationManager
+from conversation_memory import ConversationMemory
+from session_store import SessionStore, SQLiteSessionStore, MemorySessionStore, SessionManager
+
+def window_manager():
+    return ConversationManager(max_history=4, memory="window")
+
+def test_sqlite_store():
+    print("=== Testing SQLite Session Store ===")
+
+    # A store has to implement every method
+    try:
+        SessionStore()
+        assert False, "SessionStore is abstract"
+    except TypeError:
+        pass
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = SQLiteSessionStore(os.path.join(directory, "sessions.db"))
+        assert store.load("a") is None and store.version("a") is None
+
+        assert store.save_many({"a": {"last_query": "q1"}, "b": {"last_query": "q2"}}) == {"a": 1, "b": 1}
+        assert store.save_many({"a": {"last_query": "q3"}}) == {"a": 2}
+        record = store.load("a")
+        assert record["version"] == 2 and record["state"] == {"last_query": "q3"}
+
+        # Compaction drops sessions idle since the cutoff
+        assert store.compact(time.time() - 3600) == 0
+        assert store.compact(time.time() + 1) == 2
+        assert store.load("b") is None
+
+def test_write_behind_and_lazy_load():
+    print("=== Testing Write-Behind Sessions Across Workers ===")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sessions.db")
+        worker_a = SessionManager(SQLiteSessionStore(path), flush_seconds=60, factory=window_manager)
+        worker_b = SessionManager(SQLiteSessionStore(path), flush_seconds=60, factory=window_manager)
+        try:
+            manager = worker_a.get("s1")
+            manager.record_interaction("sites of P04637", "Serine 15 is phosphorylated.")
+            worker_a.save("s1", manager)
+            # Nothing is written on the request path
+            assert worker_a.store.version("s1") is None
+            assert worker_a.flush() == 1
+
+            # Another worker loads the session on first use
+            other = worker_b.get("s1")
+            assert other.state.last_query == "sites of P04637"
+            assert "Serine 15" in other.get_conversation_context()
+            other.record_interaction("what about mutations?", "Two mutations.")
+            worker_b.save("s1", other)
+            worker_b.flush()
+
+            # ...and the first worker picks up the newer version
+            manager = worker_a.get("s1")
+            assert manager.state.last_query == "what about mutations?"
+            assert len(manager.state.conversation_history) == 2
+        finally:
+            worker_a.close()
+            worker_b.close()
+
+def test_background_writer():
+    print("=== Testing Background Session Writer ===")
+
+    store = MemorySessionStore()
+    sessions = SessionManager(store, flush_seconds=0.05, factory=window_manager)
+    try:
+        for i in range(3):
+            manager = sessions.get(f"s{i}")
+            manager.record_interaction("hi", "hello")
+            sessions.save(f"s{i}", manager)
+        for _ in range(100):
+            if all(store.version(f"s{i}") for i in range(3)):
+                break
+            time.sleep(0.02)
+        assert all(store.version(f"s{i}") == 1 for i in range(3))
+    finally:
+        sessions.close()
+
+    # Closing writes what is still queued
+    sessions = SessionManager(store, flush_seconds=60, factory=window_manager)
+    manager = sessions.get("late")
+    manager.record_interaction("bye", "goodbye")
+    sessions.save("late", manager)
+    sessions.close()
+    assert store.load("late")["state"]["last_query"] == "bye"
+
+def test_bounded_history_and_eviction():
+    print("=== Testing Bounded History ===")
+
+    manager = window_manager()
+    for i in range(10):
+        manager.record_interaction(f"q{i}", f"a{i}")
+    assert [e["user_query"] for e in manager.state.conversation_history] == ["q6", "q7", "q8", "q9"]
+
+    store = MemorySessionStore()
+    sessions = SessionManager(store, cache_size=2, flush_seconds=60, factory=window_manager)
+    try:
+        for i in range(4):
+            manager = sessions.get(f"s{i}")
+            manager.record_interaction(f"q{i}", "a")
+            sessions.save(f"s{i}", manager)
+        # Unwritten sessions are never evicted
+        assert len(sessions._sessions) == 4
+        sessions.flush()
+        assert len(sessions._sessions) == 2
+        assert sessions.get("s0").state.last_query == "q0"
+    finally:
+        sessions.close()
+
+def test_memory_snapshot():
+    print("=== Testing Summary Memory Snapshot ===")
+
+    memory = ConversationMemory(summarize=lambda summary, q, a: f"{summary} {q}".strip())
+    memory.record("sites of P04637", "Serine 15.")
+    memory.wait(5)
+    restored = ConversationMemory(summarize=lambda summary, q, a: f"{summary} {q}".strip())
+    restored.restore(memory.snapshot())
+    assert restored.render() == memory.render()
+    assert "P04637" in restored.render()
+
+if __name__ == "__main__":
+    test_sqlite_store()
+    test_write_behind_and_lazy_load()
+    test_background_writer()
+    test_bounded_history_and_eviction()
+    test_memory_snapshot()
+    print("All session store tests passed")
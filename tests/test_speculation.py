@@ -0,0 +1,123 @@
+import sys
+sys.path.append('.')
+
+import threading
+from concurrent.futures import wait
+from structured_logging import setup_logging
+
+# Log to chatbot.log only, keeping the test output readable
+setup_logging(console=False, force=True)
+
+import pipeline
+from conversation_manager import ConversationManager
+from result_set import ResultSet
+
+QUERY = "show phosphorylation sites of P04637"
+
+class FixedIntentManager(ConversationManager):
+    """Conversation whose intent classification returns a fixed plan"""
+
+    def __init__(self, plan):
+        super().__init__(max_history=4)
+        self.plan = plan
+
+    def process_query(self, user_query, deadline=None):
+        return dict(self.plan)
+
+def with_fake_sql(run, empty_speculation=False):
+    """Run with SQL generation and execution faked; returns (result, generated, executed, speculations)"""
+    generated, executed, speculations, futures = [], [], [], []
+    lock = threading.Lock()
+    saved = {name: getattr(pipeline, name) for name in
+             ("generate_sql", "run_sql", "answer_from_card", "get_sql_index", "start_speculation", "SPECULATIVE_SQL")}
+
+    def fake_generate_sql(database, user_query, timeout=None, deadline=None, stats=None):
+        speculative = threading.current_thread().name.startswith("speculative-sql")
+        with lock:
+            generated.append((database, user_query, speculative))
+        if speculative and empty_speculation:
+            return ""
+        return f"SELECT '{database}: {user_query}'"
+
+    def fake_run_sql(database, sql, timeout=None, deadline=None):
+        with lock:
+            executed.append(sql)
+        return ResultSet(["site"], [(15,)])
+
+    def recording_start_speculation(user_query, deadline=None):
+        speculation = saved["start_speculation"](user_query, deadline)
+        speculations.append(speculation)
+        futures.extend(speculation.futures.values() if speculation else [])
+        return speculation
+
+    pipeline.generate_sql = fake_generate_sql
+    pipeline.run_sql = fake_run_sql
+    pipeline.answer_from_card = lambda user_query, response_mode, deadline: None
+    pipeline.get_sql_index = lambda: None
+    pipeline.start_speculation = recording_start_speculation
+    pipeline.SPECULATIVE_SQL = True
+    try:
+        return run(), generated, executed, speculations
+    finally:
+        # Discarded generations may still be running, let them finish on the fakes
+        wait(futures)
+        for name, value in saved.items():
+            setattr(pipeline, name, value)
+
+def database_search(query=QUERY):
+    return {"action": "DATABASE_SEARCH", "query": query, "skip_pipeline": False}
+
+def test_speculation_started():
+    print("=== Testing Speculation Start ===")
+
+    # The lexicon is sure this goes to SQL, for an unclear question it waits for classification
+    _, _, _, speculations = with_fake_sql(lambda: [pipeline.start_speculation(QUERY),
+                                                   pipeline.start_speculation("list scop3p sites for TP53")])
+    assert set(speculations[0].futures) == {"scop3p", "scop3ptm"}
+    assert speculations[0].take("scop3p") == (f"SELECT 'scop3p: {QUERY}'", None)
+    assert speculations[1] is None
+
+def test_speculation_reused():
+    print("=== Testing Speculation Reuse ===")
+
+    manager = FixedIntentManager(database_search())
+    _, generated, executed, speculations = with_fake_sql(
+        lambda: pipeline.handle_query(QUERY, "table", manager=manager))
+    print(f"Generated: {generated}")
+    assert len(speculations) == 1 and speculations[0] is not None
+    # Each database's SQL was generated once, by the speculation, and then executed
+    assert sorted(generated) == [("scop3p", QUERY, True), ("scop3ptm", QUERY, True)]
+    assert sorted(executed) == [f"SELECT 'scop3p: {QUERY}'", f"SELECT 'scop3ptm: {QUERY}'"]
+
+def test_empty_speculation_regenerated():
+    print("=== Testing Empty Speculation ===")
+
+    manager = FixedIntentManager(database_search())
+    _, generated, executed, _ = with_fake_sql(
+        lambda: pipeline.handle_query(QUERY, "table", manager=manager), empty_speculation=True)
+    assert sorted(g for g in generated if not g[2]) == [("scop3p", QUERY, False), ("scop3ptm", QUERY, False)]
+    assert sorted(executed) == [f"SELECT 'scop3p: {QUERY}'", f"SELECT 'scop3ptm: {QUERY}'"]
+
+def test_speculation_discarded():
+    print("=== Testing Speculation Discarded ===")
+
+    # A direct response runs no SQL at all
+    manager = FixedIntentManager({"action": "DIRECT_RESPONSE", "response": "Hello!", "skip_pipeline": True})
+    response, _, executed, speculations = with_fake_sql(lambda: pipeline.handle_query(QUERY, "table", manager=manager))
+    assert response == "Hello!" and executed == []
+    assert speculations[0] is not None and speculations[0].futures == {}
+
+    # A rewritten query gets SQL generated for the rewrite, not the original
+    rewritten = "show phosphorylation sites of P38398"
+    manager = FixedIntentManager(database_search(rewritten))
+    _, generated, executed, speculations = with_fake_sql(
+        lambda: pipeline.handle_query(QUERY, "table", manager=manager))
+    assert speculations[0].futures == {}
+    assert sorted(g for g in generated if not g[2]) == [("scop3p", rewritten, False), ("scop3ptm", rewritten, False)]
+    assert sorted(executed) == [f"SELECT 'scop3p: {rewritten}'", f"SELECT 'scop3ptm: {rewritten}'"]
+
+if __name__ == "__main__":
+    test_speculation_started()
+    test_speculation_reused()
+    test_empty_speculation_regenerated()
+    test_speculation_discarded()
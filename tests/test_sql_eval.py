@@ -0,0 +1,106 @@
+import sys
+sys.path.append('.')
+
+import json
+import tempfile
+from llm_backends import set_pool
+from sql_eval import (load_cases, build_fixture, FixtureExecutor, start_fake_llm, fake_llm_pool, run_eval,
+                      compare_reports, results_match, has_top_level_order, sqlite_dialect, percentile)
+
+SCOP3P_SCHEMA = ('Question: x Schema: "protein" "id" int, "accession" text, "protein_name" text, primary key: "id" '
+                 '[SEP] "modification" "id" int, "uniprot_position" int, "modification_name" text, '
+                 '"l_protein_id" int, foreign_key: "l_protein_id" int from "protein" "id", primary key: "id"')
+SCOP3PTM_SCHEMA = ('Question: x Schema: "protein" "id" int, "accession" text, primary key: "id" [SEP] '
+                   '"protein_modification" "id" int, "uniprot_position" int, "l_protein_id" int, '
+                   '"l_modification_id" int, primary key: "id" [SEP] "modification" "id" int, '
+                   '"unimod_modification_name" text, primary key: "id"')
+
+TRAINING = [
+    {"question": "phospho sites in P02545", "db_id": "scop3p", "input": SCOP3P_SCHEMA,
+     "target": "SELECT m.uniprot_position FROM modification m JOIN protein p ON m.l_protein_id = p.id "
+               "WHERE p.accession = 'P02545' AND m.modification_name = 'phosphorylation'"},
+    {"question": "oxidation sites in P50440", "db_id": "scop3ptm", "input": SCOP3PTM_SCHEMA,
+     "target": "SELECT pm.uniprot_position FROM protein_modification pm JOIN protein p ON pm.l_protein_id = p.id "
+               "JOIN modification m ON pm.l_modification_id = m.id "
+               "WHERE p.accession = 'P50440' AND m.unimod_modification_name = 'Oxidation'"},
+    {"question": "how many proteins are there", "db_id": "protein_databases_combined", "input": SCOP3P_SCHEMA,
+     "target": "SELECT COUNT(*) FROM protein"},
+    {"question": "name of P02545", "db_id": "scop3p", "input": SCOP3P_SCHEMA,
+     "target": "SELECT p.protein_name FROM protein p WHERE p.accession = 'P02545'"}
+]
+
+def test_sql_eval():
+    print("=== Testing SQL Evaluation ===")
+
+    # Combined pairs become a case per database
+    cases = load_cases(TRAINING)
+    print(f"Cases: {[case['id'] for case in cases]}")
+    assert [case["id"] for case in cases] == ["0:scop3p", "1:scop3ptm", "2:scop3p", "2:scop3ptm", "3:scop3p"]
+    assert len(load_cases(TRAINING, db_ids=["scop3ptm"])) == 1
+
+    # The fixture has the rows the targets look for
+    execute = FixtureExecutor(build_fixture(TRAINING, tempfile.mkdtemp()))
+    assert execute("scop3p", TRAINING[0]["target"])
+    assert execute("scop3ptm", TRAINING[1]["target"])
+    assert execute("scop3p", "SELECT accession FROM protein WHERE accession ILIKE '%p025%'") == [("P02545",)]
+
+    # One right, one with other rows, one that doesn't run, one right with extra whitespace
+    answers = {
+        "phospho sites in P02545": TRAINING[0]["target"],
+        "oxidation sites in P50440": "SELECT pm.uniprot_position FROM protein_modification pm",
+        "how many proteins are there": "SELECT COUNT(*) FROM proteins",
+        "name of P02545": "SELECT p.protein_name\n  FROM protein p WHERE p.accession = 'P02545'"
+    }
+    server = start_fake_llm(answers)
+    set_pool(fake_llm_pool(server))
+    try:
+        report = run_eval(cases, execute, workers=3)
+    finally:
+        set_pool(None)
+        server.shutdown()
+    print(f"Summary: {json.dumps(report['summary'], indent=2)}")
+
+    statuses = {case["id"]: case["status"] for case in report["cases"]}
+    assert statuses == {"0:scop3p": "match", "1:scop3ptm": "mismatch", "2:scop3p": "execution_error",
+                        "2:scop3ptm": "execution_error", "3:scop3p": "match"}
+    overall = report["summary"]["overall"]
+    assert overall["cases"] == 5
+    assert overall["execution_accuracy"] == 0.6 and overall["result_match"] == 0.4
+    assert report["summary"]["scop3p"]["result_match"] == 1.0
+    assert report["summary"]["protein_databases_combined"]["execution_accuracy"] == 0.0
+    # Token counts come from the backend's final chunk
+    assert report["cases"][0]["tokens"] == len(TRAINING[0]["target"].split())
+    assert overall["tokens_total"] > 0 and overall["latency_p50"] <= overall["latency_p99"]
+    assert set(report["config"]["templates"]) == {"sql_scop3p.txt", "sql_scop3ptm.txt"}
+    json.dumps(report)
+
+    # Comparing with a run where the mismatch was fixed and a match regressed
+    baseline = json.loads(json.dumps(report))
+    for case in baseline["cases"]:
+        if case["id"] == "1:scop3ptm":
+            case["status"] = "match"
+        if case["id"] == "3:scop3p":
+            case["status"] = "mismatch"
+    baseline["summary"]["overall"]["result_match"] = 0.2
+    comparison = compare_reports(baseline, report)
+    print(f"Comparison: {comparison['regressions']} {comparison['fixes']}")
+    assert comparison["regressions"] == ["1:scop3ptm"] and comparison["fixes"] == ["3:scop3p"]
+    assert comparison["groups"]["overall"]["result_match"]["delta"] == 0.2
+    assert comparison["groups"]["overall"]["result_match"]["improved"] is True
+
+def test_result_comparison():
+    print("=== Testing Result Comparison ===")
+
+    assert results_match([(1, "a"), (2, "b")], [(2, "b"), (1, "a")])
+    assert not results_match([(1, "a"), (2, "b")], [(2, "b"), (1, "a")], ordered=True)
+    assert not results_match([(1,), (1,)], [(1,)])
+    assert results_match([(0.1 + 0.2,)], [(0.3,)])
+    assert has_top_level_order("SELECT a FROM t ORDER BY a")
+    assert not has_top_level_order("SELECT * FROM (SELECT a FROM t ORDER BY a LIMIT 5) s")
+    assert not has_top_level_order("SELECT a FROM t WHERE b = 'order by'")
+    assert sqlite_dialect("SELECT x::text FROM t WHERE y ILIKE '%a%'") == "SELECT x FROM t WHERE y LIKE '%a%'"
+    assert percentile([3, 1, 2, 4], 50) == 2 and percentile([3, 1, 2, 4], 99) == 4 and percentile([], 50) is None
+
+if __name__ == "__main__":
+    test_sql_eval()
+    test_result_comparison()
@@ -4,7 +4,9 @@ sys.path.append('.')
 from pipeline import build_sql_prompt, clean_sql_response  # Import the cleaning function
 from llm_client import query_llm
 from db_utils import run_sql
+from cassette import recorded
 
+@recorded("sql_generation")
 def test_sql_generation():
     print("=== Testing SQL Generation with Cleaning ===")
     
@@ -0,0 +1,53 @@
+import sys
+sys.path.append('.')
+
+import json
+from sql_index import SqlIndex, build_index, normalize_question, token_key
+
+def test_sql_index():
+    print("=== Testing SQL Index ===")
+    
+    training = [
+        {"question": "what sites are phosphorylated in DDX3X?", "db_id": "scop3p",
+         "target": "SELECT m.uniprot_position FROM modification m WHERE x = 'O00571';"},
+        {"question": "methyl sites in O75390", "db_id": "protein_databases_combined",
+         "target": "SELECT pm.uniprot_position FROM protein_modification pm"},
+        {"question": "broken query", "db_id": "scop3ptm", "target": "SELEC nothing"}
+    ]
+    
+    def fake_execute(database, sql):
+        # protein_modification only exists in scop3ptm
+        if sql.startswith("SELEC ") or ("protein_modification" in sql and database != "scop3ptm"):
+            raise Exception("syntax error")
+        return 3
+    
+    entries = build_index(training, execute=fake_execute)
+    print(f"Entries: {json.dumps(entries, indent=2)}")
+    assert [(e["question"], e["db"]) for e in entries] == [
+        ("what sites are phosphorylated in DDX3X?", "scop3p"),
+        ("methyl sites in O75390", "scop3ptm")
+    ]
+    assert not entries[0]["sql"].endswith(";")
+    
+    index = SqlIndex(entries)
+    assert normalize_question("What sites are phosphorylated in DDX3X") == "what sites are phosphorylated in ddx3x"
+    assert index.lookup("What sites are phosphorylated in DDX3X", "scop3p") == entries[0]["sql"]
+    assert index.lookup("what sites are phosphorylated in DDX3X?", "scop3ptm") is None
+    
+    # Near-exact: word order, filler words and plurals don't matter
+    assert token_key("Methyl site in O75390") == token_key("methyl sites in O75390")
+    assert index.lookup("in O75390, which methyl sites?", "scop3ptm") == entries[1]["sql"]
+    # A different protein never matches
+    assert index.lookup("methyl sites in P04637", "scop3ptm") is None
+    # Question words are kept: asking who is not asking how
+    assert token_key("who detected rnf188 phosphorylation experimentally") != \
+        token_key("how was rnf188 phosphorylation detected experimentally?")
+    assert token_key("How was RNF188 phosphorylation detected experimentally") == \
+        token_key("how was rnf188 phosphorylation detected experimentally?")
+    # So are connectives: "and" is not "or"
+    assert token_key("proteins with phosphorylation and acetylation") != \
+        token_key("proteins with phosphorylation or acetylation")
+    assert token_key("proteins with phosphorylation") != token_key("proteins phosphorylation")
+
+if __name__ == "__main__":
+    test_sql_index()
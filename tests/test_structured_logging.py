@@ -0,0 +1,50 @@
+import sys
+sys.path.append('.')
+
+import os
+import json
+import logging
+import tempfile
+from structured_logging import (setup_logging, shutdown_logging, request_scope, StageClock,
+                                stage_timings, log_body)
+
+def read_records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def test_structured_logging():
+    print("=== Testing Structured Logging ===")
+    
+    path = os.path.join(tempfile.mkdtemp(), "chatbot.log")
+    logger = logging.getLogger("test_structured_logging")
+    
+    try:
+        setup_logging(path, console=False, log_format="json", body_sample_rate=1.0, force=True)
+        with request_scope("req-1"):
+            clock = StageClock()
+            log_body(logger, "LLM raw response", "x" * 5000)
+            clock.lap("classification")
+            logger.info("Request finished", extra={"stages": stage_timings()})
+        logger.info("Outside a request")
+        shutdown_logging()
+        
+        records = read_records(path)
+        print(f"Records: {records}")
+        assert [r["message"] for r in records] == ["LLM raw response (length: 5000)", "Request finished", "Outside a request"]
+        assert records[0]["request_id"] == "req-1" and records[2]["request_id"] is None
+        assert len(records[0]["body"]) < 600
+        assert "classification" in records[1]["stages"]
+        
+        # With sampling off, bodies are dropped but the record is kept
+        os.remove(path)
+        setup_logging(path, console=False, log_format="json", body_sample_rate=0.0, force=True)
+        log_body(logger, "Summary prompt", "secret prompt")
+        shutdown_logging()
+        
+        record = read_records(path)[0]
+        assert "body" not in record and record["body_sampled_out"]
+    finally:
+        shutdown_logging()
+
+if __name__ == "__main__":
+    test_structured_logging()